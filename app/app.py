@@ -1,20 +1,73 @@
+import time
+IMPORT_STARTED = time.perf_counter()
+
+import anyio.to_thread
 from fastapi import FastAPI
-from app.routes import auth, movies
-from database import create_db_and_tables
+from starlette.responses import Response
+from app.routes import auth, images, movies
+from app.catalog_cache import catalog_cache
+from app.metrics import (
+    CONTENT_TYPE, MetricsMiddleware, cache_samples, instrument_engine, limiter_samples, metrics, summary_samples,
+)
+from app.password_hasher import password_hasher
+from app.sql_profiler import SQLProfilerMiddleware, sql_profiler
+from app.startup import startup_timer
+from app.stream_cache import stream_cache
+from app.streaming import io_limiter
+from app.token_cache import token_cache
+from app.watch_buffer import watch_buffer
+from database import create_db_and_tables, db_limiter, engine, read_engine
 from contextlib import asynccontextmanager
-from app_config import BASE_DIR
-from exceptions import VersionFileNotFoundException
+from app_config import (
+    BASE_DIR, METRICS_ENABLED, MOVIE_MEDIA_DIR, SKIP_SCHEMA_SETUP, SQL_PROFILE, WATCH_LIBRARY, WATCHER_STATUS_PATH,
+)
+from exceptions import MetricsDisabledException, VersionFileNotFoundException
 
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
-    create_db_and_tables()
+    # server.py --prod sets up the schema once, before starting its workers.
+    if not SKIP_SCHEMA_SETUP:
+        with startup_timer.step("schema"):
+            create_db_and_tables()
+    # A new catalog version may mean moved or replaced files.
+    catalog_cache.on_change = stream_cache.invalidate
+    with startup_timer.step("password hasher"):
+        await password_hasher.start()
+    watch_buffer.start()
+    watcher = None
+    if WATCH_LIBRARY:
+        with startup_timer.step("library watcher"):
+            from jobs.movie.watcher import LibraryWatcher
+            def on_library_change(delta) -> None:
+                stream_cache.invalidate()
+                catalog_cache.expire()
+            watcher = LibraryWatcher(MOVIE_MEDIA_DIR, on_change=on_library_change)
+            watcher.start()
+    app.state.library_watcher = watcher
+    startup_timer.ready()
     yield
+    if watcher is not None:
+        watcher.stop()
+    watch_buffer.stop()
+    password_hasher.stop()
 
 app = FastAPI(lifespan=lifespan)
 
+if METRICS_ENABLED:
+    app.add_middleware(MetricsMiddleware)
+    instrument_engine(engine, "write")
+    instrument_engine(read_engine, "read")
+if SQL_PROFILE:
+    app.add_middleware(SQLProfilerMiddleware)
+    sql_profiler.install(engine)
+    sql_profiler.install(read_engine)
+
+startup_timer.record("imports", time.perf_counter() - IMPORT_STARTED)
+
 app.include_router(auth.router, prefix="/auth")
 app.include_router(movies.router, prefix="/media")
+app.include_router(images.router, prefix="/images")
 
 @app.get("/")
 def read_root():
@@ -24,6 +77,68 @@ def read_root():
 def health_check():
     return {"status": "ok"} 
 
+@app.get("/health/stream-cache")
+def stream_cache_stats():
+    return stream_cache.summary()
+
+@app.get("/health/catalog-cache")
+def catalog_cache_stats():
+    return catalog_cache.summary()
+
+@app.get("/health/token-cache")
+def token_cache_stats():
+    return token_cache.summary()
+
+@app.get("/health/password-hasher")
+def password_hasher_stats():
+    return password_hasher.summary()
+
+@app.get("/health/sql-profile")
+def sql_profile_stats():
+    return {"enabled": SQL_PROFILE, **sql_profiler.summary()}
+
+@app.get("/health/startup")
+def startup_stats():
+    return startup_timer.summary()
+
+@app.get("/health/watch-buffer")
+def watch_buffer_stats():
+    return watch_buffer.summary()
+
+@app.get("/health/watcher")
+def library_watcher_stats():
+    """This process's library watcher, or the status file of one running elsewhere (server.py --prod)."""
+    watcher = getattr(app.state, "library_watcher", None)
+    if watcher is not None:
+        return {"enabled": True, **watcher.summary()}
+    from jobs.movie.watcher import load_status
+    status = load_status(WATCHER_STATUS_PATH)
+    return {"enabled": status is not None, **(status or {})}
+
+def runtime_samples():
+    """Figures read at scrape time: thread limiters, caches and the background components."""
+    yield from limiter_samples({
+        "default": anyio.to_thread.current_default_thread_limiter(),
+        "db": db_limiter(),
+        "stream_io": io_limiter(),
+    })
+    yield from cache_samples({
+        "catalog": catalog_cache.summary(),
+        "token": token_cache.summary(),
+        "stream": stream_cache.summary(),
+    })
+    yield from summary_samples("password_hasher", password_hasher.summary())
+    yield from summary_samples("watch_buffer", watch_buffer.summary())
+
+metrics.collectors.append(runtime_samples)
+
+@app.get("/metrics", include_in_schema=False)
+async def metrics_endpoint():
+    """Prometheus text exposition (async, so the limiter statistics are read on the event loop)."""
+    if not METRICS_ENABLED:
+        raise MetricsDisabledException
+    return Response(metrics.render(), media_type=CONTENT_TYPE)
+
 @app.get("/version")
 def version():
     try:
@@ -0,0 +1,178 @@
+"""
+In-memory cache of rendered catalog responses.
+
+Clients reload catalog pages far more often than the catalog changes. Each
+catalog response (one page of ``list_movies``, one ``get_movie_details``) is
+kept here as JSON bytes, already gzip- and brotli-compressed, together with a
+weak ETag. The key is the request's filter, sort and page. Entries belong to
+one catalog version: the counter that triggers in the database bump on any
+movie, cast, link or image change (see ``database.ensure_catalog_version``).
+
+The version is read at most once every ``CATALOG_RECHECK_INTERVAL`` seconds,
+so a repeat request costs no query at all: a 304 when the client's ETag still
+matches, the cached bytes otherwise. A change made by another process (the
+importer, the image pipeline) is seen within that interval.
+"""
+import gzip
+import hashlib
+import json
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Hashable, NamedTuple, Optional
+
+from fastapi.encoders import jsonable_encoder
+from starlette.datastructures import Headers
+from starlette.requests import Request
+from starlette.responses import Response
+
+from app_config import CATALOG_CACHE_SIZE, CATALOG_RECHECK_INTERVAL
+from database import AsyncSession, Session, read_catalog_version, run_db
+
+try:
+    import brotli  # type: ignore
+except ImportError:  # optional: responses are offered gzip only
+    brotli = None
+
+MIN_COMPRESS_SIZE: int = 512  # smaller bodies are sent as is
+GZIP_LEVEL: int = 6
+BROTLI_QUALITY: int = 9  # compressed once per catalog version, so it can afford more than on-the-fly
+
+
+class CatalogBody(NamedTuple):
+    version: int
+    etag: str
+    identity: bytes
+    encoded: Dict[str, bytes]  # content-coding -> body
+
+
+def render_body(version: int, payload: Any) -> CatalogBody:
+    identity = json.dumps(jsonable_encoder(payload), separators=(",", ":"), ensure_ascii=False).encode()
+    etag = f'W/"{version}-{hashlib.sha256(identity).hexdigest()[:16]}"'
+    encoded: Dict[str, bytes] = {}
+    if len(identity) >= MIN_COMPRESS_SIZE:
+        encoded["gzip"] = gzip.compress(identity, compresslevel=GZIP_LEVEL, mtime=0)
+        if brotli is not None:
+            encoded["br"] = brotli.compress(identity, quality=BROTLI_QUALITY)
+    return CatalogBody(version, etag, identity, encoded)
+
+
+def _render(db: Session, version: int, fn: Callable[..., Any], *args: Any) -> CatalogBody:
+    return render_body(version, fn(db, *args))
+
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    """Weak comparison, as If-None-Match uses."""
+    if not if_none_match:
+        return False
+    tags = {tag.strip().removeprefix("W/") for tag in if_none_match.split(",")}
+    return "*" in tags or etag.removeprefix("W/") in tags
+
+
+def pick_encoding(accept_encoding: Optional[str], available: Dict[str, bytes]) -> Optional[str]:
+    """The best coding the client accepts that we have a body for (br before gzip)."""
+    if not accept_encoding or not available:
+        return None
+    accepted: Dict[str, float] = {}
+    for item in accept_encoding.split(","):
+        coding, _, params = item.strip().partition(";")
+        quality = 1.0
+        if params.strip().startswith("q="):
+            try:
+                quality = float(params.strip()[2:])
+            except ValueError:
+                quality = 0.0
+        accepted[coding.strip().lower()] = quality
+    candidates = [coding for coding in ("br", "gzip") if coding in available and accepted.get(coding, accepted.get("*", 0.0)) > 0]
+    return max(candidates, key=lambda coding: accepted.get(coding, accepted.get("*", 0.0)), default=None)
+
+
+def catalog_response(body: CatalogBody, request_headers: Headers) -> Response:
+    headers = {"ETag": body.etag, "Cache-Control": "no-cache", "Vary": "Accept-Encoding"}
+    if etag_matches(request_headers.get("if-none-match"), body.etag):
+        return Response(status_code=304, headers=headers)
+    coding = pick_encoding(request_headers.get("accept-encoding"), body.encoded)
+    if coding is None:
+        return Response(body.identity, media_type="application/json", headers=headers)
+    return Response(body.encoded[coding], media_type="application/json", headers={**headers, "Content-Encoding": coding})
+
+
+class CatalogCache:
+    """Bounded LRU of request key -> CatalogBody for the current catalog version."""
+
+    def __init__(self, maxsize: int = CATALOG_CACHE_SIZE, recheck_interval: float = CATALOG_RECHECK_INTERVAL):
+        self.maxsize = maxsize
+        self.recheck_interval = recheck_interval
+        self.on_change: Optional[Callable[[], None]] = None  # called when a new catalog version is seen
+        self.stats: Dict[str, int] = {"hits": 0, "misses": 0, "not_modified": 0, "version_reads": 0, "evictions": 0}
+        self._entries: "OrderedDict[Hashable, CatalogBody]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._version: Optional[int] = None
+        self._checked_at = 0.0
+
+    async def version(self) -> int:
+        """The catalog version, re-read from the database at most once per interval."""
+        now = time.monotonic()
+        if self._version is not None and now - self._checked_at < self.recheck_interval:
+            return self._version
+        self._checked_at = now  # requests arriving meanwhile keep using the current version
+        version = await run_db(read_catalog_version)
+        with self._lock:
+            self.stats["version_reads"] += 1
+            changed = self._version is not None and version != self._version
+            self._version = version
+            if changed:
+                self._entries.clear()
+        if changed and self.on_change is not None:
+            self.on_change()
+        return version
+
+    def expire(self) -> None:
+        """Re-read the version on the next request (after an in-process catalog write)."""
+        self._checked_at = 0.0
+
+    def get(self, key: Hashable, version: int) -> Optional[CatalogBody]:
+        with self._lock:
+            body = self._entries.get(key)
+            if body is None or body.version != version:
+                self.stats["misses"] += 1
+                return None
+            self._entries.move_to_end(key)
+            self.stats["hits"] += 1
+            return body
+
+    def put(self, key: Hashable, body: CatalogBody) -> None:
+        with self._lock:
+            if self._version is not None and body.version != self._version:
+                return  # rendered for a version that has been replaced meanwhile
+            self._entries[key] = body
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+                self.stats["evictions"] += 1
+
+    async def respond(self, request: Request, key: Hashable, db: AsyncSession, fn: Callable[..., Any], *args: Any) -> Response:
+        """Serve ``fn(session, *args)`` from the cache, rendering and caching it on a miss."""
+        version = await self.version()
+        body = self.get(key, version)
+        if body is None:
+            body = await db.run(_render, version, fn, *args)
+            self.put(key, body)
+        elif etag_matches(request.headers.get("if-none-match"), body.etag):
+            with self._lock:
+                self.stats["not_modified"] += 1
+        return catalog_response(body, request.headers)
+
+    def summary(self) -> Dict[str, Any]:
+        with self._lock:
+            lookups = self.stats["hits"] + self.stats["misses"]
+            return {
+                **self.stats,
+                "version": self._version,
+                "size": len(self._entries),
+                "maxsize": self.maxsize,
+                "hit_ratio": round(self.stats["hits"] / lookups, 4) if lookups else 0.0,
+            }
+
+
+catalog_cache = CatalogCache()
@@ -0,0 +1,319 @@
+"""
+Request, database and streaming metrics in the Prometheus text format.
+
+Recording has to stay cheap enough to leave on in production, so nothing on
+the request path takes a lock. Every thread writes to its own shard: plain
+dicts of counters and histogram buckets that only that thread mutates. The
+lock is taken once per thread, to register its shard. ``GET /metrics`` adds
+the shards up when it is scraped. Worker threads come and go (anyio retires
+idle ones), so the shards of threads that have exited are folded into one
+retired shard whenever a shard is registered or the metrics are scraped.
+
+* MetricsMiddleware (pure ASGI) times every request by route template and
+  counts in-flight requests.
+* SQLAlchemy cursor events count queries and their time per engine. A context
+  variable set by the middleware attributes them to the request; it follows
+  the request into the DB executor threads.
+* MediaFileResponse reports active streams and bytes sent per movie.
+* Thread limiter usage, cache hit ratios and the other components'
+  ``summary()`` figures are read at scrape time.
+"""
+import threading
+import time
+from bisect import bisect_left
+from contextvars import ContextVar
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+
+import anyio
+from sqlalchemy import Engine, event
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from app_config import METRICS_MAX_MOVIES
+
+Labels = Tuple[Tuple[str, str], ...]
+
+LATENCY_BUCKETS: Tuple[float, ...] = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+QUERY_COUNT_BUCKETS: Tuple[float, ...] = (0, 1, 2, 3, 5, 10, 20, 50, 100)
+CONTENT_TYPE: str = "text/plain; version=0.0.4; charset=utf-8"
+UNMATCHED_ROUTE: str = "<unmatched>"
+OTHER_MOVIES: str = "other"  # label for movies beyond METRICS_MAX_MOVIES
+
+HELP: Dict[str, Tuple[str, str]] = {
+    "velofy_http_requests_total": ("counter", "Requests by route, method and status."),
+    "velofy_http_request_duration_seconds": ("histogram", "Time from request to the end of the response, by route."),
+    "velofy_http_requests_in_flight": ("gauge", "Requests being handled right now."),
+    "velofy_http_request_db_queries": ("histogram", "SQL statements run per request, by route."),
+    "velofy_http_request_db_seconds": ("histogram", "Time spent in SQL per request, by route."),
+    "velofy_db_queries_total": ("counter", "SQL statements run, by engine."),
+    "velofy_db_query_seconds_total": ("counter", "Time spent in SQL, by engine."),
+    "velofy_stream_bytes_total": ("counter", "Media bytes sent, by movie."),
+    "velofy_streams_active": ("gauge", "Media responses currently sending a body."),
+    "velofy_thread_limiter_busy": ("gauge", "Threads in use, by limiter."),
+    "velofy_thread_limiter_waiting": ("gauge", "Tasks queued for a thread, by limiter."),
+    "velofy_thread_limiter_size": ("gauge", "Threads a limiter allows."),
+    "velofy_cache_lookups_total": ("counter", "Cache lookups, by cache and result."),
+    "velofy_cache_hit_ratio": ("gauge", "Hits over lookups since start, by cache."),
+}
+
+
+class _Shard:
+    """One thread's metrics. Only the owning thread writes to it."""
+    __slots__ = ("counters", "histograms")
+
+    def __init__(self):
+        self.counters: Dict[Tuple[str, Labels], float] = {}
+        # key -> [count per bucket..., count above the last bucket, sum]
+        self.histograms: Dict[Tuple[str, Labels], List[float]] = {}
+
+    def add(self, other: "_Shard") -> None:
+        """Add ``other``'s figures to this shard. Dict copies are atomic under the GIL, so its writer never waits."""
+        for key, value in other.counters.copy().items():
+            self.counters[key] = self.counters.get(key, 0.0) + value
+        for key, values in other.histograms.copy().items():
+            total = self.histograms.setdefault(key, [0.0] * len(values))
+            for index, value in enumerate(list(values)):
+                total[index] += value
+
+
+class RequestStats:
+    """Per-request totals the DB listeners add to."""
+    __slots__ = ("queries", "db_seconds")
+
+    def __init__(self):
+        self.queries = 0
+        self.db_seconds = 0.0
+
+
+_request_stats: ContextVar[Optional[RequestStats]] = ContextVar("request_stats", default=None)
+
+
+class Metrics:
+    def __init__(self, max_movies: int = METRICS_MAX_MOVIES):
+        self.max_movies = max_movies
+        self.buckets: Dict[str, Tuple[float, ...]] = {
+            "velofy_http_request_duration_seconds": LATENCY_BUCKETS,
+            "velofy_http_request_db_queries": QUERY_COUNT_BUCKETS,
+            "velofy_http_request_db_seconds": LATENCY_BUCKETS,
+        }
+        # Called at scrape time for figures that are read rather than recorded.
+        self.collectors: List[Callable[[], Iterable[Tuple[str, Labels, float]]]] = []
+        self._local = threading.local()
+        self._shards: List[Tuple[threading.Thread, _Shard]] = []  # live threads' shards, with their thread
+        self._retired = _Shard()  # the figures of threads that have exited
+        self._lock = threading.Lock()  # guards _shards, _retired and _movies
+        self._movies: set = set()  # movie labels handed out so far
+
+    def _shard(self) -> _Shard:
+        try:
+            return self._local.shard
+        except AttributeError:
+            shard = self._local.shard = _Shard()
+            with self._lock:
+                self._retire_dead_shards()
+                self._shards.append((threading.current_thread(), shard))
+            return shard
+
+    def _retire_dead_shards(self) -> None:
+        """Fold the shards of exited threads into ``_retired``; the caller holds ``_lock``."""
+        live: List[Tuple[threading.Thread, _Shard]] = []
+        for thread, shard in self._shards:
+            if thread.is_alive():
+                live.append((thread, shard))
+            else:
+                self._retired.add(shard)
+        self._shards = live
+
+    # ----- recording -----
+
+    def inc(self, name: str, labels: Labels = (), value: float = 1.0) -> None:
+        counters = self._shard().counters
+        key = (name, labels)
+        counters[key] = counters.get(key, 0.0) + value
+
+    def observe(self, name: str, labels: Labels, value: float) -> None:
+        histograms = self._shard().histograms
+        key = (name, labels)
+        buckets = self.buckets[name]
+        values = histograms.get(key)
+        if values is None:
+            values = histograms[key] = [0.0] * (len(buckets) + 2)
+        values[bisect_left(buckets, value)] += 1
+        values[-1] += value
+
+    def movie_label(self, movie_id: int) -> str:
+        """The movie id as a label, or ``other`` once METRICS_MAX_MOVIES movies have their own series."""
+        label = str(movie_id)
+        if label in self._movies:
+            return label
+        with self._lock:
+            if len(self._movies) < self.max_movies:
+                self._movies.add(label)
+                return label
+        return OTHER_MOVIES
+
+    def stream_started(self) -> None:
+        self.inc("_streams_started")
+
+    def stream_finished(self) -> None:
+        self.inc("_streams_finished")
+
+    def stream_bytes(self, movie_id: int, sent: int) -> None:
+        self.inc("velofy_stream_bytes_total", (("movie", self.movie_label(movie_id)),), sent)
+
+    # ----- collection -----
+
+    def snapshot(self) -> Tuple[Dict[Tuple[str, Labels], float], Dict[Tuple[str, Labels], List[float]]]:
+        """All shards added up, the retired ones included. Writers never have to wait."""
+        total = _Shard()
+        with self._lock:
+            self._retire_dead_shards()
+            shards = [shard for _, shard in self._shards]
+            total.add(self._retired)
+        for shard in shards:
+            total.add(shard)
+        return total.counters, total.histograms
+
+    def render(self) -> str:
+        counters, histograms = self.snapshot()
+        families: Dict[str, List[str]] = {}
+
+        def add(family: str, name: str, labels: Labels, value: float) -> None:
+            families.setdefault(family, []).append(f"{name}{format_labels(labels)} {format_value(value)}")
+
+        for (name, labels), value in sorted(counters.items()):
+            if not name.startswith("_"):
+                add(name, name, labels, value)
+        add("velofy_http_requests_in_flight", "velofy_http_requests_in_flight", (),
+            counters.get(("_requests_started", ()), 0.0) - counters.get(("_requests_finished", ()), 0.0))
+        add("velofy_streams_active", "velofy_streams_active", (),
+            counters.get(("_streams_started", ()), 0.0) - counters.get(("_streams_finished", ()), 0.0))
+
+        for (name, labels), values in sorted(histograms.items()):
+            cumulative = 0.0
+            for bound, count in zip(self.buckets[name], values):
+                cumulative += count
+                add(name, f"{name}_bucket", labels + (("le", format_value(bound)),), cumulative)
+            total = cumulative + values[-2]
+            add(name, f"{name}_bucket", labels + (("le", "+Inf"),), total)
+            add(name, f"{name}_sum", labels, values[-1])
+            add(name, f"{name}_count", labels, total)
+
+        for collect in self.collectors:
+            for name, labels, value in collect():
+                add(name, name, labels, value)
+
+        lines: List[str] = []
+        for family in sorted(families):
+            kind, text = HELP.get(family, ("gauge", ""))
+            if text:
+                lines.append(f"# HELP {family} {text}")
+            lines.append(f"# TYPE {family} {kind}")
+            lines.extend(families[family])
+        return "\n".join(lines) + "\n"
+
+
+def escape_label(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def format_labels(labels: Labels) -> str:
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{key}="{escape_label(str(value))}"' for key, value in labels) + "}"
+
+
+def format_value(value: float) -> str:
+    return str(int(value)) if float(value).is_integer() else repr(float(value))
+
+
+metrics = Metrics()
+
+
+# ================= Requests =================
+class MetricsMiddleware:
+    """Times each HTTP request and counts it by route template, method and status."""
+
+    def __init__(self, app: ASGIApp):
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        status = "500"
+
+        async def send_with_status(message: Message) -> None:
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = str(message["status"])
+            await send(message)
+
+        stats = RequestStats()
+        token = _request_stats.set(stats)
+        metrics.inc("_requests_started")
+        started = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            elapsed = time.perf_counter() - started
+            _request_stats.reset(token)
+            metrics.inc("_requests_finished")
+            route = scope.get("route")
+            path = getattr(route, "path", None) or UNMATCHED_ROUTE
+            method = scope["method"]
+            metrics.inc("velofy_http_requests_total", (("route", path), ("method", method), ("status", status)))
+            labels = (("route", path), ("method", method))
+            metrics.observe("velofy_http_request_duration_seconds", labels, elapsed)
+            metrics.observe("velofy_http_request_db_queries", labels, stats.queries)
+            metrics.observe("velofy_http_request_db_seconds", labels, stats.db_seconds)
+
+
+# ================= Database =================
+def instrument_engine(engine: Engine, name: str) -> None:
+    """Count the statements ``engine`` runs and their time, in total and per request."""
+    labels = (("engine", name),)
+
+    @event.listens_for(engine, "before_cursor_execute")
+    def before_cursor_execute(connection, cursor, statement, parameters, context, executemany):
+        connection.info.setdefault("query_started", []).append(time.perf_counter())
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def after_cursor_execute(connection, cursor, statement, parameters, context, executemany):
+        elapsed = time.perf_counter() - connection.info["query_started"].pop()
+        metrics.inc("velofy_db_queries_total", labels)
+        metrics.inc("velofy_db_query_seconds_total", labels, elapsed)
+        stats = _request_stats.get()
+        if stats is not None:
+            stats.queries += 1
+            stats.db_seconds += elapsed
+
+    @event.listens_for(engine, "handle_error")
+    def handle_error(exception_context):
+        connection = exception_context.connection
+        if connection is not None and connection.info.get("query_started"):
+            connection.info["query_started"].pop()
+
+
+# ================= Scrape-time figures =================
+def limiter_samples(limiters: Dict[str, anyio.CapacityLimiter]) -> Iterable[Tuple[str, Labels, float]]:
+    for name, limiter in limiters.items():
+        statistics = limiter.statistics()
+        labels = (("limiter", name),)
+        yield "velofy_thread_limiter_busy", labels, statistics.borrowed_tokens
+        yield "velofy_thread_limiter_waiting", labels, statistics.tasks_waiting
+        yield "velofy_thread_limiter_size", labels, statistics.total_tokens
+
+
+def cache_samples(summaries: Dict[str, Dict[str, Any]]) -> Iterable[Tuple[str, Labels, float]]:
+    for name, summary in summaries.items():
+        labels = (("cache", name),)
+        yield "velofy_cache_lookups_total", labels + (("result", "hit"),), summary["hits"]
+        yield "velofy_cache_lookups_total", labels + (("result", "miss"),), summary["misses"]
+        yield "velofy_cache_hit_ratio", labels, summary["hit_ratio"]
+
+
+def summary_samples(component: str, summary: Dict[str, Any]) -> Iterable[Tuple[str, Labels, float]]:
+    """The numeric fields of a component's ``summary()`` as ``velofy_<component>_<field>`` gauges."""
+    for field, value in summary.items():
+        if isinstance(value, (int, float)) and not isinstance(value, bool):
+            yield f"velofy_{component}_{field}", (), value
@@ -0,0 +1,206 @@
+"""
+Password hashing on a dedicated process pool.
+
+bcrypt is slow on purpose, and it holds the GIL for much of that time. If it
+runs on Starlette's threadpool, a burst of logins slows every stream and
+catalog request in the process. PasswordHasher sends hashes and verifications
+to a small pool of worker processes. At most ``PASSWORD_HASH_WORKERS`` run at
+once and ``PASSWORD_HASH_QUEUE`` more may wait. Anything beyond that is turned
+away with a 503 right away, before it can pile up.
+
+The bcrypt cost comes from ``BCRYPT_ROUNDS``. When that is 0, it is calibrated
+once: the highest cost whose hash still takes at most ``BCRYPT_TARGET_MS`` on
+this machine. The result is saved to ``BCRYPT_CALIBRATION_PATH`` and reused by
+later starts, so the cost does not drift with the load at startup. The first
+calibration runs in the background once the server is up, and until it ends
+hashes use ``DEFAULT_ROUNDS``. On login, hashes made with a lower cost are
+re-hashed (see ``needs_rehash``); stronger ones are left alone. ``server.py
+--prod`` calibrates (or loads the saved cost) before starting its workers, and
+hands them the result in ``BCRYPT_ROUNDS``.
+
+If a worker process dies, the pool is replaced and the call tried once more.
+"""
+import asyncio
+import json
+import multiprocessing
+import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from pathlib import Path
+from typing import Any, Callable, Dict, Optional
+
+import click
+from passlib.hash import bcrypt
+
+from app_config import (
+    BCRYPT_CALIBRATION_PATH, BCRYPT_ROUNDS, BCRYPT_TARGET_MS, PASSWORD_HASH_WORKERS, PASSWORD_HASH_QUEUE,
+)
+from exceptions import AuthBusyException
+
+MIN_ROUNDS: int = 10
+MAX_ROUNDS: int = 16
+DEFAULT_ROUNDS: int = 12  # until calibrated
+
+
+# ----- run in the worker processes -----
+
+def _hash(password: str, rounds: int) -> str:
+    return bcrypt.using(rounds=rounds).hash(password)
+
+def _verify(password: str, password_hash: str) -> bool:
+    try:
+        return bcrypt.verify(password, password_hash)
+    except ValueError:  # not a bcrypt hash
+        return False
+
+def calibrate_rounds(target_ms: float) -> int:
+    """The highest cost whose hash takes no longer than ``target_ms`` (each step doubles the time)."""
+    rounds = MIN_ROUNDS
+    while rounds < MAX_ROUNDS:
+        started = time.perf_counter()
+        _hash("calibration", rounds)
+        elapsed_ms = (time.perf_counter() - started) * 1000
+        if elapsed_ms * 2 > target_ms:
+            break
+        rounds += 1
+    return rounds
+
+
+def load_calibration(target_ms: float, path: Path = BCRYPT_CALIBRATION_PATH) -> Optional[int]:
+    """The cost saved by an earlier calibration to the same target, if any."""
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            data = json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return None
+    if data.get("target_ms") != target_ms or not MIN_ROUNDS <= data.get("rounds", 0) <= MAX_ROUNDS:
+        return None
+    return data["rounds"]
+
+def save_calibration(rounds: int, target_ms: float, path: Path = BCRYPT_CALIBRATION_PATH) -> None:
+    try:
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump({"rounds": rounds, "target_ms": target_ms}, f)
+    except OSError as e:
+        click.secho(f"[WARN] Could not save the bcrypt cost to {path}: {e}", fg="yellow")
+
+def calibrated_rounds(target_ms: float) -> int:
+    """The saved cost for ``target_ms``, calibrating (and saving) it the first time."""
+    rounds = load_calibration(target_ms)
+    if rounds is None:
+        rounds = calibrate_rounds(target_ms)
+        save_calibration(rounds, target_ms)
+    return rounds
+
+
+def hash_rounds(password_hash: str) -> Optional[int]:
+    """The cost of a ``$2b$12$...`` hash, or None if it is not bcrypt."""
+    try:
+        return int(password_hash.split("$")[2])
+    except (IndexError, ValueError):
+        return None
+
+
+class PasswordHasher:
+    def __init__(
+        self,
+        workers: int = PASSWORD_HASH_WORKERS,
+        max_queue: int = PASSWORD_HASH_QUEUE,
+        rounds: int = BCRYPT_ROUNDS,
+        target_ms: float = BCRYPT_TARGET_MS,
+    ):
+        self.workers = max(1, workers)
+        self.max_queue = max(0, max_queue)
+        self.target_ms = target_ms
+        self.rounds = rounds or DEFAULT_ROUNDS
+        self._calibrate = not rounds
+        self.stats: Dict[str, int] = {"hashed": 0, "verified": 0, "rehashed": 0, "rejected": 0, "pool_restarts": 0}
+        self._pool: Optional[ProcessPoolExecutor] = None
+        self._pending = 0  # running + queued; only touched on the event loop
+        self._calibration: Optional[asyncio.Future] = None
+
+    def _executor(self) -> ProcessPoolExecutor:
+        if self._pool is None:
+            # spawn: forking a server process that already runs threads is unsafe.
+            self._pool = ProcessPoolExecutor(self.workers, mp_context=multiprocessing.get_context("spawn"))
+        return self._pool
+
+    async def _submit(self, fn: Callable[..., Any], *args: Any) -> Any:
+        if self._pending >= self.workers + self.max_queue:
+            self.stats["rejected"] += 1
+            raise AuthBusyException
+        self._pending += 1
+        try:
+            for retry in (True, False):
+                pool = self._executor()
+                try:
+                    return await asyncio.wrap_future(pool.submit(fn, *args))
+                except BrokenProcessPool:
+                    # A worker died (OOM killer, crash): the whole pool is unusable. Concurrent
+                    # callers see the same pool break; only the first one replaces it.
+                    if pool is self._pool:
+                        self._pool = None
+                        pool.shutdown(wait=False, cancel_futures=True)
+                        self.stats["pool_restarts"] += 1
+                        click.secho("[WARN] Password hashing worker died, restarting the pool", fg="yellow")
+                    if not retry:
+                        raise AuthBusyException
+        finally:
+            self._pending -= 1
+
+    async def hash(self, password: str) -> str:
+        password_hash = await self._submit(_hash, password, self.rounds)
+        self.stats["hashed"] += 1
+        return password_hash
+
+    async def verify(self, password: str, password_hash: str) -> bool:
+        verified = await self._submit(_verify, password, password_hash)
+        self.stats["verified"] += 1
+        return verified
+
+    def needs_rehash(self, password_hash: str) -> bool:
+        """Only upgrade: a hash stronger than the current cost (e.g. from before a recalibration) is kept."""
+        return (hash_rounds(password_hash) or 0) < self.rounds
+
+    # ----- lifecycle -----
+
+    async def start(self) -> None:
+        """Start the workers; unless the cost is set or saved, calibrate it in the background (FastAPI lifespan)."""
+        executor = self._executor()
+        if self._calibrate:
+            saved = load_calibration(self.target_ms)
+            if saved is not None:
+                self.rounds = saved
+                self._calibrate = False
+        if self._calibrate:
+            self._calibration = asyncio.wrap_future(executor.submit(calibrate_rounds, self.target_ms))
+            self._calibration.add_done_callback(self._calibrated)
+
+    def _calibrated(self, future: asyncio.Future) -> None:
+        if future.cancelled() or future.exception() is not None:
+            return  # keep DEFAULT_ROUNDS
+        self.rounds = future.result()
+        self._calibrate = False
+        save_calibration(self.rounds, self.target_ms)
+        click.secho(f"🔐 bcrypt cost {self.rounds} (target {self.target_ms:.0f} ms)", fg="bright_blue")
+
+    def stop(self) -> None:
+        if self._calibration is not None and not self._calibration.done():
+            self._calibration.cancel()
+        if self._pool is not None:
+            # Wait for the hash (or calibration) in progress: uvicorn re-raises SIGTERM once the
+            # lifespan ends, and workers still busy then would outlive the server.
+            self._pool.shutdown(wait=True, cancel_futures=True)
+            self._pool = None
+
+    def summary(self) -> Dict[str, int]:
+        return {
+            **self.stats,
+            "pending": self._pending,
+            "workers": self.workers,
+            "max_queue": self.max_queue,
+            "rounds": self.rounds,
+        }
+
+
+password_hasher = PasswordHasher()
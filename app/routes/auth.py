@@ -1,12 +1,13 @@
 from fastapi import APIRouter, Depends
 from fastapi.security import OAuth2PasswordBearer
-from passlib.context import CryptContext
 from datetime import datetime, timedelta, timezone
 from jose import JWTError, jwt
 from typing import Optional, Dict, Any
 
-from sqlmodel import select
-from database import SessionDep
+from sqlmodel import select, update
+from app.password_hasher import password_hasher
+from app.token_cache import token_cache
+from database import AsyncSessionDep, Session
 from models import User
 from schemas.auth import (
     UserRequestSchema, UserResponseSchema, 
@@ -23,41 +24,96 @@ from exceptions import (
 )
 
 router = APIRouter()
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="/auth/login")
 
 # ======================= UTILITY FUNCTIONS =======================
 
-def verify_password(plain_password: str, password_hash: str) -> bool:
-    return pwd_context.verify(plain_password, password_hash)
-
-def get_password_hash(password: str) -> str:
-    return pwd_context.hash(password)
-
 def create_access_token(data: Dict[str, Any], expires_delta: Optional[timedelta] = None) -> str:
     to_encode = data.copy()
     expire = datetime.now(timezone.utc) + (expires_delta or timedelta(minutes=15))
     to_encode.update({"exp": expire})
     return jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
 
-def get_user_by_username(username: str, db: SessionDep) -> Optional[User]:
+def get_user_by_username(db: Session, username: str) -> Optional[User]:
     return db.exec(select(User).where(User.username == username)).first()
 
-def authenticate_user(username: str, password: str, db: SessionDep) -> Optional[User]:
-    user = get_user_by_username(username, db)
-    if user and verify_password(password, user.password_hash):
-        return user
-    return None
+async def authenticate_user(username: str, password: str, db: AsyncSessionDep) -> Optional[User]:
+    user = await db.run(get_user_by_username, username)
+    if not user or not await password_hasher.verify(password, user.password_hash):
+        return None
+    if password_hasher.needs_rehash(user.password_hash):
+        # The bcrypt cost changed since this hash was made; upgrade it while we have the password.
+        new_hash = await password_hasher.hash(password)
+        if await db.run(replace_password_hash, user.id, user.password_hash, new_hash):
+            password_hasher.stats["rehashed"] += 1
+    return user
+
+# The functions below run on the DB executor and build the response schema there,
+# while the session can still load the user's relationships.
+
+def load_token_user(db: Session, username: str, user_id: Optional[int], version: int) -> UserResponseSchema:
+    user = get_user_by_username(db, username)
+    # A token names its user by username; the id guards against a name being reused.
+    if not user or (user_id is not None and user.id != user_id):
+        raise InvalidCredentialsException
+    if user.token_version != version:
+        raise InvalidTokenException  # revoked
+    return UserResponseSchema.model_validate(user)
+
+def create_user(db: Session, user: User) -> UserResponseSchema:
+    return UserResponseSchema.model_validate(db.add_user(user))
+
+def save_user_details(db: Session, user_id: int, user: UserRequestSchema) -> Optional[UserResponseSchema]:
+    db_user = db.get(User, user_id)
+    if not db_user:
+        return None
+    db_user.username = user.username
+    db_user.first_name = user.first_name
+    db_user.last_name = user.last_name
+    db_user.email = user.email
+    db_user.phone = user.phone
+    db_user.address = user.address
+    db_user.date_of_birth = user.date_of_birth
+    db.commit()
+    return UserResponseSchema.model_validate(db_user)
+
+def replace_password_hash(db: Session, user_id: int, old_hash: str, new_hash: str) -> bool:
+    """Swap in a re-hashed password, unless the password was changed meanwhile."""
+    result = db.exec(
+        update(User).where(User.id == user_id, User.password_hash == old_hash).values(password_hash=new_hash)
+    )
+    db.commit()
+    return result.rowcount == 1
+
+def revoke_tokens(db: Session, user_id: int) -> bool:
+    db_user = db.get(User, user_id)
+    if not db_user:
+        return False
+    db_user.token_version += 1
+    db.commit()
+    return True
+
+def remove_user(db: Session, user_id: int) -> Optional[UserResponseSchema]:
+    db_user = db.get(User, user_id)
+    if not db_user:
+        return None
+    db.delete(db_user)
+    db.commit()
+    return UserResponseSchema.model_validate(db_user)
 
 # ======================= ROUTES =======================
 
 @router.post("/login", response_model=UserLoginOutputSchema)
-def login(user: UserLoginInputSchema, db: SessionDep) -> UserLoginOutputSchema:
-    authenticated_user: "Optional[User]" = authenticate_user(user.username, user.password, db)
+async def login(user: UserLoginInputSchema, db: AsyncSessionDep) -> UserLoginOutputSchema:
+    authenticated_user: "Optional[User]" = await authenticate_user(user.username, user.password, db)
     if not authenticated_user:
         raise InvalidCredentialsException
     access_token = create_access_token(
-        data={"username": authenticated_user.username},
+        data={
+            "username": authenticated_user.username,
+            "uid": authenticated_user.id,
+            "ver": authenticated_user.token_version,
+        },
         expires_delta=timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
     )
     return UserLoginOutputSchema(
@@ -66,14 +122,14 @@ def login(user: UserLoginInputSchema, db: SessionDep) -> UserLoginOutputSchema:
     )
 
 @router.post("/register", response_model=UserResponseSchema)
-def register(user: UserRequestSchema, db: SessionDep) -> UserResponseSchema:
-    existing_user = get_user_by_username(user.username, db)
+async def register(user: UserRequestSchema, db: AsyncSessionDep) -> UserResponseSchema:
+    existing_user = await db.run(get_user_by_username, user.username)
     if existing_user:
         raise UserAlreadyExistsException(user.username)
     
     db_user = User(
         username=user.username,
-        password_hash=get_password_hash(user.password),
+        password_hash=await password_hasher.hash(user.password),
         first_name=user.first_name,
         last_name=user.last_name,
         email=user.email,
@@ -82,12 +138,16 @@ def register(user: UserRequestSchema, db: SessionDep) -> UserResponseSchema:
         date_of_birth=user.date_of_birth,
         created_at=datetime.now(timezone.utc)
     )
-    db.add_user(db_user)
-    return UserResponseSchema.model_validate(db_user)
+    return await db.run(create_user, db_user)
 
 # ======================= AUTH DEPENDENCY =======================
 
-def get_current_user(db: SessionDep, token: str = Depends(oauth2_scheme)) -> UserResponseSchema:
+async def get_current_user(db: AsyncSessionDep, token: str = Depends(oauth2_scheme)) -> UserResponseSchema:
+    # Tokens verified recently skip the decode and the query; see app/token_cache.py.
+    await token_cache.sync()
+    cached = token_cache.get(token)
+    if cached is not None:
+        return cached
     try:
         payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
         username: Optional[str] = payload.get("username")
@@ -101,45 +161,49 @@ def get_current_user(db: SessionDep, token: str = Depends(oauth2_scheme)) -> Use
     if datetime.now(timezone.utc) > datetime.fromtimestamp(exp, tz=timezone.utc):
         raise TokenExpiredException
 
-    user = get_user_by_username(username, db)
-    if not user:
-        raise InvalidCredentialsException
-    return UserResponseSchema.model_validate(user)
+    user_id, version = payload.get("uid"), payload.get("ver", 0)
+    if not isinstance(version, int) or (user_id is not None and not isinstance(user_id, int)):
+        raise InvalidTokenException
+
+    stamp = token_cache.stamp()
+    user = await db.run(load_token_user, username, user_id, version)
+    token_cache.put(token, user, exp, stamp)
+    return user
 
 @router.get("/me", response_model=UserResponseSchema)
-def read_users_me(current_user: UserResponseSchema = Depends(get_current_user)) -> UserResponseSchema:
+async def read_users_me(current_user: UserResponseSchema = Depends(get_current_user)) -> UserResponseSchema:
     return current_user
 
 
+@router.post("/logout")
+async def logout(
+    db: AsyncSessionDep,
+    current_user: UserResponseSchema = Depends(get_current_user),
+) -> Dict[str, str]:
+    """Revoke every token issued to the current user, on all devices."""
+    if not await db.run(revoke_tokens, current_user.id):
+        raise InvalidCredentialsException
+    return {"status": "revoked"}
+
 @router.put("/me", response_model=UserResponseSchema)
-def update_user(
-    db: SessionDep,
+async def update_user(
+    db: AsyncSessionDep,
     user: UserRequestSchema, 
     current_user: UserResponseSchema = Depends(get_current_user), 
 ) -> UserResponseSchema:
     """Update user details."""
-    db_user = db.get(User, current_user.id)
+    db_user = await db.run(save_user_details, current_user.id, user)
     if not db_user:
         raise InvalidCredentialsException
-    db_user.username = user.username
-    db_user.first_name = user.first_name
-    db_user.last_name = user.last_name
-    db_user.email = user.email
-    db_user.phone = user.phone
-    db_user.address = user.address
-    db_user.date_of_birth = user.date_of_birth
-    db.commit()
-    return UserResponseSchema.model_validate(db_user)
+    return db_user
 
 
 @router.delete("/me", response_model=UserResponseSchema)
-def delete_user(
-    db: SessionDep,
+async def delete_user(
+    db: AsyncSessionDep,
     current_user: UserResponseSchema = Depends(get_current_user), 
 ) -> UserResponseSchema:
-    db_user = db.get(User, current_user.id)
+    db_user = await db.run(remove_user, current_user.id)
     if not db_user:
         raise InvalidCredentialsException
-    db.delete(db_user)
-    db.commit()
-    return UserResponseSchema.model_validate(db_user)
\ No newline at end of file
+    return db_user
\ No newline at end of file
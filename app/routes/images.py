@@ -0,0 +1,46 @@
+import os
+from typing import Dict, Iterable
+
+from fastapi import APIRouter, Request
+from sqlmodel import select
+
+from app.streaming import MediaFileResponse
+from app_config import IMAGE_MAX_AGE
+from database import SessionDep
+from exceptions import ImageNotFoundException
+from jobs.image.store import IMAGE_FORMATS, IMAGE_VARIANTS, is_content_hash, variant_path, variant_url
+from models import ImageAsset
+
+router = APIRouter()
+
+# ======================= UTILITY FUNCTIONS =======================
+
+def local_image_urls(db: SessionDep, urls: Iterable[str]) -> Dict[str, str]:
+    """Map the cached ones among ``urls`` to their content hash, in one query."""
+    wanted = {url for url in urls if url}
+    if not wanted:
+        return {}
+    return dict(db.exec(select(ImageAsset.url, ImageAsset.content_hash).where(ImageAsset.url.in_(wanted))).all())
+
+def image_link(url: str, hashes: Dict[str, str], variant: str) -> str:
+    """The local URL of a cached image, or the original URL while it is not cached yet."""
+    content_hash = hashes.get(url) if url else None
+    return variant_url(content_hash, variant) if content_hash else url
+
+# ======================= ROUTES =======================
+
+@router.api_route("/{content_hash}/{name}", methods=["GET", "HEAD"])
+async def get_image(content_hash: str, name: str, request: Request):
+    """Serve a resized poster or headshot; the URL names its content, so it never changes."""
+    variant, _, fmt = name.partition(".")
+    if not is_content_hash(content_hash) or variant not in IMAGE_VARIANTS or fmt not in IMAGE_FORMATS:
+        raise ImageNotFoundException
+    path = variant_path(content_hash, variant, fmt)
+    try:
+        stat = os.stat(path)
+    except OSError:
+        raise ImageNotFoundException
+    return MediaFileResponse(
+        str(path), request.headers, method=request.method, stat=stat, media_type=IMAGE_FORMATS[fmt],
+        headers={"cache-control": f"public, max-age={IMAGE_MAX_AGE}, immutable"},
+    )
@@ -1,51 +1,155 @@
-from fastapi import APIRouter, Query
+from fastapi import APIRouter, Query, Request
 from fastapi.responses import FileResponse
+from sqlalchemy import tuple_
+from sqlalchemy.orm import selectinload
 from sqlmodel import select, desc, asc
-from typing import Dict, Optional, Any
+from typing import Dict, Optional, Any, List, Tuple
+import base64
+import binascii
+import json
 import os
+import click
 from app_config import MEDIA_DIR
-from database import SessionDep
-from datetime import datetime, timezone
-from models import WatchHistory, Movie
-# from sqlalchemy import String
+from app.catalog_cache import catalog_cache
+from app.routes.images import image_link, local_image_urls
+from app.stream_cache import stream_cache
+from app.watch_buffer import watch_buffer
+from app.streaming import MediaFileResponse, is_regular_file
+from database import AsyncSessionDep, Session, run_db
+from datetime import datetime
+from models import ImageAsset, WatchHistory, Movie, MovieCastLink, MovieSimilarity, MOVIE_SORT_FIELDS
+from schemas.movies import MovieSearchSchema, MovieSearchResultSchema, MovieSearchHitSchema
+from jobs.image.store import HEADSHOT_VARIANT, POSTER_VARIANT, variant_url
+from search import match_clause, search_movies as run_search, suggest_titles
 from exceptions import (
     FileNotFoundException,
     MovieNotFoundException, 
     InvalidFileLocationException,
     InvalidSortingFieldException,
+    InvalidCursorException,
     SubtitleNotFoundException
 )
 
 router = APIRouter()
 
+# Loads cast links and their Cast rows in two extra SELECT ... IN queries,
+# no matter how many movies are on the page.
+MOVIE_CAST_OPTIONS = (selectinload(Movie.cast_links).selectinload(MovieCastLink.cast),)
+
+# Cursor fields that hold datetimes (sent as ISO strings).
+DATETIME_CURSOR_FIELDS = ("added_date", "watched_at")
+# Titles watched this far (percent) are finished and leave "continue watching".
+FINISHED_PROGRESS = 95.0
+
+# ======================= UTILITY FUNCTIONS =======================
+
+def encode_cursor(sort_by: str, sort_order: str, movie: Movie) -> str:
+    value = getattr(movie, sort_by)
+    if isinstance(value, datetime):
+        value = value.isoformat()
+    payload = json.dumps({"s": sort_by, "o": sort_order, "v": value, "id": movie.id}, separators=(",", ":"))
+    return base64.urlsafe_b64encode(payload.encode()).decode().rstrip("=")
+
+def decode_cursor(cursor: str, sort_by: str, sort_order: str) -> Tuple[Any, int]:
+    try:
+        payload = json.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+        if payload["s"] != sort_by or payload["o"] != sort_order or not isinstance(payload["id"], int):
+            raise InvalidCursorException
+        value = payload["v"]
+        if sort_by in DATETIME_CURSOR_FIELDS:
+            value = datetime.fromisoformat(value)
+        return value, payload["id"]
+    except (binascii.Error, ValueError, TypeError, KeyError):
+        raise InvalidCursorException
+
+# ======================= ROUTES =======================
+
+# Route handlers are async: validation runs on the event loop and the ORM work
+# in the sync functions below runs on the bounded DB executor (database.run_db).
+
 @router.get("/movies/")
-def list_movies(
-    db: SessionDep,
+async def list_movies(
+    request: Request,
+    db: AsyncSessionDep,
     category: Optional[str] = None,
-    sort_by: Optional[str] = Query("name", enum=["name", "size", "added_date", "rating"]),
+    sort_by: Optional[str] = Query("name", enum=list(MOVIE_SORT_FIELDS)),
     sort_order: Optional[str] = Query("asc", enum=["asc", "desc"]),
-    search: Optional[str] = None
+    search: Optional[str] = None,
+    limit: int = Query(50, ge=1, le=200),
+    cursor: Optional[str] = None,
 ):
-    query = select(Movie)
+    """List movies one keyset page at a time, ordered by (sort_by, id). Served from the catalog cache."""
+    sort_by = sort_by or "name"
+    sort_order = "desc" if sort_order == "desc" else "asc"
+    if sort_by not in MOVIE_SORT_FIELDS:
+        raise InvalidSortingFieldException(sort_by)
+    after = decode_cursor(cursor, sort_by, sort_order) if cursor else None
+    key = ("movies", category, sort_by, sort_order, search, limit, cursor)
+    return await catalog_cache.respond(request, key, db, fetch_movie_page, category, sort_by, sort_order, search, limit, after)
+
+def fetch_movie_page(
+    db: Session,
+    category: Optional[str],
+    sort_by: str,
+    sort_order: str,
+    search: Optional[str],
+    limit: int,
+    after: Optional[Tuple[Any, int]] = None,
+) -> Dict[str, Any]:
+    sort_column = getattr(Movie, sort_by)
+
+    query = select(Movie).options(*MOVIE_CAST_OPTIONS)
 
     if category:
         query = query.where(Movie.category == category)
-    
-    # if search:
-    #     query = query.where(Movie.name.cast(String).ilike(f"%{search}%"))
-    if sort_by:
-        if sort_by not in ["name", "size", "added_date", "rating"]:
-            raise InvalidSortingFieldException(sort_by)
-        sort_column = getattr(Movie, sort_by)
-        if sort_order == "desc":
-            query = query.order_by(desc(sort_column))
-        else:
-            query = query.order_by(asc(sort_column))
-
-    result = db.exec(query).all()
-    return [movie_to_dict(movie) for movie in result]
-
-def movie_to_dict(movie: Movie) -> Dict[str, Any]:
+    if search:
+        query = query.where(match_clause(search))
+    if after:
+        value, last_id = after
+        key = tuple_(sort_column, Movie.id)
+        query = query.where(key < (value, last_id) if sort_order == "desc" else key > (value, last_id))
+    if sort_order == "desc":
+        query = query.order_by(desc(sort_column), desc(Movie.id))
+    else:
+        query = query.order_by(asc(sort_column), asc(Movie.id))
+
+    result: List[Movie] = list(db.exec(query.limit(limit + 1)).all())
+    next_cursor = None
+    if len(result) > limit:
+        result = result[:limit]
+        next_cursor = encode_cursor(sort_by, sort_order, result[-1])
+    images = catalog_images(db, result)
+    return {
+        "items": [movie_to_dict(movie, images) for movie in result],
+        "next_cursor": next_cursor,
+    }
+
+def catalog_images(db: Session, movies: List[Movie]) -> Dict[str, str]:
+    """Cached posters and headshots for a page of movies, looked up in one query."""
+    return local_image_urls(db, [movie.thumbnail for movie in movies] + [
+        link.cast.image_url for movie in movies for link in movie.cast_links if link.cast is not None
+    ])
+
+# Columns for compact movie cards in lists; queries selecting them join Movie
+# and outer-join ImageAsset on the thumbnail URL.
+MOVIE_SUMMARY_COLUMNS = (
+    Movie.id.label("movie_id"), Movie.name, Movie.thumbnail, Movie.duration, Movie.rating,
+    Movie.category, Movie.published_year, ImageAsset.content_hash,
+)
+
+def movie_summary(row: Any) -> Dict[str, Any]:
+    return {
+        "movie_id": row.movie_id,
+        "name": row.name,
+        "thumbnail": variant_url(row.content_hash, POSTER_VARIANT) if row.content_hash else row.thumbnail,
+        "duration": row.duration,
+        "rating": row.rating,
+        "category": row.category,
+        "published_year": row.published_year,
+    }
+
+def movie_to_dict(movie: Movie, images: Optional[Dict[str, str]] = None) -> Dict[str, Any]:
+    images = images or {}
     return {
         "id": movie.id,
         "name": movie.name,
@@ -54,19 +158,40 @@ def movie_to_dict(movie: Movie) -> Dict[str, Any]:
         "category": movie.category,
         "size": movie.size,
         "published_year": movie.published_year,
+        "added_date": movie.added_date,
         "filename": movie.filename,
+        "thumbnail": image_link(movie.thumbnail, images, POSTER_VARIANT),
+        "bitrate": movie.bitrate,
+        "video_codec": movie.video_codec,
+        "audio_codec": movie.audio_codec,
+        "width": movie.width,
+        "height": movie.height,
         "casts": [
             {
                 "name": link.cast.name,
                 "role": link.cast.role,
-                "image_url": link.cast.image_url,
-            } for link in movie.cast_links if link.cast is not None
+                "image_url": image_link(link.cast.image_url, images, HEADSHOT_VARIANT),
+            } for link in sorted(movie.cast_links, key=lambda link: link.order or 0) if link.cast is not None
         ]
     }
 
-@router.get("/stream/{movie_id}")
-def stream_file(movie_id: int, db: SessionDep):
-    movie = db.get(Movie, movie_id)
+@router.api_route("/stream/{movie_id}", methods=["GET", "HEAD"])
+async def stream_file(movie_id: int, request: Request):
+    """Stream a movie file, honouring Range, If-Range and conditional requests."""
+    # Repeat (seek) requests are answered from the cache with no SQL and at most
+    # one stat, run off the event loop.
+    # Reading the catalog version first (rate-limited, usually no query) clears
+    # the cache when another process changed the catalog, e.g. the faststart
+    # job pointed this movie at a new copy.
+    await catalog_cache.version()
+    target = await stream_cache.get(movie_id)
+    if target is None:
+        target = stream_cache.put(movie_id, *await run_db(resolve_movie_file, movie_id))
+    return MediaFileResponse(target.path, request.headers, method=request.method, stat=target.stat, movie_id=movie_id)
+
+def resolve_movie_file(movie_id: int) -> Tuple[str, os.stat_result]:
+    with Session() as db:
+        movie = db.get(Movie, movie_id)
     if not movie:
         raise MovieNotFoundException(movie_id)
 
@@ -74,65 +199,208 @@ def stream_file(movie_id: int, db: SessionDep):
     if not location or not isinstance(location, str):
         raise InvalidFileLocationException
     filepath = location
-    if not os.path.isfile(filepath):
-        filepath = os.path.join(MEDIA_DIR, location)
-    if not os.path.isfile(filepath):
-        raise FileNotFoundException(filepath)
-    if os.path.isfile(filepath):
-        return FileResponse(filepath, media_type="video/mp4")
+    for filepath in (location, os.path.join(MEDIA_DIR, location)):
+        try:
+            stat = os.stat(filepath)
+        except OSError:
+            continue
+        if is_regular_file(stat):
+            return prefer_optimized(movie.optimized_location, filepath, stat)
     raise FileNotFoundException(filepath)
 
+def prefer_optimized(optimized_location: Optional[str], filepath: str, stat: os.stat_result) -> Tuple[str, os.stat_result]:
+    """Use the faststart copy of a file unless it is missing or older than the original."""
+    if optimized_location:
+        try:
+            optimized = os.stat(optimized_location)
+        except OSError:
+            return filepath, stat
+        if is_regular_file(optimized) and optimized.st_mtime_ns >= stat.st_mtime_ns:
+            return optimized_location, optimized
+    return filepath, stat
+
 @router.get("/movie/{movie_id}")
-def get_movie_details(movie_id: int, db: SessionDep):
-    movie = db.get(Movie, movie_id)
+async def get_movie_details(movie_id: int, request: Request, db: AsyncSessionDep):
+    return await catalog_cache.respond(request, ("movie", movie_id), db, fetch_movie_details, movie_id)
+
+def fetch_movie_details(db: Session, movie_id: int) -> Dict[str, Any]:
+    movie = db.get(Movie, movie_id, options=MOVIE_CAST_OPTIONS)
     if not movie:
         raise MovieNotFoundException(movie_id)
     
-    return movie_to_dict(movie)
+    return movie_to_dict(movie, catalog_images(db, [movie]))
 
-@router.post("/watch/{movie_id}")
-def log_watch(movie_id: int, user_id: int, progress: float, db: SessionDep):
-    """Log watch history for a movie."""
-    history = WatchHistory(
-        user_id=user_id,
-        movie_id=movie_id,
-        watched_at=datetime.now(timezone.utc),
-        progress=progress
+@router.get("/movie/{movie_id}/similar")
+async def get_similar_movies(movie_id: int, request: Request, db: AsyncSessionDep, limit: int = Query(10, ge=1, le=20)):
+    """"More like this": neighbours precomputed by jobs/movie/recommend.py, best first."""
+    return await catalog_cache.respond(request, ("similar", movie_id, limit), db, fetch_similar_movies, movie_id, limit)
+
+def fetch_similar_movies(db: Session, movie_id: int, limit: int) -> Dict[str, Any]:
+    rows = db.exec(
+        select(MovieSimilarity.score, *MOVIE_SUMMARY_COLUMNS)
+        .join(Movie, Movie.id == MovieSimilarity.similar_id)
+        .outerjoin(ImageAsset, ImageAsset.url == Movie.thumbnail)
+        .where(MovieSimilarity.movie_id == movie_id)
+        .order_by(MovieSimilarity.rank)
+        .limit(limit)
+    ).all()
+    if not rows and db.get(Movie, movie_id) is None:
+        raise MovieNotFoundException(movie_id)
+    return {"items": [{**movie_summary(row), "score": row.score} for row in rows]}
+
+@router.post("/search", response_model=MovieSearchResultSchema)
+async def search_movies(params: MovieSearchSchema, db: AsyncSessionDep) -> MovieSearchResultSchema:
+    """Full-text search over titles, plots, synopses and cast names, ranked by bm25."""
+    sort_by = params.sort.sort_by if params.sort else None
+    if sort_by is not None and sort_by not in MOVIE_SORT_FIELDS:
+        raise InvalidSortingFieldException(sort_by)
+    return await db.run(fetch_search_results, params)
+
+def fetch_search_results(db: Session, params: MovieSearchSchema) -> MovieSearchResultSchema:
+    category = params.filter.category if params.filter else None
+    sort_by = params.sort.sort_by if params.sort else None
+    hits, total_count = run_search(
+        db, params.query, category=category,
+        limit=params.limit, offset=params.offset, prefix=params.prefix,
+        sort_by=sort_by, descending=bool(params.sort and params.sort.sort_order == "desc"),
     )
-    db.add(history)
-    db.commit()
+    movies = {
+        movie.id: movie for movie in db.exec(
+            select(Movie).where(Movie.id.in_([hit["id"] for hit in hits])).options(*MOVIE_CAST_OPTIONS)
+        ).all()
+    }
+    images = catalog_images(db, list(movies.values()))
+    results = [
+        MovieSearchHitSchema(**movie_to_read_dict(movies[hit["id"]], images), rank=hit["score"], snippet=hit["snippet"])
+        for hit in hits if hit["id"] in movies
+    ]
+    return MovieSearchResultSchema(movies=results, total_count=total_count)
+
+@router.get("/search/suggest")
+async def suggest(db: AsyncSessionDep, q: str = Query(..., min_length=1), limit: int = Query(10, ge=1, le=50)):
+    """Type-ahead title suggestions for a partially typed query."""
+    return await db.run(suggest_titles, q, limit=limit)
+
+def movie_to_read_dict(movie: Movie, images: Optional[Dict[str, str]] = None) -> Dict[str, Any]:
+    return {
+        **movie_to_dict(movie, images),
+        "casts": [
+            link.cast.name for link in sorted(movie.cast_links, key=lambda link: link.order or 0)
+            if link.cast is not None
+        ],
+        "plot": movie.plot,
+        "subtitles": movie.subtitles,
+        "location": movie.location,
+    }
+
+@router.post("/watch/{movie_id}")
+async def log_watch(movie_id: int, user_id: int, progress: float):
+    """Log watch progress for a movie (buffered, written in batches)."""
+    watch_buffer.record(user_id, movie_id, progress)
     return {"status": "logged"}
 
 @router.put("/watch/{movie_id}")
-def update_watch(movie_id: int, user_id: int, progress: float, db: SessionDep):
-    """Update watch history for a movie."""
-    history = db.exec(select(WatchHistory).where(WatchHistory.movie_id == movie_id, WatchHistory.user_id == user_id)).first()
-    if not history:
+async def update_watch(movie_id: int, user_id: int, progress: float, db: AsyncSessionDep):
+    """Update watch progress for a movie (buffered, written in batches)."""
+    if watch_buffer.get(user_id, movie_id) is None and await db.run(find_watch_history, user_id, movie_id) is None:
         raise MovieNotFoundException(movie_id)
-    
-    history.progress = progress
-    db.commit()
+    watch_buffer.record(user_id, movie_id, progress)
     return {"status": "updated"}
 
 @router.get("/watch/{movie_id}")
-def get_watch_history(movie_id: int, user_id: int, db: SessionDep) -> Dict[str, Any]:
-    """Get watch history for a movie."""
-    history = db.exec(select(WatchHistory).where(WatchHistory.movie_id == movie_id, WatchHistory.user_id == user_id)).first()
-    if not history:
-        raise MovieNotFoundException(movie_id)
-    
+async def get_watch_history(movie_id: int, user_id: int, db: AsyncSessionDep) -> Dict[str, Any]:
+    """Get watch history for a movie, including progress not flushed yet."""
+    buffered = watch_buffer.get(user_id, movie_id)
+    if buffered is not None:
+        watched_at, progress = buffered.watched_at, buffered.progress
+    else:
+        history = await db.run(find_watch_history, user_id, movie_id)
+        if not history:
+            raise MovieNotFoundException(movie_id)
+        watched_at, progress = history.watched_at, history.progress
+
     return {
-        "movie_id": history.movie_id,
-        "user_id": history.user_id,
-        "watched_at": history.watched_at,
-        "progress": history.progress
+        "movie_id": movie_id,
+        "user_id": user_id,
+        "watched_at": watched_at,
+        "progress": progress
+    }
+
+def find_watch_history(db: Session, user_id: int, movie_id: int) -> Optional[WatchHistory]:
+    return db.exec(select(WatchHistory).where(WatchHistory.user_id == user_id, WatchHistory.movie_id == movie_id)).first()
+
+@router.get("/history")
+async def get_user_history(
+    user_id: int,
+    db: AsyncSessionDep,
+    limit: int = Query(20, ge=1, le=100),
+    cursor: Optional[str] = None,
+) -> Dict[str, Any]:
+    """Movies the user has watched, most recent first, with their progress."""
+    return await watch_history_page(db, user_id, limit, cursor, unfinished=False)
+
+@router.get("/continue-watching")
+async def continue_watching(
+    user_id: int,
+    db: AsyncSessionDep,
+    limit: int = Query(20, ge=1, le=100),
+    cursor: Optional[str] = None,
+) -> Dict[str, Any]:
+    """Movies the user started but has not finished, most recent first."""
+    return await watch_history_page(db, user_id, limit, cursor, unfinished=True)
+
+async def watch_history_page(
+    db: AsyncSessionDep, user_id: int, limit: int, cursor: Optional[str], unfinished: bool,
+) -> Dict[str, Any]:
+    after = decode_cursor(cursor, "watched_at", "desc") if cursor else None
+    if watch_buffer.has_pending(user_id):
+        # Write the user's latest heartbeats now rather than merging the buffer
+        # into a paginated result; the flush batches everyone else's too.
+        try:
+            await run_db(watch_buffer.flush)
+        except Exception as e:
+            click.secho(f"[ERROR] Failed to flush watch progress: {e}", fg="red")
+    return await db.run(fetch_watch_page, user_id, limit, after, unfinished)
+
+def fetch_watch_page(
+    db: Session, user_id: int, limit: int, after: Optional[Tuple[Any, int]], unfinished: bool,
+) -> Dict[str, Any]:
+    """One page of history joined with its movies and cached posters, in a single query."""
+    query = (
+        select(WatchHistory.id, WatchHistory.progress, WatchHistory.watched_at, *MOVIE_SUMMARY_COLUMNS)
+        .join(Movie, Movie.id == WatchHistory.movie_id)
+        .outerjoin(ImageAsset, ImageAsset.url == Movie.thumbnail)
+        .where(WatchHistory.user_id == user_id)
+    )
+    if unfinished:
+        query = query.where(WatchHistory.progress > 0, WatchHistory.progress < FINISHED_PROGRESS)
+    if after:
+        query = query.where(tuple_(WatchHistory.watched_at, WatchHistory.id) < after)
+    query = query.order_by(desc(WatchHistory.watched_at), desc(WatchHistory.id)).limit(limit + 1)
+
+    rows = list(db.exec(query).all())
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = encode_cursor("watched_at", "desc", rows[-1])
+    return {
+        "items": [
+            {**movie_summary(row), "progress": row.progress, "watched_at": row.watched_at} for row in rows
+        ],
+        "next_cursor": next_cursor,
     }
 
 @router.get("/subtitle/{movie_id}")
-def get_subtitle(movie_id: int, db: SessionDep):
+async def get_subtitle(movie_id: int, db: AsyncSessionDep):
+    subtitle_path = await db.run(find_subtitle, movie_id)
+    if subtitle_path is None:
+        raise SubtitleNotFoundException(movie_id)
+    return FileResponse(subtitle_path, media_type="text/plain")
+
+def find_subtitle(db: Session, movie_id: int) -> Optional[str]:
     movie = db.get(Movie, movie_id)
     if movie is not None and getattr(movie, "subtitles", None) is not None:
         subtitle_path = os.path.join(MEDIA_DIR, movie.subtitles)
         if os.path.isfile(subtitle_path):
-            return FileResponse(subtitle_path, media_type="text/plain")
-    raise SubtitleNotFoundException(movie_id)
\ No newline at end of file
+            return subtitle_path
+    return None
\ No newline at end of file
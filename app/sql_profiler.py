@@ -0,0 +1,272 @@
+"""
+Opt-in SQL profiling: per-request statement counts, N+1 detection and a
+slow-query log.
+
+A lazy relationship read in a loop (``movie.cast_links`` for every movie of a
+page) runs the same statement once per row. That does not show up in a test
+or on a small catalog, but it does on a real one. With ``SQL_PROFILE=1``,
+SQLProfilerMiddleware gives every request a RequestProfile. The engine
+listeners add each statement to it, grouped by shape: the SQL with runs of
+``?`` placeholders collapsed, so ``IN (?, ?, ?)`` and ``IN (?, ?)`` match.
+When the request ends, any shape run ``SQL_N_PLUS_ONE_THRESHOLD`` times or
+more is logged as a likely N+1, with the route that ran it.
+
+A statement slower than ``SQL_SLOW_QUERY_MS`` is written to the rotating
+``SQL_PROFILE_LOG`` with its parameters and its ``EXPLAIN QUERY PLAN``.
+``GET /health/sql-profile`` summarises queries per route and the N+1 shapes
+found so far.
+
+Tests can bound the queries an endpoint runs, profiling on or not::
+
+    with max_queries(3):
+        client.get("/media/movie/1")
+"""
+import logging
+import re
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from logging.handlers import RotatingFileHandler
+from pathlib import Path
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+from sqlalchemy import Engine, event
+from starlette.types import ASGIApp, Receive, Scope, Send
+
+from app_config import (
+    SQL_N_PLUS_ONE_THRESHOLD, SQL_PROFILE_LOG, SQL_PROFILE_LOG_BACKUPS, SQL_PROFILE_LOG_BYTES, SQL_SLOW_QUERY_MS,
+)
+
+UNKNOWN_ROUTE: str = "<no request>"
+MAX_FINDINGS: int = 200  # (route, shape) pairs kept for the summary
+
+_PLACEHOLDERS = re.compile(r"\?(?:\s*,\s*\?)+")
+_WHITESPACE = re.compile(r"\s+")
+
+
+def statement_shape(statement: str) -> str:
+    """The statement with whitespace normalised and placeholder lists collapsed to ``?, ...``."""
+    return _PLACEHOLDERS.sub("?, ...", _WHITESPACE.sub(" ", statement).strip())
+
+
+class RequestProfile:
+    """Statements run on behalf of one request (or one ``capture``)."""
+
+    def __init__(self, scope: Optional[Scope] = None):
+        self.scope = scope
+        self.count = 0
+        self.seconds = 0.0
+        self.shapes: Dict[str, List[float]] = {}  # shape -> [count, seconds]
+        self._lock = threading.Lock()  # a request's statements may run on several executor threads
+
+    @property
+    def route(self) -> str:
+        if self.scope is None:
+            return UNKNOWN_ROUTE
+        route = self.scope.get("route")
+        return f"{self.scope['method']} {getattr(route, 'path', None) or self.scope['path']}"
+
+    def add(self, shape: str, seconds: float) -> None:
+        with self._lock:
+            self.count += 1
+            self.seconds += seconds
+            entry = self.shapes.setdefault(shape, [0, 0.0])
+            entry[0] += 1
+            entry[1] += seconds
+
+    def repeated(self, threshold: int) -> List[Tuple[str, int]]:
+        """Shapes run at least ``threshold`` times, most frequent first."""
+        with self._lock:
+            found = [(shape, int(entry[0])) for shape, entry in self.shapes.items() if entry[0] >= threshold]
+        return sorted(found, key=lambda item: -item[1])
+
+    def report(self) -> str:
+        with self._lock:
+            shapes = sorted(self.shapes.items(), key=lambda item: -item[1][0])
+        lines = [f"{self.count} statements, {self.seconds * 1000:.1f} ms"]
+        lines += [f"  {int(count):>4} x {seconds * 1000:8.1f} ms  {shape}" for shape, (count, seconds) in shapes]
+        return "\n".join(lines)
+
+
+_current: ContextVar[Optional[RequestProfile]] = ContextVar("sql_profile", default=None)
+
+
+class SQLProfiler:
+    def __init__(
+        self,
+        slow_ms: float = SQL_SLOW_QUERY_MS,
+        n_plus_one_threshold: int = SQL_N_PLUS_ONE_THRESHOLD,
+        log_path: Path = SQL_PROFILE_LOG,
+    ):
+        self.slow_seconds = slow_ms / 1000
+        self.n_plus_one_threshold = n_plus_one_threshold
+        self.log_path = log_path
+        self.stats: Dict[str, int] = {"requests": 0, "statements": 0, "slow": 0, "n_plus_one": 0}
+        self._routes: Dict[str, List[float]] = {}  # route -> [requests, statements, seconds, worst]
+        self._findings: Dict[Tuple[str, str], int] = {}  # (route, shape) -> most runs in one request
+        self._captures: List[RequestProfile] = []
+        self._engines: List[Engine] = []
+        self._logger: Optional[logging.Logger] = None
+        self._lock = threading.Lock()
+
+    # ----- setup -----
+
+    def install(self, engine: Engine) -> None:
+        """Listen to ``engine``'s statements (once per engine)."""
+        with self._lock:
+            if any(known is engine for known in self._engines):
+                return
+            self._engines.append(engine)
+        event.listen(engine, "before_cursor_execute", self._before)
+        event.listen(engine, "after_cursor_execute", self._after)
+        event.listen(engine, "handle_error", self._on_error)
+
+    def logger(self) -> logging.Logger:
+        if self._logger is None:
+            logger = logging.getLogger("velofy.sql")
+            logger.setLevel(logging.INFO)
+            logger.propagate = False
+            handler = RotatingFileHandler(
+                self.log_path, maxBytes=SQL_PROFILE_LOG_BYTES, backupCount=SQL_PROFILE_LOG_BACKUPS, encoding="utf-8",
+            )
+            handler.setFormatter(logging.Formatter("%(asctime)s %(message)s"))
+            logger.addHandler(handler)
+            self._logger = logger
+        return self._logger
+
+    # ----- engine events -----
+
+    @staticmethod
+    def _before(connection, cursor, statement, parameters, context, executemany) -> None:
+        connection.info.setdefault("profile_started", []).append(time.perf_counter())
+
+    @staticmethod
+    def _on_error(exception_context) -> None:
+        connection = exception_context.connection
+        if connection is not None and connection.info.get("profile_started"):
+            connection.info["profile_started"].pop()
+
+    def _after(self, connection, cursor, statement, parameters, context, executemany) -> None:
+        elapsed = time.perf_counter() - connection.info["profile_started"].pop()
+        profile = _current.get()
+        if profile is None and not self._captures:
+            return
+        shape = statement_shape(statement)
+        if profile is not None:
+            profile.add(shape, elapsed)
+        with self._lock:
+            captures = list(self._captures)
+        for capture in captures:
+            capture.add(shape, elapsed)
+        if profile is not None and elapsed >= self.slow_seconds:
+            self._log_slow(cursor, statement, parameters, executemany, elapsed, profile.route)
+
+    def _log_slow(self, cursor, statement: str, parameters: Any, executemany: bool, elapsed: float, route: str) -> None:
+        with self._lock:
+            self.stats["slow"] += 1
+        lines = [f"SLOW {elapsed * 1000:.1f} ms {route}", f"  {_WHITESPACE.sub(' ', statement).strip()}"]
+        if not executemany:
+            lines.append(f"  params: {parameters!r}")
+            lines += [f"  plan: {step}" for step in explain(cursor, statement, parameters)]
+        self.logger().warning("\n".join(lines))
+
+    # ----- requests -----
+
+    def start_request(self, scope: Scope) -> Tuple[RequestProfile, Any]:
+        profile = RequestProfile(scope)
+        return profile, _current.set(profile)
+
+    def finish_request(self, profile: RequestProfile, token: Any) -> None:
+        _current.reset(token)
+        route = profile.route
+        repeated = profile.repeated(self.n_plus_one_threshold)
+        with self._lock:
+            self.stats["requests"] += 1
+            self.stats["statements"] += profile.count
+            totals = self._routes.setdefault(route, [0, 0, 0.0, 0])
+            totals[0] += 1
+            totals[1] += profile.count
+            totals[2] += profile.seconds
+            totals[3] = max(totals[3], profile.count)
+            for shape, count in repeated:
+                key = (route, shape)
+                if key in self._findings or len(self._findings) < MAX_FINDINGS:
+                    self._findings[key] = max(count, self._findings.get(key, 0))
+            self.stats["n_plus_one"] += len(repeated)
+        for shape, count in repeated:
+            self.logger().warning(f"N+1 {route}: {count} x {shape}")
+
+    @contextmanager
+    def capture(self) -> Iterator[RequestProfile]:
+        """Collect every statement run on the profiled engines, on any thread, until the block ends."""
+        from database import engine, read_engine
+
+        self.install(engine)
+        self.install(read_engine)
+        profile = RequestProfile()
+        with self._lock:
+            self._captures.append(profile)
+        try:
+            yield profile
+        finally:
+            with self._lock:
+                self._captures.remove(profile)
+
+    def summary(self) -> Dict[str, Any]:
+        with self._lock:
+            routes = {
+                route: {
+                    "requests": int(requests),
+                    "statements_per_request": round(statements / requests, 2),
+                    "max_statements": int(worst),
+                    "ms_per_request": round(seconds / requests * 1000, 3),
+                }
+                for route, (requests, statements, seconds, worst) in sorted(self._routes.items())
+            }
+            findings = [
+                {"route": route, "statements": count, "shape": shape}
+                for (route, shape), count in sorted(self._findings.items(), key=lambda item: -item[1])
+            ]
+            return {**self.stats, "slow_query_ms": self.slow_seconds * 1000, "routes": routes, "n_plus_one_shapes": findings}
+
+
+def explain(cursor, statement: str, parameters: Any) -> List[str]:
+    """EXPLAIN QUERY PLAN of a statement, run on the same DBAPI connection (so no events fire)."""
+    if not statement.lstrip().upper().startswith(("SELECT", "WITH", "UPDATE", "DELETE", "INSERT")):
+        return []
+    try:
+        rows = cursor.connection.execute(f"EXPLAIN QUERY PLAN {statement}", parameters).fetchall()
+    except sqlite3.Error as error:
+        return [f"(unavailable: {error})"]
+    return [row[-1] for row in rows]
+
+
+sql_profiler = SQLProfiler()
+
+
+class SQLProfilerMiddleware:
+    """Profiles the statements of each HTTP request (installed when SQL_PROFILE=1)."""
+
+    def __init__(self, app: ASGIApp):
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        profile, token = sql_profiler.start_request(scope)
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            sql_profiler.finish_request(profile, token)
+
+
+@contextmanager
+def max_queries(limit: int) -> Iterator[RequestProfile]:
+    """Fail with the statement breakdown if the block runs more than ``limit`` statements."""
+    with sql_profiler.capture() as profile:
+        yield profile
+    if profile.count > limit:
+        raise AssertionError(f"expected at most {limit} statements, ran {profile.report()}")
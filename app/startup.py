@@ -0,0 +1,61 @@
+"""
+Startup timing.
+
+Cold start is most of what a restart or a new worker costs, so the server
+reports where it goes: how long importing the app took, each lifespan step,
+and the time from process start (as the kernel recorded it, so interpreter
+start-up and uvicorn's own imports count too) to accepting requests. The
+report is printed once per process and served by ``GET /health/startup``.
+"""
+import os
+import time
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Any, Dict, Iterator, Optional
+
+import click
+
+
+def process_age() -> Optional[float]:
+    """Seconds since this process started, from /proc (None where that is unavailable)."""
+    try:
+        # Field 22 (starttime, in clock ticks after boot) comes 20 fields after the ")" closing the name.
+        ticks = int(Path("/proc/self/stat").read_text().rsplit(")", 1)[1].split()[19])
+        uptime = float(Path("/proc/uptime").read_text().split()[0])
+    except (OSError, ValueError, IndexError):
+        return None
+    return max(0.0, uptime - ticks / os.sysconf("SC_CLK_TCK"))
+
+
+class StartupTimer:
+    def __init__(self):
+        self.steps: Dict[str, float] = {}  # step -> seconds, in the order they ran
+        self.ready_after: Optional[float] = None
+
+    def record(self, name: str, seconds: float) -> None:
+        self.steps[name] = seconds
+
+    @contextmanager
+    def step(self, name: str) -> Iterator[None]:
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(name, time.perf_counter() - started)
+
+    def ready(self) -> None:
+        """Called when the app is about to accept requests: prints the report."""
+        self.ready_after = process_age()
+        steps = ", ".join(f"{name} {seconds * 1000:.0f} ms" for name, seconds in self.steps.items())
+        total = f"{self.ready_after:.2f}s after process start" if self.ready_after is not None else "started"
+        click.secho(f"⚡ Worker {os.getpid()} ready, {total} ({steps})", fg="bright_green")
+
+    def summary(self) -> Dict[str, Any]:
+        return {
+            "pid": os.getpid(),
+            "ready_after_s": None if self.ready_after is None else round(self.ready_after, 3),
+            "steps_ms": {name: round(seconds * 1000, 1) for name, seconds in self.steps.items()},
+        }
+
+
+startup_timer = StartupTimer()
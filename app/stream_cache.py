@@ -0,0 +1,130 @@
+"""
+Hot-path cache for stream path resolution.
+
+A player seeking through a film sends a burst of small Range requests for the
+same movie. StreamCache remembers, per movie_id, the path the catalog resolved
+to and the stat it had, so a repeat request costs no SQL and at most one
+``os.stat``. That stat runs on the streaming I/O limiter, not on the event
+loop, since on a slow or network mount it can block; and a target checked
+less than ``STREAM_CACHE_FRESHNESS`` seconds ago is not checked again.
+An entry is dropped when that stat no longer matches (the file was replaced,
+moved or deleted) or when the catalog reports a change to the movie.
+"""
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, Iterable, NamedTuple, Optional
+
+import anyio.to_thread
+from sqlalchemy import event
+
+from app.streaming import io_limiter
+from app_config import STREAM_CACHE_FRESHNESS, STREAM_CACHE_SIZE
+from models import Movie
+
+
+class StreamTarget(NamedTuple):
+    path: str
+    stat: os.stat_result
+    checked_at: float = 0.0  # monotonic time of the stat
+
+
+def _same_file(a: os.stat_result, b: os.stat_result) -> bool:
+    return (a.st_ino, a.st_dev, a.st_size, a.st_mtime_ns) == (b.st_ino, b.st_dev, b.st_size, b.st_mtime_ns)
+
+
+class StreamCache:
+    """Thread-safe bounded LRU of movie_id -> StreamTarget."""
+
+    def __init__(self, maxsize: int = STREAM_CACHE_SIZE, freshness: float = STREAM_CACHE_FRESHNESS):
+        self.maxsize = maxsize
+        self.freshness = freshness
+        self.stats: Dict[str, int] = {
+            "hits": 0, "misses": 0, "stale": 0, "stats": 0, "invalidations": 0, "evictions": 0,
+        }
+        self._entries: "OrderedDict[int, StreamTarget]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    async def get(self, movie_id: int) -> Optional[StreamTarget]:
+        """
+        Return the cached target with a recent stat, or None when the caller
+        has to resolve it from the catalog. Costs at most one ``os.stat``.
+        """
+        with self._lock:
+            target = self._entries.get(movie_id)
+            if target is not None:
+                self._entries.move_to_end(movie_id)
+        if target is None:
+            self._count("misses")
+            return None
+        if time.monotonic() - target.checked_at < self.freshness:
+            self._count("hits")
+            return target
+        try:
+            stat = await anyio.to_thread.run_sync(os.stat, target.path, limiter=io_limiter())
+        except OSError:
+            stat = None
+        with self._lock:
+            self.stats["stats"] += 1
+            current = self._entries.get(movie_id)
+            if stat is None or not _same_file(stat, target.stat):
+                if current is target:
+                    del self._entries[movie_id]
+                self.stats["stale"] += 1
+                self.stats["misses"] += 1
+                return None
+            checked = target._replace(checked_at=time.monotonic())
+            if current is target:
+                self._entries[movie_id] = checked
+            self.stats["hits"] += 1
+        return checked
+
+    def put(self, movie_id: int, path: str, stat: os.stat_result) -> StreamTarget:
+        target = StreamTarget(path, stat, time.monotonic())
+        with self._lock:
+            self._entries[movie_id] = target
+            self._entries.move_to_end(movie_id)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+                self.stats["evictions"] += 1
+        return target
+
+    def invalidate(self, movie_ids: Optional[Iterable[int]] = None) -> None:
+        """Drop the given movies, or everything when ``movie_ids`` is None."""
+        with self._lock:
+            if movie_ids is None:
+                self.stats["invalidations"] += len(self._entries)
+                self._entries.clear()
+                return
+            for movie_id in movie_ids:
+                if self._entries.pop(movie_id, None) is not None:
+                    self.stats["invalidations"] += 1
+
+    def _count(self, key: str) -> None:
+        with self._lock:
+            self.stats[key] += 1
+
+    def summary(self) -> Dict[str, float]:
+        with self._lock:
+            lookups = self.stats["hits"] + self.stats["misses"]
+            return {
+                **self.stats,
+                "size": len(self._entries),
+                "maxsize": self.maxsize,
+                "hit_ratio": round(self.stats["hits"] / lookups, 4) if lookups else 0.0,
+            }
+
+
+stream_cache = StreamCache()
+
+
+# ORM writes to a movie (location edits, deletes) drop its entry straight away.
+# Bulk Core writes from the importer bypass these events; the watcher clears
+# the cache after applying a delta, and any moved or deleted file is caught by
+# the stat check anyway.
+@event.listens_for(Movie, "after_update")
+@event.listens_for(Movie, "after_delete")
+def _invalidate_movie(mapper, connection, target: Movie) -> None:
+    if target.id is not None:
+        stream_cache.invalidate([target.id])
@@ -0,0 +1,263 @@
+"""
+Range-aware media streaming.
+
+MediaFileResponse serves a file with the headers players and browsers rely on
+when seeking: Accept-Ranges, Content-Range/206, strong ETags, Last-Modified,
+If-Range and 304 revalidation. The body is sent without tying up the shared
+threadpool: if the server offers the ASGI ``http.response.zerocopysend``
+extension the kernel copies the bytes (sendfile); otherwise reads run on a
+small, dedicated I/O limiter with ``posix_fadvise`` read-ahead hints, so
+dozens of seeking clients cannot starve the sync routes.
+"""
+import mimetypes
+import os
+import stat as stat_module
+from email.utils import formatdate, parsedate_to_datetime
+from typing import Dict, List, Optional, Tuple
+
+import anyio
+from starlette.datastructures import Headers
+from starlette.responses import Response
+from starlette.types import Receive, Scope, Send
+
+from app.metrics import metrics
+from app_config import STREAM_CHUNK_SIZE, STREAM_READAHEAD, STREAM_IO_THREADS
+
+MEDIA_TYPES: Dict[str, str] = {
+    ".mp4": "video/mp4",
+    ".m4v": "video/mp4",
+    ".mkv": "video/x-matroska",
+    ".webm": "video/webm",
+    ".avi": "video/x-msvideo",
+    ".mov": "video/quicktime",
+    ".ts": "video/mp2t",
+    ".srt": "application/x-subrip",
+    ".vtt": "text/vtt",
+}
+
+# Bounds how many threads file reads may occupy, independently of the
+# default anyio limiter that sync endpoints and dependencies run on.
+_io_limiter: Optional[anyio.CapacityLimiter] = None
+
+
+def io_limiter() -> anyio.CapacityLimiter:
+    global _io_limiter
+    if _io_limiter is None:
+        _io_limiter = anyio.CapacityLimiter(STREAM_IO_THREADS)
+    return _io_limiter
+
+
+def guess_media_type(path: str) -> str:
+    extension = os.path.splitext(path)[1].lower()
+    return MEDIA_TYPES.get(extension) or mimetypes.guess_type(path)[0] or "application/octet-stream"
+
+
+def make_etag(stat: os.stat_result) -> str:
+    return f'"{stat.st_ino:x}-{stat.st_size:x}-{stat.st_mtime_ns:x}"'
+
+
+def parse_range(header: str, size: int) -> Optional[List[Tuple[int, int]]]:
+    """
+    Parse a ``Range`` header into inclusive ``(start, end)`` pairs.
+
+    Returns None when the header is malformed (it must then be ignored) and
+    an empty list when it is well formed but no range is satisfiable.
+    """
+    unit, _, spec = header.partition("=")
+    if unit.strip().lower() != "bytes" or not spec:
+        return None
+    ranges: List[Tuple[int, int]] = []
+    for part in spec.split(","):
+        first, sep, last = part.strip().partition("-")
+        if not sep:
+            return None
+        try:
+            if first:
+                start = int(first)
+                end = int(last) if last else size - 1
+                if end < start:
+                    return None
+            else:
+                suffix = int(last)
+                if suffix == 0:
+                    continue
+                start, end = max(0, size - suffix), size - 1
+        except ValueError:
+            return None
+        if start < size:
+            ranges.append((start, min(end, size - 1)))
+    return ranges
+
+
+class MediaFileResponse(Response):
+    def __init__(
+        self,
+        path: str,
+        request_headers: Headers,
+        method: str = "GET",
+        stat: Optional[os.stat_result] = None,
+        media_type: Optional[str] = None,
+        chunk_size: int = STREAM_CHUNK_SIZE,
+        readahead: int = STREAM_READAHEAD,
+        headers: Optional[Dict[str, str]] = None,
+        movie_id: Optional[int] = None,  # counts the body in the streaming metrics
+    ):
+        self.path = path
+        self.movie_id = movie_id
+        self.chunk_size = chunk_size
+        self.readahead = readahead
+        self.send_body = method.upper() != "HEAD"
+        self.stat = stat or os.stat(path)
+        self.media_type = media_type or guess_media_type(path)
+        self.background = None
+        self.start, self.end = 0, self.stat.st_size - 1
+        self.status_code = 200
+        self.raw_headers = []
+
+        etag = make_etag(self.stat)
+        last_modified = formatdate(self.stat.st_mtime, usegmt=True)
+        headers = {
+            "accept-ranges": "bytes",
+            "etag": etag,
+            "last-modified": last_modified,
+            "content-type": self.media_type,
+            **(headers or {}),
+        }
+
+        if self._not_modified(request_headers, etag):
+            self.status_code = 304
+            self.send_body = False
+            del headers["content-type"]
+            self.init_headers(headers)
+            return
+
+        range_header = request_headers.get("range")
+        if range_header and self._if_range_matches(request_headers.get("if-range"), etag, last_modified):
+            ranges = parse_range(range_header, self.stat.st_size)
+            if ranges == []:
+                self.status_code = 416
+                self.send_body = False
+                headers["content-range"] = f"bytes */{self.stat.st_size}"
+                headers["content-length"] = "0"
+                self.init_headers(headers)
+                return
+            # Players only ever ask for one range; multi-range requests are
+            # answered with the whole file, which RFC 9110 allows.
+            if ranges is not None and len(ranges) == 1:
+                self.start, self.end = ranges[0]
+                self.status_code = 206
+                headers["content-range"] = f"bytes {self.start}-{self.end}/{self.stat.st_size}"
+
+        headers["content-length"] = str(max(0, self.end - self.start + 1))
+        self.init_headers(headers)
+
+    def init_headers(self, headers: Optional[Dict[str, str]] = None) -> None:
+        self.raw_headers = [(key.encode("latin-1"), value.encode("latin-1")) for key, value in (headers or {}).items()]
+
+    def _not_modified(self, request_headers: Headers, etag: str) -> bool:
+        if_none_match = request_headers.get("if-none-match")
+        if if_none_match is not None:
+            tags = [tag.strip() for tag in if_none_match.split(",")]
+            return "*" in tags or etag in tags or f"W/{etag}" in tags
+        if_modified_since = request_headers.get("if-modified-since")
+        if if_modified_since:
+            try:
+                return int(self.stat.st_mtime) <= parsedate_to_datetime(if_modified_since).timestamp()
+            except (TypeError, ValueError):
+                return False
+        return False
+
+    @staticmethod
+    def _if_range_matches(if_range: Optional[str], etag: str, last_modified: str) -> bool:
+        if if_range is None:
+            return True
+        if_range = if_range.strip()
+        if if_range.startswith('"'):
+            return if_range == etag  # strong comparison only
+        return if_range == last_modified
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        await send({"type": "http.response.start", "status": self.status_code, "headers": self.raw_headers})
+        length = self.end - self.start + 1
+        if not self.send_body or length <= 0:
+            await send({"type": "http.response.body", "body": b"", "more_body": False})
+            return
+
+        fd = os.open(self.path, os.O_RDONLY | getattr(os, "O_CLOEXEC", 0))
+        if self.movie_id is not None:
+            metrics.stream_started()
+        try:
+            if "http.response.zerocopysend" in scope.get("extensions", {}):
+                self._advise(fd, self.start, length, sequential=True)
+                # The extension takes a file object; the fd itself is closed below.
+                with os.fdopen(fd, "rb", closefd=False) as file:
+                    await send({
+                        "type": "http.response.zerocopysend",
+                        "file": file,
+                        "offset": self.start,
+                        "count": length,
+                        "more_body": False,
+                    })
+                self._sent(length)
+                return
+            async with anyio.create_task_group() as task_group:
+                async def stream_then_cancel() -> None:
+                    await self._stream(fd, length, send)
+                    task_group.cancel_scope.cancel()
+
+                task_group.start_soon(stream_then_cancel)
+                await self._wait_for_disconnect(receive)
+                task_group.cancel_scope.cancel()
+        finally:
+            os.close(fd)
+            if self.movie_id is not None:
+                metrics.stream_finished()
+
+    def _sent(self, size: int) -> None:
+        if self.movie_id is not None:
+            metrics.stream_bytes(self.movie_id, size)
+
+    @staticmethod
+    async def _wait_for_disconnect(receive: Receive) -> None:
+        while True:
+            message = await receive()
+            if message["type"] == "http.disconnect":
+                return
+
+    def _advise(self, fd: int, offset: int, length: int, sequential: bool = False) -> None:
+        if not hasattr(os, "posix_fadvise"):
+            return
+        try:
+            if sequential:
+                os.posix_fadvise(fd, offset, length, os.POSIX_FADV_SEQUENTIAL)
+            os.posix_fadvise(fd, offset, min(length, self.readahead), os.POSIX_FADV_WILLNEED)
+        except OSError:
+            pass
+
+    def _read(self, fd: int, offset: int, size: int, remaining: int) -> bytes:
+        # Ask the kernel to start fetching the window after this chunk while
+        # the current one is on the wire.
+        if remaining > size and offset % self.readahead < size:
+            self._advise(fd, offset + size, remaining - size)
+        return os.pread(fd, size, offset)
+
+    async def _stream(self, fd: int, length: int, send: Send) -> None:
+        self._advise(fd, self.start, length, sequential=True)
+        limiter = io_limiter()
+        offset, remaining = self.start, length
+        while remaining > 0:
+            size = min(self.chunk_size, remaining)
+            chunk = await anyio.to_thread.run_sync(self._read, fd, offset, size, remaining, limiter=limiter)
+            if not chunk:
+                break
+            offset += len(chunk)
+            remaining -= len(chunk)
+            await send({"type": "http.response.body", "body": chunk, "more_body": remaining > 0})
+            self._sent(len(chunk))
+        if remaining > 0:
+            # The file shrank under us; end the response rather than hang.
+            await send({"type": "http.response.body", "body": b"", "more_body": False})
+
+
+def is_regular_file(stat: os.stat_result) -> bool:
+    return stat_module.S_ISREG(stat.st_mode)
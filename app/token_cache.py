@@ -0,0 +1,141 @@
+"""
+Cache of verified access tokens for ``get_current_user``.
+
+A logged-in client sends the same bearer token with every request. Once a
+token has been decoded and matched against its user row, TokenCache keeps the
+resulting UserResponseSchema under the sha256 of the token, so the next
+request with it needs neither the JWT decode nor a query. An entry lives for
+at most ``TOKEN_CACHE_TTL`` seconds and never past the token's own ``exp``.
+
+Any ORM change to a user (profile update, delete, token revocation through
+``User.token_version``) drops that user's entries straight away. The cache is
+per process, so changes made elsewhere (another server worker, a script) are
+caught through ``auth_version``, a counter that triggers bump on every user
+update or delete (see ``database.ensure_auth_version``). ``sync`` reads it at
+most once every ``TOKEN_RECHECK_INTERVAL`` seconds and empties the cache when
+it moved, so a logout in one worker holds in all of them within that interval.
+"""
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, NamedTuple, Optional
+
+from sqlalchemy import event
+
+from app_config import TOKEN_CACHE_SIZE, TOKEN_CACHE_TTL, TOKEN_RECHECK_INTERVAL
+from database import read_auth_version, run_db
+from models import User
+from schemas.auth import UserResponseSchema
+
+
+class CachedToken(NamedTuple):
+    user: UserResponseSchema
+    expires_at: float  # unix time
+
+
+def token_key(token: str) -> bytes:
+    return hashlib.sha256(token.encode()).digest()
+
+
+class TokenCache:
+    """Thread-safe bounded LRU of sha256(token) -> CachedToken."""
+
+    def __init__(
+        self,
+        maxsize: int = TOKEN_CACHE_SIZE,
+        ttl: float = TOKEN_CACHE_TTL,
+        recheck_interval: float = TOKEN_RECHECK_INTERVAL,
+    ):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.recheck_interval = recheck_interval
+        self.stats: Dict[str, int] = {
+            "hits": 0, "misses": 0, "expired": 0, "invalidations": 0, "evictions": 0, "version_reads": 0,
+        }
+        self._entries: "OrderedDict[bytes, CachedToken]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._stamp = 0  # bumped by every invalidation
+        self._version: Optional[int] = None
+        self._checked_at = 0.0
+
+    async def sync(self) -> None:
+        """Empty the cache if the auth version moved; reads it from the database at most once per interval."""
+        now = time.monotonic()
+        if self._version is not None and now - self._checked_at < self.recheck_interval:
+            return
+        self._checked_at = now  # requests arriving meanwhile keep using the cache
+        version = await run_db(read_auth_version)
+        with self._lock:
+            self.stats["version_reads"] += 1
+            changed = self._version is not None and version != self._version
+            self._version = version
+        if changed:
+            self.clear()
+
+    def get(self, token: str) -> Optional[UserResponseSchema]:
+        key = token_key(token)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.stats["misses"] += 1
+                return None
+            if entry.expires_at <= time.time():
+                del self._entries[key]
+                self.stats["expired"] += 1
+                self.stats["misses"] += 1
+                return None
+            self._entries.move_to_end(key)
+            self.stats["hits"] += 1
+            return entry.user
+
+    def stamp(self) -> int:
+        """Take before loading a user; pass to ``put`` so a concurrent change is not cached over."""
+        with self._lock:
+            return self._stamp
+
+    def put(self, token: str, user: UserResponseSchema, exp: float, stamp: int) -> None:
+        expires_at = min(exp, time.time() + self.ttl)
+        with self._lock:
+            if stamp != self._stamp:
+                return
+            key = token_key(token)
+            self._entries[key] = CachedToken(user, expires_at)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+                self.stats["evictions"] += 1
+
+    def invalidate_user(self, user_id: int) -> None:
+        with self._lock:
+            self._stamp += 1
+            stale = [key for key, entry in self._entries.items() if entry.user.id == user_id]
+            for key in stale:
+                del self._entries[key]
+            self.stats["invalidations"] += len(stale)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._stamp += 1
+            self.stats["invalidations"] += len(self._entries)
+            self._entries.clear()
+
+    def summary(self) -> Dict[str, float]:
+        with self._lock:
+            lookups = self.stats["hits"] + self.stats["misses"]
+            return {
+                **self.stats,
+                "size": len(self._entries),
+                "maxsize": self.maxsize,
+                "hit_ratio": round(self.stats["hits"] / lookups, 4) if lookups else 0.0,
+            }
+
+
+token_cache = TokenCache()
+
+
+@event.listens_for(User, "after_update")
+@event.listens_for(User, "after_delete")
+def _invalidate_user(mapper, connection, target: User) -> None:
+    if target.id is not None:
+        token_cache.invalidate_user(target.id)
@@ -0,0 +1,145 @@
+"""
+Write-behind buffer for watch-progress heartbeats.
+
+Players report progress every few seconds. Instead of one SQLite write (and
+one write lock) per heartbeat, updates land in an in-memory dict keyed by
+(user_id, movie_id), where later heartbeats overwrite earlier ones. A
+background thread flushes the dict every ``WATCH_FLUSH_INTERVAL`` seconds (or
+sooner once ``WATCH_BUFFER_MAX`` keys are pending) as one batched upsert, and
+the server's shutdown flushes whatever is left. Reads consult the buffer
+first, so they never see a value older than the last heartbeat.
+
+The buffer is per process: with several server workers, a read served by
+another worker (including the flush-before-read of the history pages) sees a
+heartbeat only once its own worker has flushed it. ``server.py --prod`` with
+several workers therefore flushes every ``MULTI_WORKER_FLUSH_INTERVAL``
+seconds unless ``WATCH_FLUSH_INTERVAL`` is set, which bounds that lag.
+"""
+import threading
+from datetime import datetime, timezone
+from typing import Dict, NamedTuple, Optional, Tuple
+
+import click
+from sqlalchemy import select
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+
+from app_config import WATCH_FLUSH_INTERVAL, WATCH_BUFFER_MAX
+from database import engine
+from models import Movie, WatchHistory
+
+WatchKey = Tuple[int, int]  # (user_id, movie_id)
+
+
+class WatchProgress(NamedTuple):
+    progress: float
+    watched_at: datetime
+
+
+class WatchBuffer:
+    def __init__(self, flush_interval: float = WATCH_FLUSH_INTERVAL, max_pending: int = WATCH_BUFFER_MAX):
+        self.flush_interval = flush_interval
+        self.max_pending = max_pending
+        self.stats: Dict[str, int] = {"heartbeats": 0, "flushes": 0, "rows_written": 0, "failed_flushes": 0}
+        self._pending: Dict[WatchKey, WatchProgress] = {}
+        self._flushing: Dict[WatchKey, WatchProgress] = {}  # being written; still visible to reads
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def record(self, user_id: int, movie_id: int, progress: float) -> None:
+        with self._lock:
+            self._pending[(user_id, movie_id)] = WatchProgress(progress, datetime.now(timezone.utc))
+            self.stats["heartbeats"] += 1
+            if len(self._pending) >= self.max_pending:
+                self._wake.set()
+
+    def get(self, user_id: int, movie_id: int) -> Optional[WatchProgress]:
+        """The newest buffered progress for the pair, or None if it only lives in the database."""
+        key = (user_id, movie_id)
+        with self._lock:
+            return self._pending.get(key) or self._flushing.get(key)
+
+    def has_pending(self, user_id: int) -> bool:
+        """Whether any of the user's heartbeats are not in the database yet."""
+        with self._lock:
+            return any(key[0] == user_id for key in self._pending) or any(key[0] == user_id for key in self._flushing)
+
+    def flush(self) -> int:
+        """Write every pending heartbeat in one upsert; returns the number of rows written."""
+        with self._flush_lock:
+            with self._lock:
+                if not self._pending:
+                    return 0
+                pending, self._pending = self._pending, {}
+                self._flushing = pending
+            try:
+                written = self._write(pending)
+            except Exception:
+                with self._lock:
+                    # Keep the values for the next attempt, unless a newer heartbeat replaced them.
+                    for key, value in pending.items():
+                        self._pending.setdefault(key, value)
+                    self._flushing = {}
+                    self.stats["failed_flushes"] += 1
+                raise
+            with self._lock:
+                self._flushing = {}
+                self.stats["flushes"] += 1
+                self.stats["rows_written"] += written
+            return written
+
+    @staticmethod
+    def _write(pending: Dict[WatchKey, WatchProgress]) -> int:
+        with engine.begin() as connection:
+            # Movies removed from the library since the heartbeat are dropped.
+            movie_ids = {movie_id for _, movie_id in pending}
+            existing = set(connection.execute(select(Movie.id).where(Movie.id.in_(movie_ids))).scalars())
+            rows = [
+                {"user_id": user_id, "movie_id": movie_id, "progress": value.progress, "watched_at": value.watched_at}
+                for (user_id, movie_id), value in pending.items() if movie_id in existing
+            ]
+            if rows:
+                stmt = sqlite_insert(WatchHistory)
+                stmt = stmt.on_conflict_do_update(
+                    index_elements=[WatchHistory.user_id, WatchHistory.movie_id],
+                    set_={"progress": stmt.excluded.progress, "watched_at": stmt.excluded.watched_at},
+                )
+                connection.execute(stmt, rows)
+        return len(rows)
+
+    # ----- lifecycle -----
+
+    def start(self) -> None:
+        """Flush on a daemon thread (used from the FastAPI lifespan)."""
+        self._stop.clear()
+        self._thread = threading.Thread(target=self.run, name="watch-buffer", daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout: Optional[float] = 10.0) -> None:
+        """Stop the flush thread and write out whatever is still buffered."""
+        self._stop.set()
+        self._wake.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+        self.flush()
+
+    def run(self) -> None:
+        while not self._stop.is_set():
+            self._wake.wait(self.flush_interval)
+            self._wake.clear()
+            if self._stop.is_set():
+                return
+            try:
+                self.flush()
+            except Exception as e:
+                click.secho(f"[ERROR] Failed to flush watch progress: {e}", fg="red")
+
+    def summary(self) -> Dict[str, int]:
+        with self._lock:
+            return {**self.stats, "pending": len(self._pending)}
+
+
+watch_buffer = WatchBuffer()
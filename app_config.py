@@ -9,5 +9,60 @@ MEDIA_DIR:Path = Path(os.getenv("MEDIA_DIR") or BASE_DIR / "media")
 SECRET_KEY:str = os.getenv("SECRET_KEY") or "default"
 ALGORITHM:str = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES:int = 7*24*60  # 7 days
+BCRYPT_ROUNDS:int = int(os.getenv("BCRYPT_ROUNDS") or 0)  # 0: calibrate to BCRYPT_TARGET_MS at startup
+BCRYPT_TARGET_MS:float = float(os.getenv("BCRYPT_TARGET_MS") or 250.0)  # slowest acceptable hash when calibrating
+BCRYPT_CALIBRATION_PATH:Path = Path(os.getenv("BCRYPT_CALIBRATION_PATH") or BASE_DIR / "bcrypt_calibration.json")
+PASSWORD_HASH_WORKERS:int = int(os.getenv("PASSWORD_HASH_WORKERS") or 2)  # processes hashing passwords
+PASSWORD_HASH_QUEUE:int = int(os.getenv("PASSWORD_HASH_QUEUE") or 32)  # hashes allowed to wait before logins get a 503
+TOKEN_CACHE_SIZE:int = int(os.getenv("TOKEN_CACHE_SIZE") or 4096)  # verified tokens kept per process
+TOKEN_CACHE_TTL:float = float(os.getenv("TOKEN_CACHE_TTL") or 60.0)  # seconds before a token is checked against the DB again
+TOKEN_RECHECK_INTERVAL:float = float(os.getenv("TOKEN_RECHECK_INTERVAL") or 1.0)  # seconds between auth version reads
 
-MOVIE_MEDIA_DIR:Path = Path(os.getenv("MOVIE_MEDIA_DIR") or MEDIA_DIR / "movies")
\ No newline at end of file
+DATABASE_PATH:Path = Path(os.getenv("DATABASE_PATH") or BASE_DIR / "database.db")
+SQLITE_BUSY_TIMEOUT:int = int(os.getenv("SQLITE_BUSY_TIMEOUT") or 5000)  # ms to wait on a lock held by another process
+SQLITE_CACHE_SIZE:int = int(os.getenv("SQLITE_CACHE_SIZE") or -64000)  # pages, or KiB when negative (64 MB)
+SQLITE_MMAP_SIZE:int = int(os.getenv("SQLITE_MMAP_SIZE") or 256 * 1024 * 1024)
+DB_READ_POOL_SIZE:int = int(os.getenv("DB_READ_POOL_SIZE") or 8)  # read-only connections
+DB_WRITE_TIMEOUT:float = float(os.getenv("DB_WRITE_TIMEOUT") or 30.0)  # seconds to queue for the single writer
+DB_EXECUTOR_THREADS:int = int(os.getenv("DB_EXECUTOR_THREADS") or 16)  # threads running queries for async handlers
+
+MOVIE_MEDIA_DIR:Path = Path(os.getenv("MOVIE_MEDIA_DIR") or MEDIA_DIR / "movies")
+MUSIC_MEDIA_DIR:Path = Path(os.getenv("MUSIC_MEDIA_DIR") or MEDIA_DIR / "music")
+METADATA_CACHE_PATH:Path = Path(os.getenv("METADATA_CACHE_PATH") or BASE_DIR / "metadata_cache.db")
+
+WATCH_LIBRARY:bool = os.getenv("WATCH_LIBRARY", "0").lower() in ("1", "true", "yes")
+WATCH_DEBOUNCE:float = float(os.getenv("WATCH_DEBOUNCE") or 2.0)  # seconds a file must stay quiet
+WATCH_POLL_INTERVAL:float = float(os.getenv("WATCH_POLL_INTERVAL") or 30.0)  # polling fallback only
+WATCHER_MANIFEST_PATH:Path = Path(os.getenv("WATCHER_MANIFEST_PATH") or BASE_DIR / "watcher_manifest.json")
+WATCHER_STATUS_PATH:Path = Path(os.getenv("WATCHER_STATUS_PATH") or BASE_DIR / "watcher_status.json")  # for /health/watcher
+
+STREAM_CHUNK_SIZE:int = int(os.getenv("STREAM_CHUNK_SIZE") or 1024 * 1024)  # bytes per read/send
+STREAM_READAHEAD:int = int(os.getenv("STREAM_READAHEAD") or 8 * 1024 * 1024)  # posix_fadvise WILLNEED window
+STREAM_IO_THREADS:int = int(os.getenv("STREAM_IO_THREADS") or 16)  # threads reserved for file reads
+WATCH_FLUSH_INTERVAL:float = float(os.getenv("WATCH_FLUSH_INTERVAL") or 5.0)  # seconds between progress flushes
+WATCH_BUFFER_MAX:int = int(os.getenv("WATCH_BUFFER_MAX") or 10_000)  # pending (user, movie) pairs that force a flush
+
+STREAM_CACHE_SIZE:int = int(os.getenv("STREAM_CACHE_SIZE") or 1024)  # movie_id -> path/stat entries kept hot
+STREAM_CACHE_FRESHNESS:float = float(os.getenv("STREAM_CACHE_FRESHNESS") or 1.0)  # seconds a cached stat is trusted
+CATALOG_CACHE_SIZE:int = int(os.getenv("CATALOG_CACHE_SIZE") or 256)  # rendered catalog pages kept in memory
+CATALOG_RECHECK_INTERVAL:float = float(os.getenv("CATALOG_RECHECK_INTERVAL") or 1.0)  # seconds between catalog version reads
+
+IMAGE_CACHE_DIR:Path = Path(os.getenv("IMAGE_CACHE_DIR") or BASE_DIR / "image_cache")
+IMAGE_ORIGIN:str = os.getenv("IMAGE_ORIGIN") or ""  # e.g. http://127.0.0.1:9000 to fetch from a local mirror
+IMAGE_MAX_AGE:int = int(os.getenv("IMAGE_MAX_AGE") or 365 * 24 * 3600)  # image URLs are content-addressed
+
+METRICS_ENABLED:bool = os.getenv("METRICS_ENABLED", "1").lower() in ("1", "true", "yes")  # GET /metrics and request timing
+METRICS_MAX_MOVIES:int = int(os.getenv("METRICS_MAX_MOVIES") or 1000)  # movies with their own bytes-streamed series
+
+SQL_PROFILE:bool = os.getenv("SQL_PROFILE", "0").lower() in ("1", "true", "yes")  # per-request SQL profiling
+SQL_SLOW_QUERY_MS:float = float(os.getenv("SQL_SLOW_QUERY_MS") or 100.0)  # statements this slow go to the log
+SQL_N_PLUS_ONE_THRESHOLD:int = int(os.getenv("SQL_N_PLUS_ONE_THRESHOLD") or 5)  # same statement this often in one request
+SQL_PROFILE_LOG:Path = Path(os.getenv("SQL_PROFILE_LOG") or BASE_DIR / "sql_profile.log")
+SQL_PROFILE_LOG_BYTES:int = int(os.getenv("SQL_PROFILE_LOG_BYTES") or 10 * 1024 * 1024)  # rotate at this size
+SQL_PROFILE_LOG_BACKUPS:int = int(os.getenv("SQL_PROFILE_LOG_BACKUPS") or 5)  # rotated files kept
+
+SERVER_HOST:str = os.getenv("SERVER_HOST") or "0.0.0.0"
+SERVER_PORT:int = int(os.getenv("SERVER_PORT") or 8000)
+SERVER_WORKERS:int = int(os.getenv("SERVER_WORKERS") or 0)  # server.py --prod worker processes; 0: one per CPU
+SHUTDOWN_GRACE_PERIOD:float = float(os.getenv("SHUTDOWN_GRACE_PERIOD") or 30.0)  # seconds open streams get to finish on shutdown
+SKIP_SCHEMA_SETUP:bool = os.getenv("SKIP_SCHEMA_SETUP", "0").lower() in ("1", "true", "yes")  # set by server.py for its workers
@@ -0,0 +1,222 @@
+"""
+Before/after benchmark for the async catalog, watch and auth handlers.
+
+Starts one uvicorn worker on a throwaway database and replays the same mix of
+catalog pages, movie details and watch-progress reads through many keep-alive
+connections. The server exposes the current async handlers under /media and,
+for comparison, the previous style of handler under /sync: a plain ``def``
+with ``SessionDep`` calling the same query functions, run on Starlette's
+40-thread pool.
+
+Usage:
+    python -m benchmarks.async_routes --movies 20000 --connections 500 --seconds 10
+"""
+import asyncio
+import os
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+import typer
+
+from benchmarks.sqlite_concurrency import percentile, populate
+
+app = typer.Typer()
+
+# ================= Configuration =================
+HOST: str = "127.0.0.1"
+STARTUP_TIMEOUT: float = 30.0
+WARMUP_SECONDS: float = 2.0
+WATCH_USERS: int = 50
+
+
+def create_app():
+    """uvicorn factory: the real app plus the old sync handlers under /sync."""
+    from fastapi import APIRouter
+
+    from app.app import app as server
+    from app.routes.movies import fetch_movie_details, fetch_movie_page, find_watch_history
+    from database import SessionDep
+    from exceptions import MovieNotFoundException
+
+    router = APIRouter()
+
+    @router.get("/movies/")
+    def list_movies(db: SessionDep, limit: int = 20):
+        return fetch_movie_page(db, None, "name", "asc", None, limit)
+
+    @router.get("/movie/{movie_id}")
+    def get_movie_details(movie_id: int, db: SessionDep):
+        return fetch_movie_details(db, movie_id)
+
+    @router.get("/watch/{movie_id}")
+    def get_watch_history(movie_id: int, user_id: int, db: SessionDep):
+        history = find_watch_history(db, user_id, movie_id)
+        if not history:
+            raise MovieNotFoundException(movie_id)
+        return {"movie_id": movie_id, "user_id": user_id, "watched_at": history.watched_at, "progress": history.progress}
+
+    server.include_router(router, prefix="/sync")
+    return server
+
+
+def seed_watch_history(path: Path, movies: int) -> None:
+    from datetime import datetime, timezone
+
+    from sqlalchemy import insert
+
+    from database import create_sqlite_engine
+    from models import WatchHistory
+
+    engine = create_sqlite_engine(path)
+    now = datetime.now(timezone.utc)
+    with engine.begin() as connection:
+        connection.execute(insert(WatchHistory), [
+            {"user_id": user_id, "movie_id": movie_id, "progress": 50.0, "watched_at": now}
+            for user_id in range(1, WATCH_USERS + 1) for movie_id in range(1, min(movies, 100) + 1)
+        ])
+    engine.dispose()
+
+
+def request_paths(prefix: str, movies: int, count: int = 4096) -> List[str]:
+    paths = []
+    for _ in range(count):
+        kind = random.random()
+        if kind < 0.3:
+            paths.append(f"{prefix}/movies/?limit=20")
+        elif kind < 0.7:
+            paths.append(f"{prefix}/movie/{random.randint(1, movies)}")
+        else:
+            paths.append(f"{prefix}/watch/{random.randint(1, min(movies, 100))}?user_id={random.randint(1, WATCH_USERS)}")
+    return paths
+
+
+async def read_response(reader: asyncio.StreamReader) -> int:
+    head = await reader.readuntil(b"\r\n\r\n")
+    status = int(head.split(b" ", 2)[1])
+    length = 0
+    for line in head.split(b"\r\n")[1:]:
+        name, _, value = line.partition(b":")
+        if name.strip().lower() == b"content-length":
+            length = int(value)
+    await reader.readexactly(length)
+    return status
+
+
+async def client(port: int, paths: List[str], deadline: float, latencies: List[float], errors: Dict[str, int]) -> None:
+    try:
+        reader, writer = await asyncio.open_connection(HOST, port)
+    except OSError:
+        errors["connect"] += 1
+        return
+    index = random.randrange(len(paths))
+    try:
+        while time.perf_counter() < deadline:
+            path = paths[index % len(paths)]
+            index += 1
+            started = time.perf_counter()
+            writer.write(f"GET {path} HTTP/1.1\r\nHost: {HOST}\r\n\r\n".encode())
+            status = await read_response(reader)
+            if status != 200:
+                errors["status"] += 1
+                continue
+            latencies.append(time.perf_counter() - started)
+    except (OSError, asyncio.IncompleteReadError):
+        errors["connection"] += 1
+    finally:
+        writer.close()
+
+
+async def load(port: int, paths: List[str], connections: int, seconds: float) -> Dict[str, float]:
+    latencies: List[float] = []
+    errors = {"connect": 0, "connection": 0, "status": 0}
+    deadline = time.perf_counter() + seconds
+    await asyncio.gather(*(client(port, paths, deadline, latencies, errors) for _ in range(connections)))
+    return {
+        "rps": len(latencies) / seconds,
+        "p50_ms": percentile(latencies, 0.5) * 1000,
+        "p99_ms": percentile(latencies, 0.99) * 1000,
+        "errors": sum(errors.values()),
+    }
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind((HOST, 0))
+        return sock.getsockname()[1]
+
+
+def wait_for_server(port: int, process: subprocess.Popen) -> None:
+    deadline = time.monotonic() + STARTUP_TIMEOUT
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError("server exited during startup")
+        try:
+            socket.create_connection((HOST, port), timeout=0.5).close()
+            return
+        except OSError:
+            time.sleep(0.1)
+    raise RuntimeError("server did not start")
+
+
+def start_server(database: Path, port: int) -> subprocess.Popen:
+    env = {**os.environ, "DATABASE_PATH": str(database)}
+    return subprocess.Popen(
+        [
+            sys.executable, "-m", "uvicorn", "benchmarks.async_routes:create_app", "--factory",
+            "--host", HOST, "--port", str(port), "--log-level", "warning", "--no-access-log",
+            "--backlog", "4096",
+        ],
+        env=env, cwd=Path(__file__).resolve().parent.parent,
+    )
+
+
+def report(name: str, result: Dict[str, float]) -> None:
+    typer.echo(
+        f"  {name:<28} {result['rps']:9.1f} req/s  p50 {result['p50_ms']:7.1f} ms  "
+        f"p99 {result['p99_ms']:7.1f} ms  errors {result['errors']:.0f}"
+    )
+
+
+@app.command()
+def main(movies: int = 20_000, connections: int = 500, seconds: float = 10.0):
+    from database import create_sqlite_engine
+
+    results: Dict[str, Dict[str, float]] = {}
+    with tempfile.TemporaryDirectory() as directory:
+        database = Path(directory) / "bench.db"
+        engine = create_sqlite_engine(database)
+        populate(engine, movies)
+        engine.dispose()
+        seed_watch_history(database, movies)
+
+        port = free_port()
+        process: Optional[subprocess.Popen] = start_server(database, port)
+        try:
+            wait_for_server(port, process)
+            typer.secho(
+                f"\n🚀 {connections} connections, {seconds:.0f}s per run, {movies} movies",
+                fg=typer.colors.BRIGHT_BLUE, bold=True,
+            )
+            runs: List[Tuple[str, str]] = [("before (sync def, threadpool)", "/sync"), ("after (async, DB executor)", "/media")]
+            for name, prefix in runs:
+                paths = request_paths(prefix, movies)
+                asyncio.run(load(port, paths, min(connections, 50), WARMUP_SECONDS))
+                results[name] = asyncio.run(load(port, paths, connections, seconds))
+                report(name, results[name])
+        finally:
+            process.terminate()
+            process.wait()
+
+    before, after = (results[name] for name, _ in runs)
+    speedup = after["rps"] / before["rps"] if before["rps"] else float("inf")
+    typer.secho(f"\n✅ async handlers: {speedup:.2f}x requests per second", fg=typer.colors.BRIGHT_GREEN)
+
+
+if __name__ == "__main__":
+    app()
@@ -0,0 +1,155 @@
+"""
+Correctness and speed of the faststart remux (jobs/movie/faststart.py).
+
+Builds synthetic MP4 files with the index after the media data, rewrites
+them and checks that every chunk offset in the new index points at that
+chunk's bytes. The layouts cover a plain ``mdat`` + ``moov``, a second
+``mdat`` after ``moov`` (its chunks only move when the index grows), and both
+again with the stco limit lowered so every table is upgraded to co64, which
+is what makes the index grow. A larger file (``--size-mb``) is then rewritten
+to time the copy. The command exits non-zero if any check fails.
+
+Usage:
+    python -m benchmarks.faststart --size-mb 256
+"""
+import struct
+import tempfile
+import time
+from pathlib import Path
+from typing import Iterator, List, Tuple
+
+import typer
+
+from jobs.movie import faststart
+from jobs.movie.probe import MP4_CONTAINERS, iter_boxes
+
+app = typer.Typer()
+
+# ================= Configuration =================
+CHUNK_SIZE: int = 4096
+CHUNKS_PER_TRACK: int = 64
+LAYOUTS: Tuple[Tuple[str, int, bool], ...] = (
+    # (name, chunks in an mdat after moov, force co64)
+    ("mdat, moov", 0, False),
+    ("mdat, moov, mdat", 16, False),
+    ("mdat, moov (co64)", 0, True),
+    ("mdat, moov, mdat (co64)", 16, True),
+)
+
+
+def box(box_type: bytes, payload: bytes) -> bytes:
+    return struct.pack(">I4s", 8 + len(payload), box_type) + payload
+
+
+def chunk(index: int, size: int) -> bytes:
+    return f"<chunk {index:06d}>".encode().ljust(size, b".")
+
+
+def build_mp4(path: Path, before: int, after: int, chunk_size: int = CHUNK_SIZE) -> List[bytes]:
+    """
+    Write ``ftyp, mdat, moov[, mdat]`` with two tracks whose chunks alternate;
+    returns every chunk in index order (track 1's table, then track 2's).
+    """
+    chunks = [chunk(index, chunk_size) for index in range(before + after)]
+    ftyp = box(b"ftyp", b"isom\0\0\0\0isomavc1")
+    head = ftyp + struct.pack(">I4s", 8 + before * chunk_size, b"mdat")
+    offsets = [len(head) + index * chunk_size for index in range(before)]
+
+    def moov(tail_start: int) -> bytes:
+        all_offsets = offsets + [tail_start + 8 + index * chunk_size for index in range(after)]
+        traks = b"".join(
+            box(b"trak", box(b"mdia", box(b"minf", box(b"stbl", box(
+                b"stco", b"\0\0\0\0" + struct.pack(f">I{len(track)}I", len(track), *track),
+            )))))
+            for track in (all_offsets[0::2], all_offsets[1::2])
+        )
+        return box(b"moov", box(b"mvhd", bytes(100)) + traks)
+
+    moov_start = len(head) + before * chunk_size
+    index_box = moov(moov_start + len(moov(0)))  # the offsets do not change the table sizes
+    with open(path, "wb") as f:
+        f.write(head)
+        f.writelines(chunks[:before])
+        f.write(index_box)
+        if after:
+            f.write(struct.pack(">I4s", 8 + after * chunk_size, b"mdat"))
+            f.writelines(chunks[before:])
+    return chunks[0::2] + chunks[1::2]
+
+
+def chunk_offsets(data: bytes, start: int, end: int) -> Iterator[int]:
+    """Every stco/co64 offset below ``[start, end)``, in table order."""
+    for box_type, _, payload, box_end in iter_boxes(data, start, end):
+        if box_type in MP4_CONTAINERS:
+            yield from chunk_offsets(data, payload, box_end)
+        elif box_type in (b"stco", b"co64"):
+            count = struct.unpack_from(">I", data, payload + 4)[0]
+            yield from struct.unpack_from(f">{count}{'I' if box_type == b'stco' else 'Q'}", data, payload + 8)
+
+
+def check(path: Path, target: Path, chunks: List[bytes]) -> List[str]:
+    """Rewrite ``path`` to ``target`` and return what is wrong with the result."""
+    plan = faststart.plan_faststart(path)
+    if plan is None:
+        return ["not detected as needing faststart"]
+    faststart.write_faststart(plan, target)
+    data = target.read_bytes()
+    problems: List[str] = []
+    if len(data) != plan.size + plan.moov_growth:
+        problems.append(f"size {len(data)}, expected {plan.size + plan.moov_growth}")
+    boxes = {box_type: (payload, end) for box_type, _, payload, end in iter_boxes(data, 0, len(data))}
+    top = [box_type for box_type, _, _, _ in iter_boxes(data, 0, len(data))]
+    if top.index(b"moov") > top.index(b"mdat"):
+        problems.append("moov still after mdat")
+    offsets = list(chunk_offsets(data, *boxes[b"moov"]))
+    if len(offsets) != len(chunks):
+        problems.append(f"{len(offsets)} chunk offsets, expected {len(chunks)}")
+    bad = [index for index, (offset, expected) in enumerate(zip(offsets, chunks)) if data[offset:offset + len(expected)] != expected]
+    if bad:
+        problems.append(f"{len(bad)} of {len(chunks)} offsets point at the wrong bytes (first: chunk {bad[0]})")
+    return problems
+
+
+@app.command()
+def main(
+    size_mb: int = typer.Option(256, help="Size of the file rewritten for the timing run."),
+):
+    failures = 0
+    with tempfile.TemporaryDirectory(prefix="velofy-faststart-") as tmp:
+        directory = Path(tmp)
+        typer.secho("🧪 Checking chunk offsets after faststart...", fg=typer.colors.BRIGHT_MAGENTA)
+        for name, after, force_co64 in LAYOUTS:
+            path = directory / "movie.mp4"
+            chunks = build_mp4(path, CHUNKS_PER_TRACK * 2, after)
+            limit = faststart.STCO_MAX_OFFSET
+            if force_co64:
+                faststart.STCO_MAX_OFFSET = 0  # every offset is "too big": all tables become co64
+            try:
+                problems = check(path, directory / "movie.faststart.mp4", chunks)
+            finally:
+                faststart.STCO_MAX_OFFSET = limit
+            if problems:
+                failures += 1
+                typer.secho(f"❌ {name}: {'; '.join(problems)}", fg=typer.colors.RED)
+            else:
+                typer.secho(f"✅ {name}: {len(chunks)} chunk offsets correct", fg=typer.colors.GREEN)
+
+        path = directory / "large.mp4"
+        chunk_size = 1024 * 1024
+        chunks = build_mp4(path, size_mb - 8, 8, chunk_size=chunk_size)
+        started = time.perf_counter()
+        problems = check(path, directory / "large.faststart.mp4", chunks)
+        elapsed = time.perf_counter() - started
+        if problems:
+            failures += 1
+            typer.secho(f"❌ {size_mb} MB: {'; '.join(problems)}", fg=typer.colors.RED)
+        typer.secho(
+            f"⏱️ {size_mb} MB rewritten and verified in {elapsed:.2f}s ({size_mb / elapsed:.0f} MB/s)",
+            fg=typer.colors.BRIGHT_BLUE,
+        )
+    if failures:
+        raise typer.Exit(1)
+
+
+if __name__ == "__main__":
+    app()
@@ -0,0 +1,189 @@
+"""
+Synthetic media library for benchmarks.
+
+Writes a database with ``--size`` movies, cast members and watch-history rows
+(1k, 100k or 1M of each), built through the same schema setup as the server,
+so the search index, catalog triggers and indexes are all in place. Titles,
+plots and cast names are drawn from a small vocabulary, so searches find
+something. Every user has the password ``BENCH_PASSWORD``, hashed once at the
+cost the server will use.
+
+Movies point at a handful of sparse media files (``--media-files`` of
+``--media-gb`` GB each). They take no disk space but can be seeked and read
+like real multi-GB files. A ``library.json`` manifest next to the database
+records what was generated; ``benchmarks.suite`` reads it.
+
+Usage:
+    python -m benchmarks.library --size 100k --out /tmp/velofy-bench
+"""
+import json
+import random
+import time
+from datetime import datetime, timedelta
+from pathlib import Path
+from typing import Any, Dict, Iterator, List
+
+import typer
+from passlib.hash import bcrypt
+
+from app.password_hasher import DEFAULT_ROUNDS
+from app_config import BCRYPT_ROUNDS
+from database import catalog_bulk_write, create_db_and_tables, create_sqlite_engine
+from search import rebuild_search_index, suspended_sync
+
+app = typer.Typer()
+
+# ================= Configuration =================
+SIZES: Dict[str, int] = {"1k": 1_000, "100k": 100_000, "1m": 1_000_000}
+CAST_PER_MOVIE: int = 5
+HISTORY_PER_USER: int = 50
+BENCH_PASSWORD: str = "benchmark-password"
+CHUNK_ROWS: int = 50_000
+MANIFEST_NAME: str = "library.json"
+CATEGORIES = ("Action", "Drama", "Comedy", "Thriller", "Horror", "Romance", "Sci-Fi", "Documentary")
+WORDS = (
+    "night", "city", "river", "ghost", "summer", "empire", "silent", "storm", "garden", "machine",
+    "winter", "shadow", "ocean", "broken", "golden", "island", "secret", "fire", "mirror", "letter",
+    "station", "dance", "hunter", "paper", "glass", "forest", "desert", "moon", "signal", "crown",
+    "echo", "harbor", "iron", "velvet", "orbit", "canyon", "lantern", "tiger", "circus", "frontier",
+)
+FIRST_NAMES = ("Ada", "Ben", "Chloe", "Dev", "Elena", "Farid", "Grace", "Hiro", "Ines", "Jonas", "Kemi", "Luca")
+LAST_NAMES = ("Stone", "Okafor", "Marsh", "Ito", "Novak", "Reyes", "Quinn", "Larsen", "Haddad", "Moreau")
+
+
+def phrase(words: int) -> str:
+    return " ".join(random.choices(WORDS, k=words))
+
+
+def chunks(rows: Iterator[tuple], size: int = CHUNK_ROWS) -> Iterator[List[tuple]]:
+    batch: List[tuple] = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def create_media_files(directory: Path, count: int, size_gb: float) -> List[str]:
+    """Sparse files of ``size_gb`` GB: a few bytes on disk, any offset readable."""
+    directory.mkdir(parents=True, exist_ok=True)
+    paths = []
+    for index in range(count):
+        path = directory / f"synthetic-{index:02d}.mp4"
+        with open(path, "wb") as handle:
+            handle.truncate(int(size_gb * 1024 ** 3))
+        paths.append(str(path))
+    return paths
+
+
+def movie_rows(count: int, media: List[str]) -> Iterator[tuple]:
+    added = datetime(2020, 1, 1)
+    for index in range(1, count + 1):
+        yield (
+            index, f"tt{index:08d}", f"{phrase(2).title()} {index}", random.uniform(80, 180), round(random.uniform(1, 10), 1),
+            random.choice(CATEGORIES), 1500.0, random.randint(1950, 2025), f"tt{index:08d}.mp4", "",
+            phrase(30), phrase(60), "", media[index % len(media)], (added + timedelta(minutes=index)).isoformat(sep=" "),
+        )
+
+
+def history_rows(users: int, movies: int, rows: int) -> Iterator[tuple]:
+    started = datetime(2024, 1, 1)
+    per_user = max(1, min(HISTORY_PER_USER, movies))
+    written = 0
+    for user_id in range(1, users + 1):
+        for movie_id in random.sample(range(1, movies + 1), per_user):
+            if written >= rows:
+                return
+            watched_at = started + timedelta(minutes=random.randrange(500_000))
+            yield user_id, movie_id, watched_at.isoformat(sep=" "), random.uniform(0, 100)
+            written += 1
+
+
+def build_library(directory: Path, movies: int, media_files: int = 8, media_gb: float = 4.0) -> Dict[str, Any]:
+    directory.mkdir(parents=True, exist_ok=True)
+    database = directory / "bench.db"
+    if database.exists():
+        raise typer.BadParameter(f"{database} already exists")
+    media = create_media_files(directory / "media", media_files, media_gb)
+    cast = max(1, movies)
+    users = max(1, movies // HISTORY_PER_USER)
+    rounds = BCRYPT_ROUNDS or DEFAULT_ROUNDS
+    password_hash = bcrypt.using(rounds=rounds).hash(BENCH_PASSWORD)
+
+    engine = create_sqlite_engine(database)
+    create_db_and_tables(engine)
+    with engine.begin() as connection, catalog_bulk_write(connection), suspended_sync(connection):
+        for batch in chunks(movie_rows(movies, media)):
+            connection.exec_driver_sql(
+                "INSERT INTO movie (id, imdb_id, name, duration, rating, category, size, published_year, filename, "
+                "thumbnail, plot, synopsis, subtitles, location, added_date) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                batch,
+            )
+        cast_rows = ((index, f"{random.choice(FIRST_NAMES)} {random.choice(LAST_NAMES)} {index}", "Actor") for index in range(1, cast + 1))
+        for batch in chunks(cast_rows):
+            connection.exec_driver_sql('INSERT INTO "cast" (id, name, role) VALUES (?, ?, ?)', batch)
+        links = (
+            (movie_id, cast_id, order)
+            for movie_id in range(1, movies + 1)
+            for order, cast_id in enumerate(random.sample(range(1, cast + 1), min(CAST_PER_MOVIE, cast)))
+        )
+        for batch in chunks(links):
+            connection.exec_driver_sql('INSERT INTO moviecastlink (movie_id, cast_id, "order") VALUES (?, ?, ?)', batch)
+        rebuild_search_index(connection)
+    with engine.begin() as connection:
+        user_rows = ((user_id, f"user{user_id}", password_hash, "2024-01-01 00:00:00") for user_id in range(1, users + 1))
+        for batch in chunks(user_rows):
+            connection.exec_driver_sql("INSERT INTO user (id, username, password_hash, created_at) VALUES (?, ?, ?, ?)", batch)
+        for batch in chunks(history_rows(users, movies, movies)):
+            connection.exec_driver_sql(
+                "INSERT INTO watchhistory (user_id, movie_id, watched_at, progress) VALUES (?, ?, ?, ?)", batch,
+            )
+        connection.exec_driver_sql("ANALYZE")
+    engine.dispose()
+
+    manifest = {
+        "database": str(database),
+        "movies": movies,
+        "cast": cast,
+        "users": users,
+        "history": min(movies, users * min(HISTORY_PER_USER, movies)),
+        "password": BENCH_PASSWORD,
+        "bcrypt_rounds": rounds,
+        "media": media,
+        "media_bytes": int(media_gb * 1024 ** 3),
+        "words": list(WORDS),
+        "categories": list(CATEGORIES),
+    }
+    (directory / MANIFEST_NAME).write_text(json.dumps(manifest, indent=2))
+    return manifest
+
+
+def load_manifest(directory: Path) -> Dict[str, Any]:
+    return json.loads((directory / MANIFEST_NAME).read_text())
+
+
+@app.command()
+def main(
+    out: Path = typer.Option(..., help="Directory for the database, media files and manifest."),
+    size: str = typer.Option("100k", help=f"Catalog size: {', '.join(SIZES)} or a number of movies."),
+    media_files: int = typer.Option(8, help="Number of sparse media files the movies point at."),
+    media_gb: float = typer.Option(4.0, help="Apparent size of each media file in GB."),
+    seed: int = typer.Option(42, help="Random seed, so runs generate the same library."),
+):
+    random.seed(seed)
+    movies = SIZES.get(size.lower()) or int(size)
+    started = time.perf_counter()
+    typer.secho(f"🏗️  Generating {movies} movies in {out}...", fg=typer.colors.BRIGHT_BLUE)
+    manifest = build_library(out, movies, media_files, media_gb)
+    typer.secho(
+        f"✅ {manifest['movies']} movies, {manifest['cast']} cast, {manifest['users']} users, "
+        f"{manifest['history']} history rows, {len(manifest['media'])} x {media_gb:g} GB media "
+        f"({time.perf_counter() - started:.1f}s)",
+        fg=typer.colors.BRIGHT_GREEN,
+    )
+
+
+if __name__ == "__main__":
+    app()
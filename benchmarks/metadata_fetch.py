@@ -0,0 +1,131 @@
+"""
+Before/after benchmark for the metadata lookups of the movie jobs.
+
+Looks up a synthetic library on ``StubProvider`` (jobs/movie/fetcher.py), a
+Cinemagoer stand-in with configurable latency and failure rate, three ways:
+
+- before: the previous serial flow, one movie after another, then one
+  ``get_person`` call per cast member and director, with no retries.
+- after: ``MetadataFetcher`` with its worker pool, rate limiter and retries,
+  looking each person up once however many films they are in.
+- warm: ``MetadataFetcher`` again with a warm ``LookupCache``, as a rescan
+  of an unchanged library would run.
+
+It reports wall time, provider calls and failed lookups for each, and checks
+that the concurrent results match a serial run of the same fetcher.
+
+Usage:
+    python -m benchmarks.metadata_fetch --movies 30 --latency 0.05 --workers 16
+"""
+import tempfile
+import time
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+
+import typer
+
+from jobs.movie.cache import LookupCache
+from jobs.movie.fetcher import MetadataFetcher, StubProvider
+from jobs.movie.interfaces import ProviderMovie, ProviderPerson
+
+app = typer.Typer()
+
+# ================= Configuration =================
+FIRST_MOVIE_ID: int = 1_000_000
+
+
+def serial_lookups(provider: StubProvider, movie_ids: List[str]) -> Tuple[int, int]:
+    """The flow before the worker pool; returns (movies found, failed lookups)."""
+    found, failed = 0, 0
+    for movie_id in movie_ids:
+        try:
+            movie = provider.get_movie(movie_id)
+        except Exception:
+            failed += 1
+            continue
+        found += 1
+        for person in movie["cast"] + movie["director"]:
+            try:
+                provider.get_person(person["person_id"])
+            except Exception:
+                failed += 1
+    return found, failed
+
+
+def fetch_all(
+    fetcher: MetadataFetcher, movie_ids: List[str],
+) -> Tuple[Dict[str, Optional[ProviderMovie]], Dict[str, Optional[ProviderPerson]]]:
+    movies = fetcher.fetch_movies(movie_ids)
+    people = fetcher.fetch_people(
+        person["person_id"]
+        for movie in movies.values() if movie is not None
+        for person in movie["cast"] + movie["director"]
+    )
+    return movies, people
+
+
+def report(name: str, elapsed: float, calls: int, failed: int, baseline: Optional[float] = None) -> None:
+    speedup = f", {baseline / elapsed:.1f}x faster" if baseline else ""
+    typer.secho(
+        f"{name:>8}: {elapsed:7.2f}s, {calls:6d} provider calls, {failed:4d} failed lookups{speedup}",
+        fg=typer.colors.BRIGHT_BLUE,
+    )
+
+
+def failures(results: Tuple[Dict[str, Any], Dict[str, Any]]) -> int:
+    return sum(value is None for result in results for value in result.values())
+
+
+@app.command()
+def main(
+    movies: int = typer.Option(30, help="Movies in the synthetic library."),
+    latency: float = typer.Option(0.05, help="Seconds per provider call."),
+    failure_rate: float = typer.Option(0.0, help="Share of provider calls that fail like a network error."),
+    people: int = typer.Option(600, help="Distinct people the casts are drawn from (fewer means more overlap)."),
+    workers: int = typer.Option(16, help="Lookup workers for the after runs."),
+    rate: float = typer.Option(0.0, help="Provider calls per second for the after runs (0: unlimited)."),
+    retries: int = typer.Option(3, help="Retries per failed lookup for the after runs."),
+    skip_before: bool = typer.Option(False, help="Skip the serial run, which is the slow one."),
+):
+    movie_ids = [str(FIRST_MOVIE_ID + index) for index in range(movies)]
+
+    def provider() -> StubProvider:
+        return StubProvider(latency=latency, jitter=latency / 4, failure_rate=failure_rate, people=people)
+
+    typer.secho(
+        f"🎬 {movies} movies, {latency * 1000:.0f} ms per call, {failure_rate:.0%} failures, "
+        f"{workers} workers, rate {rate or 'unlimited'}\n",
+        fg=typer.colors.BRIGHT_MAGENTA,
+    )
+    baseline = None
+    if not skip_before:
+        stub = provider()
+        started = time.perf_counter()
+        _, failed = serial_lookups(stub, movie_ids)
+        baseline = time.perf_counter() - started
+        report("before", baseline, stub.calls, failed)
+
+    with tempfile.TemporaryDirectory(prefix="velofy-fetch-") as tmp:
+        cache = LookupCache(Path(tmp) / "cache.db")
+        for name in ("after", "warm"):
+            stub = provider()
+            fetcher = MetadataFetcher(stub, workers=workers, rate=rate, retries=retries, cache=cache)
+            started = time.perf_counter()
+            results = fetch_all(fetcher, movie_ids)
+            report(name, time.perf_counter() - started, stub.calls, failures(results), baseline)
+        cache.close()
+
+    if failure_rate == 0:
+        # Same answers without the latency: only the order of completion differs.
+        concurrent = fetch_all(
+            MetadataFetcher(StubProvider(latency=0, jitter=0.001, people=people), workers=workers, rate=0), movie_ids,
+        )
+        serial = fetch_all(MetadataFetcher(StubProvider(latency=0, jitter=0, people=people), workers=1, rate=0), movie_ids)
+        if concurrent != serial or list(concurrent[0]) != list(serial[0]):
+            typer.secho("❌ Concurrent results differ from a serial run", fg=typer.colors.RED)
+            raise typer.Exit(1)
+        typer.secho("✅ Concurrent results match a serial run, in the same order", fg=typer.colors.GREEN)
+
+
+if __name__ == "__main__":
+    app()
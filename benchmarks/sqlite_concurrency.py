@@ -0,0 +1,180 @@
+"""
+Concurrency check for the SQLite engine layer.
+
+Runs the same mixed workload against a throwaway database twice: once with
+the old setup (one default engine, rollback journal) and once with the tuned
+engines from database.py (WAL, pragmas, read-only pool plus one serialized
+writer). Reader threads run long catalog scans back to back, while writer
+threads upsert watch progress one row per transaction, as heartbeats do.
+
+With the old setup, writes stall behind the scans (and some fail with
+"database is locked"). With the tuned engines, reads and writes no longer
+block each other: the command exits non-zero if any tuned write fails or
+waits longer than the slowest scan.
+
+Usage:
+    python -m benchmarks.sqlite_concurrency --movies 200000 --seconds 5
+"""
+import random
+import tempfile
+import threading
+import time
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Dict, List, Tuple
+
+import typer
+from sqlalchemy import Engine, create_engine, insert, text
+from sqlalchemy.exc import OperationalError
+from sqlmodel import SQLModel
+
+import models  # noqa: F401  (registers the tables on SQLModel.metadata)
+from database import create_sqlite_engine, ensure_watch_history_index
+
+app = typer.Typer()
+
+# ================= Configuration =================
+SCAN_SQL = (
+    "SELECT category, count(*), avg(rating) FROM movie "
+    "WHERE name LIKE '%a%' OR plot LIKE '%e%' GROUP BY category"
+)
+UPSERT_SQL = (
+    "INSERT INTO watchhistory (user_id, movie_id, watched_at, progress) VALUES (:user_id, :movie_id, :watched_at, :progress) "
+    "ON CONFLICT (user_id, movie_id) DO UPDATE SET progress = excluded.progress, watched_at = excluded.watched_at"
+)
+CATEGORIES = ("Action", "Drama", "Comedy", "Thriller", "Horror", "Romance", "Sci-Fi", "Documentary")
+
+
+def populate(engine: Engine, movies: int) -> None:
+    SQLModel.metadata.create_all(engine)
+    with engine.begin() as connection:
+        ensure_watch_history_index(connection)
+        rows = [
+            {
+                "imdb_id": f"tt{index:08d}", "name": f"Movie {index} {random.choice('aeiou') * 3}",
+                "duration": 120.0, "rating": random.uniform(1, 10), "category": random.choice(CATEGORIES),
+                "size": 1.5, "published_year": 2000 + index % 25, "filename": f"tt{index:08d}.mp4",
+                "thumbnail": "", "plot": "A plot " * 20, "synopsis": "", "subtitles": "",
+                "location": f"/media/tt{index:08d}.mp4",
+            }
+            for index in range(movies)
+        ]
+        connection.execute(insert(models.Movie), rows)
+
+
+def percentile(values: List[float], pct: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * pct))]
+
+
+def run_workload(
+    read_engine: Engine, write_engine: Engine, readers: int, writers: int, seconds: float, movies: int,
+) -> Dict[str, float]:
+    stop = threading.Event()
+    lock = threading.Lock()
+    read_times: List[float] = []
+    write_times: List[float] = []
+    errors = {"read": 0, "write": 0}
+
+    def reader() -> None:
+        while not stop.is_set():
+            started = time.perf_counter()
+            try:
+                with read_engine.connect() as connection:
+                    connection.execute(text(SCAN_SQL)).all()
+            except OperationalError:
+                with lock:
+                    errors["read"] += 1
+                continue
+            with lock:
+                read_times.append(time.perf_counter() - started)
+
+    def writer(user_id: int) -> None:
+        while not stop.is_set():
+            params = {
+                "user_id": user_id, "movie_id": random.randrange(1, movies + 1),
+                "watched_at": datetime.now(timezone.utc), "progress": random.uniform(0, 100),
+            }
+            started = time.perf_counter()
+            try:
+                with write_engine.begin() as connection:
+                    connection.execute(text(UPSERT_SQL), params)
+            except OperationalError:
+                with lock:
+                    errors["write"] += 1
+                continue
+            with lock:
+                write_times.append(time.perf_counter() - started)
+            time.sleep(0.005)  # heartbeats arrive spread out, not in a tight loop
+
+    threads = [threading.Thread(target=reader) for _ in range(readers)]
+    threads += [threading.Thread(target=writer, args=(user_id,)) for user_id in range(writers)]
+    for thread in threads:
+        thread.start()
+    time.sleep(seconds)
+    stop.set()
+    for thread in threads:
+        thread.join()
+
+    return {
+        "reads": len(read_times) / seconds,
+        "read_p50_ms": percentile(read_times, 0.5) * 1000,
+        "read_max_ms": max(read_times, default=0.0) * 1000,
+        "read_errors": errors["read"],
+        "writes": len(write_times) / seconds,
+        "write_p50_ms": percentile(write_times, 0.5) * 1000,
+        "write_p99_ms": percentile(write_times, 0.99) * 1000,
+        "write_max_ms": max(write_times, default=0.0) * 1000,
+        "write_errors": errors["write"],
+    }
+
+
+def baseline_engines(path: Path) -> Tuple[Engine, Engine]:
+    engine = create_engine(f"sqlite:///{path}", connect_args={"check_same_thread": False})
+    return engine, engine
+
+
+def tuned_engines(path: Path) -> Tuple[Engine, Engine]:
+    writer = create_sqlite_engine(path)
+    reader = create_sqlite_engine(path, read_only=True, pool_size=8, max_overflow=-1)
+    return reader, writer
+
+
+def report(name: str, result: Dict[str, float]) -> None:
+    typer.secho(f"\n{name}", fg=typer.colors.BRIGHT_BLUE, bold=True)
+    typer.echo(
+        f"  reads : {result['reads']:8.1f}/s  p50 {result['read_p50_ms']:7.1f} ms  "
+        f"max {result['read_max_ms']:7.1f} ms  errors {result['read_errors']:.0f}"
+    )
+    typer.echo(
+        f"  writes: {result['writes']:8.1f}/s  p50 {result['write_p50_ms']:7.1f} ms  "
+        f"p99 {result['write_p99_ms']:7.1f} ms  max {result['write_max_ms']:7.1f} ms  errors {result['write_errors']:.0f}"
+    )
+
+
+@app.command()
+def main(movies: int = 200_000, readers: int = 4, writers: int = 4, seconds: float = 5.0):
+    results: Dict[str, Dict[str, float]] = {}
+    for name, make_engines in (("baseline (default engine, rollback journal)", baseline_engines),
+                               ("tuned (WAL, read pool + single writer)", tuned_engines)):
+        with tempfile.TemporaryDirectory() as directory:
+            path = Path(directory) / "bench.db"
+            read_engine, write_engine = make_engines(path)
+            populate(write_engine, movies)
+            results[name] = run_workload(read_engine, write_engine, readers, writers, seconds, movies)
+            read_engine.dispose()
+            write_engine.dispose()
+        report(name, results[name])
+
+    tuned = results["tuned (WAL, read pool + single writer)"]
+    blocked = tuned["write_errors"] > 0 or tuned["write_max_ms"] > tuned["read_max_ms"]
+    if blocked:
+        typer.secho("\n❌ Writes were blocked by reads with the tuned engines", fg=typer.colors.RED)
+        raise typer.Exit(code=1)
+    typer.secho("\n✅ Reads and writes ran without blocking each other", fg=typer.colors.BRIGHT_GREEN)
+
+
+if __name__ == "__main__":
+    app()
@@ -0,0 +1,353 @@
+"""
+Load and latency suite for the main request paths.
+
+Runs each scenario against a synthetic library (see ``benchmarks.library``)
+with many concurrent clients, one after the other:
+
+* catalog     - catalog pages (random category and sort) and movie details
+* search      - full-text search for two vocabulary words
+* range_seek  - 256 KiB Range reads at random offsets of multi-GB files
+* login       - password login for random users
+* heartbeat   - watch-progress heartbeats
+
+Two modes drive the same scenarios. ``inprocess`` calls the ASGI app directly
+(no sockets), so it measures the handlers and the layers beneath them; its
+peak RSS covers the clients too. ``loopback`` starts a uvicorn server on
+127.0.0.1 and goes through real HTTP; its peak RSS is the server's alone.
+Each scenario reports throughput, p50/p95/p99 latency, non-2xx responses
+and peak RSS, which is reset between scenarios through
+``/proc/<pid>/clear_refs``. On systems without it, the value is the peak so far.
+
+Results are written as JSON. Given ``--baseline``, the run is compared with
+an earlier result file: a scenario whose p95 rises or whose throughput drops
+by more than ``--tolerance``, or that fails more often, is flagged, and the
+command exits non-zero.
+``compare`` does the same for two saved files.
+
+Usage:
+    python -m benchmarks.library --size 100k --out /tmp/velofy-bench
+    python -m benchmarks.suite run --library /tmp/velofy-bench --output before.json
+    python -m benchmarks.suite run --library /tmp/velofy-bench --baseline before.json --output after.json
+    python -m benchmarks.suite compare before.json after.json
+"""
+import asyncio
+import json
+import os
+import platform
+import random
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Any, Callable, Dict, List, NamedTuple, Optional
+
+import httpx
+import typer
+
+# Nothing from the app is imported up here: it reads its configuration (the
+# database path above all) at import, and ``run`` has to set that first.
+
+app = typer.Typer()
+
+# ================= Configuration =================
+HOST: str = "127.0.0.1"
+MODES = ("inprocess", "loopback")
+SCENARIOS = ("catalog", "search", "range_seek", "login", "heartbeat")
+WARMUP_SECONDS: float = 1.0
+SEEK_BYTES: int = 256 * 1024
+TOLERANCE: float = 0.15  # relative p95 rise / throughput drop that counts as a regression
+ERROR_RATE_SLACK: float = 0.01  # share of non-2xx responses that may be added before it counts
+REPO_ROOT = Path(__file__).resolve().parent.parent
+
+
+class Call(NamedTuple):
+    method: str
+    url: str
+    options: Dict[str, Any]  # extra arguments for httpx.AsyncClient.request
+
+
+# ================= Scenarios =================
+def catalog_call(library: Dict[str, Any]) -> Call:
+    if random.random() < 0.5:
+        params = {
+            "limit": 20,
+            "sort_by": random.choice(("name", "added_date", "rating")),
+            "sort_order": random.choice(("asc", "desc")),
+        }
+        if random.random() < 0.5:
+            params["category"] = random.choice(library["categories"])
+        return Call("GET", "/media/movies/", {"params": params})
+    return Call("GET", f"/media/movie/{random.randint(1, library['movies'])}", {})
+
+
+def search_call(library: Dict[str, Any]) -> Call:
+    query = " ".join(random.sample(library["words"], 2))
+    return Call("POST", "/media/search", {"json": {"query": query, "limit": 20}})
+
+
+def range_seek_call(library: Dict[str, Any]) -> Call:
+    start = random.randrange(0, library["media_bytes"] - SEEK_BYTES)
+    headers = {"Range": f"bytes={start}-{start + SEEK_BYTES - 1}"}
+    return Call("GET", f"/media/stream/{random.randint(1, library['movies'])}", {"headers": headers})
+
+
+def login_call(library: Dict[str, Any]) -> Call:
+    username = f"user{random.randint(1, library['users'])}"
+    return Call("POST", "/auth/login", {"json": {"username": username, "password": library["password"]}})
+
+
+def heartbeat_call(library: Dict[str, Any]) -> Call:
+    params = {
+        "user_id": random.randint(1, library["users"]),
+        "progress": round(random.uniform(0, 100), 1),
+    }
+    return Call("POST", f"/media/watch/{random.randint(1, library['movies'])}", {"params": params})
+
+
+CALLS: Dict[str, Callable[[Dict[str, Any]], Call]] = {
+    "catalog": catalog_call,
+    "search": search_call,
+    "range_seek": range_seek_call,
+    "login": login_call,
+    "heartbeat": heartbeat_call,
+}
+
+
+# ================= Measurement =================
+def percentile(values: List[float], pct: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * pct))]
+
+
+def reset_peak_rss(pid: int) -> None:
+    try:
+        Path(f"/proc/{pid}/clear_refs").write_text("5")
+    except OSError:
+        pass
+
+
+def peak_rss_mb(pid: int) -> float:
+    try:
+        for line in Path(f"/proc/{pid}/status").read_text().splitlines():
+            if line.startswith("VmHWM:"):
+                return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    if pid == os.getpid():
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    return 0.0
+
+
+async def drive(
+    client: httpx.AsyncClient, scenario: str, library: Dict[str, Any], concurrency: int, seconds: float,
+) -> Dict[str, Any]:
+    make_call = CALLS[scenario]
+    latencies: List[float] = []
+    statuses: Dict[str, int] = {}
+    deadline = time.perf_counter() + seconds
+
+    async def worker() -> None:
+        while time.perf_counter() < deadline:
+            call = make_call(library)
+            started = time.perf_counter()
+            try:
+                response = await client.request(call.method, call.url, **call.options)
+                status = str(response.status_code)
+            except httpx.HTTPError as error:
+                status = type(error).__name__
+            elapsed = time.perf_counter() - started
+            statuses[status] = statuses.get(status, 0) + 1
+            if status.startswith("2"):
+                latencies.append(elapsed)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - started
+    return {
+        "requests": sum(statuses.values()),
+        "rps": round(len(latencies) / elapsed, 1),
+        "p50_ms": round(percentile(latencies, 0.50) * 1000, 2),
+        "p95_ms": round(percentile(latencies, 0.95) * 1000, 2),
+        "p99_ms": round(percentile(latencies, 0.99) * 1000, 2),
+        "errors": sum(count for status, count in statuses.items() if not status.startswith("2")),
+        "statuses": statuses,
+    }
+
+
+async def run_scenarios(
+    client: httpx.AsyncClient, pid: int, library: Dict[str, Any], scenarios: List[str], concurrency: int, seconds: float,
+) -> Dict[str, Dict[str, Any]]:
+    results: Dict[str, Dict[str, Any]] = {}
+    for scenario in scenarios:
+        await drive(client, scenario, library, min(concurrency, 8), WARMUP_SECONDS)
+        reset_peak_rss(pid)
+        result = await drive(client, scenario, library, concurrency, seconds)
+        result["peak_rss_mb"] = round(peak_rss_mb(pid), 1)
+        results[scenario] = result
+        report(scenario, result)
+    return results
+
+
+async def run_inprocess(library: Dict[str, Any], scenarios: List[str], concurrency: int, seconds: float) -> Dict[str, Dict[str, Any]]:
+    from app.app import app as server
+
+    transport = httpx.ASGITransport(app=server)
+    async with server.router.lifespan_context(server):
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+            return await run_scenarios(client, os.getpid(), library, scenarios, concurrency, seconds)
+
+
+async def run_loopback(
+    library: Dict[str, Any], scenarios: List[str], concurrency: int, seconds: float, env: Dict[str, str],
+) -> Dict[str, Dict[str, Any]]:
+    from benchmarks.async_routes import free_port, wait_for_server
+
+    port = free_port()
+    process = subprocess.Popen(
+        [
+            sys.executable, "-m", "uvicorn", "app.app:app", "--host", HOST, "--port", str(port),
+            "--log-level", "warning", "--no-access-log", "--backlog", "4096",
+        ],
+        env=env, cwd=REPO_ROOT,
+    )
+    try:
+        wait_for_server(port, process)
+        limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+        async with httpx.AsyncClient(base_url=f"http://{HOST}:{port}", limits=limits, timeout=30.0) as client:
+            return await run_scenarios(client, process.pid, library, scenarios, concurrency, seconds)
+    finally:
+        process.terminate()
+        process.wait()
+
+
+# ================= Reporting =================
+def report(scenario: str, result: Dict[str, Any]) -> None:
+    typer.echo(
+        f"  {scenario:<11} {result['rps']:9.1f} req/s  p50 {result['p50_ms']:8.2f}  p95 {result['p95_ms']:8.2f}  "
+        f"p99 {result['p99_ms']:8.2f} ms  errors {result['errors']:<5} peak RSS {result['peak_rss_mb']:7.1f} MB"
+    )
+
+
+def find_regressions(baseline: Dict[str, Any], current: Dict[str, Any], tolerance: float) -> List[str]:
+    regressions = []
+    for mode, scenarios in current["results"].items():
+        for scenario, result in scenarios.items():
+            before = baseline["results"].get(mode, {}).get(scenario)
+            if not before:
+                continue
+            if before["p95_ms"] and result["p95_ms"] > before["p95_ms"] * (1 + tolerance):
+                regressions.append(f"{mode}/{scenario}: p95 {before['p95_ms']:.2f} -> {result['p95_ms']:.2f} ms")
+            if before["rps"] and result["rps"] < before["rps"] * (1 - tolerance):
+                regressions.append(f"{mode}/{scenario}: {before['rps']:.1f} -> {result['rps']:.1f} req/s")
+            before_rate, rate = (run["errors"] / max(run["requests"], 1) for run in (before, result))
+            if rate > before_rate + ERROR_RATE_SLACK:
+                regressions.append(f"{mode}/{scenario}: errors {before_rate:.1%} -> {rate:.1%}")
+    return regressions
+
+
+def check_regressions(baseline: Dict[str, Any], current: Dict[str, Any], tolerance: float) -> None:
+    if baseline["library"].get("movies") != current["library"].get("movies"):
+        typer.secho("⚠️  Baseline was run on a different library size", fg=typer.colors.YELLOW)
+    regressions = find_regressions(baseline, current, tolerance)
+    if regressions:
+        typer.secho(f"\n❌ {len(regressions)} regression(s) beyond {tolerance:.0%}:", fg=typer.colors.RED, bold=True)
+        for line in regressions:
+            typer.secho(f"  {line}", fg=typer.colors.RED)
+        raise typer.Exit(code=1)
+    typer.secho(f"\n✅ No regressions beyond {tolerance:.0%}", fg=typer.colors.BRIGHT_GREEN)
+
+
+def git_revision() -> Optional[str]:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=REPO_ROOT, capture_output=True, text=True, check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+# ================= Commands =================
+@app.command()
+def run(
+    library: Optional[Path] = typer.Option(None, help="Library from benchmarks.library; a 1k one is generated if omitted."),
+    mode: List[str] = typer.Option(list(MODES), help="inprocess and/or loopback."),
+    scenario: List[str] = typer.Option(list(SCENARIOS), help="Scenarios to run."),
+    concurrency: int = typer.Option(64, help="Concurrent clients per scenario."),
+    seconds: float = typer.Option(10.0, help="Measured seconds per scenario."),
+    output: Optional[Path] = typer.Option(None, help="Result file (default: bench-<time>.json)."),
+    baseline: Optional[Path] = typer.Option(None, help="Earlier result file to compare with."),
+    tolerance: float = typer.Option(TOLERANCE, help="Allowed relative p95 rise / throughput drop."),
+):
+    unknown = (set(mode) - set(MODES)) | (set(scenario) - set(SCENARIOS))
+    if unknown:
+        raise typer.BadParameter(f"unknown mode or scenario: {', '.join(sorted(unknown))}")
+
+    with tempfile.TemporaryDirectory() as directory:
+        if library is None:
+            library = Path(directory) / "library"
+            subprocess.run([sys.executable, "-m", "benchmarks.library", "--size", "1k", "--out", str(library)], cwd=REPO_ROOT, check=True)
+        manifest = json.loads((library / "library.json").read_text())
+
+        # The app reads its configuration at import, so point it at the library first.
+        env = {**os.environ, "DATABASE_PATH": manifest["database"], "BCRYPT_ROUNDS": str(manifest["bcrypt_rounds"])}
+        os.environ.update(env)
+
+        results: Dict[str, Dict[str, Any]] = {}
+        for name in mode:
+            typer.secho(
+                f"\n🚀 {name}: {manifest['movies']} movies, {concurrency} clients, {seconds:g}s per scenario",
+                fg=typer.colors.BRIGHT_BLUE, bold=True,
+            )
+            if name == "inprocess":
+                results[name] = asyncio.run(run_inprocess(manifest, scenario, concurrency, seconds))
+            else:
+                results[name] = asyncio.run(run_loopback(manifest, scenario, concurrency, seconds, env))
+
+    current = {
+        "created_at": datetime.now(timezone.utc).isoformat(),
+        "revision": git_revision(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpus": os.cpu_count(),
+        "concurrency": concurrency,
+        "seconds": seconds,
+        "library": {key: manifest[key] for key in ("movies", "cast", "users", "history", "media_bytes", "bcrypt_rounds")},
+        "results": results,
+    }
+    output = output or Path(f"bench-{datetime.now():%Y%m%d-%H%M%S}.json")
+    output.write_text(json.dumps(current, indent=2))
+    typer.secho(f"\n💾 Results written to {output}", fg=typer.colors.BRIGHT_GREEN)
+    if baseline is not None:
+        check_regressions(json.loads(baseline.read_text()), current, tolerance)
+
+
+@app.command()
+def compare(
+    baseline: Path,
+    current: Path,
+    tolerance: float = typer.Option(TOLERANCE, help="Allowed relative p95 rise / throughput drop."),
+):
+    before, after = json.loads(baseline.read_text()), json.loads(current.read_text())
+    for mode, scenarios in after["results"].items():
+        if mode not in before["results"]:
+            continue
+        typer.secho(f"\n{mode}", bold=True)
+        for name, result in scenarios.items():
+            old = before["results"].get(mode, {}).get(name)
+            if old is None:
+                continue
+            typer.echo(
+                f"  {name:<11} {old['rps']:9.1f} -> {result['rps']:9.1f} req/s   "
+                f"p95 {old['p95_ms']:8.2f} -> {result['p95_ms']:8.2f} ms   "
+                f"RSS {old['peak_rss_mb']:7.1f} -> {result['peak_rss_mb']:7.1f} MB"
+            )
+    check_regressions(before, after, tolerance)
+
+
+if __name__ == "__main__":
+    app()
@@ -0,0 +1,118 @@
+"""
+Latency of the per-user history pages as the watchhistory table grows.
+
+Fills a throwaway database with movies and then with watch history for many
+users in steps (100k, 1M, ... rows), timing ``fetch_watch_page`` for one
+user's first page and a later page after each step. The query is timed with
+and without the (user_id, watched_at) index; without it, SQLite finds the
+user's rows through (user_id, movie_id) and sorts all of them for every page.
+With the index, a page is a short range scan, so its latency should stay
+flat however large the table or the user's history gets. The command exits
+non-zero if the indexed latency at the largest size is more than 3x the
+latency at the smallest.
+
+Usage:
+    python -m benchmarks.watch_history --sizes 100000,1000000,3000000
+"""
+import random
+import tempfile
+import time
+from datetime import datetime, timedelta
+from pathlib import Path
+from statistics import median
+from typing import Dict, List
+
+import typer
+from sqlalchemy import Engine, text
+
+from app.routes.movies import decode_cursor, fetch_watch_page
+from benchmarks.sqlite_concurrency import populate
+from database import Session, create_sqlite_engine
+
+app = typer.Typer()
+
+# ================= Configuration =================
+MOVIES: int = 20_000
+HISTORY_PER_USER: int = 1000  # a heavy user: long histories are what an unindexed sort hurts
+PAGE_SIZE: int = 20
+REPEATS: int = 50
+INDEX_NAME: str = "ix_watchhistory_user_id_watched_at"
+
+
+def grow_history(engine: Engine, start_user: int, rows: int) -> int:
+    """Add ``rows`` history rows for new users; returns the next unused user id."""
+    user_id = start_user
+    started = datetime(2024, 1, 1)
+    with engine.begin() as connection:
+        batch = []
+        for _ in range(rows // HISTORY_PER_USER):
+            for movie_id in random.sample(range(1, MOVIES + 1), HISTORY_PER_USER):
+                watched_at = started + timedelta(minutes=random.randrange(500_000))
+                batch.append((user_id, movie_id, watched_at.isoformat(sep=" "), random.uniform(0, 100)))
+            user_id += 1
+            if len(batch) >= 50_000:
+                connection.exec_driver_sql(
+                    "INSERT INTO watchhistory (user_id, movie_id, watched_at, progress) VALUES (?, ?, ?, ?)", batch,
+                )
+                batch = []
+        if batch:
+            connection.exec_driver_sql(
+                "INSERT INTO watchhistory (user_id, movie_id, watched_at, progress) VALUES (?, ?, ?, ?)", batch,
+            )
+    return user_id
+
+
+def time_pages(engine: Engine, user_ids: List[int]) -> Dict[str, float]:
+    first: List[float] = []
+    later: List[float] = []
+    with Session(bind=engine) as db:
+        for index in range(REPEATS):
+            user_id = user_ids[index % len(user_ids)]
+            started = time.perf_counter()
+            page = fetch_watch_page(db, user_id, PAGE_SIZE, None, unfinished=True)
+            first.append(time.perf_counter() - started)
+            if page["next_cursor"]:
+                after = decode_cursor(page["next_cursor"], "watched_at", "desc")
+                started = time.perf_counter()
+                fetch_watch_page(db, user_id, PAGE_SIZE, after, unfinished=True)
+                later.append(time.perf_counter() - started)
+            db.rollback()
+    return {"first_ms": median(first) * 1000, "later_ms": median(later or [0.0]) * 1000}
+
+
+@app.command()
+def main(sizes: str = "100000,1000000"):
+    steps = sorted(int(size) for size in sizes.split(","))
+    results: Dict[int, Dict[str, float]] = {}
+    with tempfile.TemporaryDirectory() as directory:
+        engine = create_sqlite_engine(Path(directory) / "bench.db")
+        populate(engine, MOVIES)
+        next_user, total = 1, 0
+        for size in steps:
+            next_user = grow_history(engine, next_user, size - total)
+            total = size
+            with engine.begin() as connection:
+                connection.execute(text("ANALYZE"))
+            sample = random.sample(range(1, next_user), min(REPEATS, next_user - 1))
+            indexed = time_pages(engine, sample)
+            with engine.begin() as connection:
+                connection.execute(text(f"DROP INDEX {INDEX_NAME}"))
+            scanned = time_pages(engine, sample)
+            with engine.begin() as connection:
+                connection.execute(text(f"CREATE INDEX {INDEX_NAME} ON watchhistory (user_id, watched_at)"))
+            results[size] = indexed
+            typer.echo(
+                f"  {size:>10,} rows  indexed: first {indexed['first_ms']:6.2f} ms  next {indexed['later_ms']:6.2f} ms"
+                f"   | without: first {scanned['first_ms']:7.2f} ms  next {scanned['later_ms']:7.2f} ms"
+            )
+        engine.dispose()
+
+    smallest, largest = results[steps[0]]["first_ms"], results[steps[-1]]["first_ms"]
+    if largest > 3 * smallest:
+        typer.secho(f"\n❌ Page latency grew {largest / smallest:.1f}x with the table", fg=typer.colors.RED)
+        raise typer.Exit(code=1)
+    typer.secho("\n✅ Page latency stayed flat as history grew", fg=typer.colors.BRIGHT_GREEN)
+
+
+if __name__ == "__main__":
+    app()
@@ -1,31 +1,304 @@
-from typing import Annotated, TYPE_CHECKING
+import functools
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Annotated, Any, AsyncIterator, Callable, Iterator, List, Optional, Tuple, TypeVar, TYPE_CHECKING
+from urllib.parse import quote
+import anyio
 from fastapi import Depends
+from sqlalchemy import Connection, DateTime, Engine, event, inspect, text
+from sqlalchemy.pool import QueuePool
 from sqlmodel import SQLModel, create_engine, Session as SessionBase
+from app_config import (
+    DATABASE_PATH, SQLITE_BUSY_TIMEOUT, SQLITE_CACHE_SIZE, SQLITE_MMAP_SIZE,
+    DB_READ_POOL_SIZE, DB_WRITE_TIMEOUT, DB_EXECUTOR_THREADS,
+)
+from search import create_search_index
 
 if TYPE_CHECKING:
     from models import User
 
 # Database configuration
-sqlite_file_name = "database.db"
-sqlite_url = f"sqlite:///{sqlite_file_name}"
+#
+# SQLite allows one writer at a time but, in WAL mode, any number of readers
+# alongside it. Writes go through a pool of exactly one connection, so they
+# queue in the application instead of failing with "database is locked", and
+# each write transaction starts with BEGIN IMMEDIATE so it never has to
+# upgrade a read lock half way through. Reads use a separate pool of
+# read-only connections and are never blocked by the writer.
 
-connect_args = {"check_same_thread": False}
-engine = create_engine(sqlite_url, connect_args=connect_args)
+def sqlite_pragmas(read_only: bool) -> List[Tuple[str, Any]]:
+    pragmas: List[Tuple[str, Any]] = [
+        ("busy_timeout", SQLITE_BUSY_TIMEOUT),
+        ("cache_size", SQLITE_CACHE_SIZE),
+        ("mmap_size", SQLITE_MMAP_SIZE),
+    ]
+    if read_only:
+        return pragmas + [("query_only", "ON")]
+    return [("journal_mode", "WAL"), ("synchronous", "NORMAL")] + pragmas
+
+def create_sqlite_engine(
+    path: Path,
+    read_only: bool = False,
+    pool_size: int = 1,
+    max_overflow: int = 0,
+    pool_timeout: float = 30.0,
+) -> Engine:
+    if read_only:
+        url = f"sqlite:///file:{quote(str(path))}?mode=ro&uri=true"
+    else:
+        url = f"sqlite:///{path}"
+    new_engine = create_engine(
+        url,
+        connect_args={"check_same_thread": False},
+        poolclass=QueuePool,
+        pool_size=pool_size,
+        max_overflow=max_overflow,
+        pool_timeout=pool_timeout,
+    )
+    pragmas = sqlite_pragmas(read_only)
+
+    @event.listens_for(new_engine, "connect")
+    def on_connect(dbapi_connection, connection_record):
+        # Let SQLAlchemy's "begin" event below decide how transactions start.
+        dbapi_connection.isolation_level = None
+        cursor = dbapi_connection.cursor()
+        for name, value in pragmas:
+            cursor.execute(f"PRAGMA {name}={value}")
+        cursor.close()
+
+    @event.listens_for(new_engine, "begin")
+    def on_begin(connection):
+        connection.exec_driver_sql("BEGIN" if read_only else "BEGIN IMMEDIATE")
+
+    return new_engine
+
+engine = create_sqlite_engine(DATABASE_PATH, pool_timeout=DB_WRITE_TIMEOUT)
+# Readers may overflow the pool under bursts; only DB_READ_POOL_SIZE stay open.
+read_engine = create_sqlite_engine(DATABASE_PATH, read_only=True, pool_size=DB_READ_POOL_SIZE, max_overflow=-1)
 
 class Session(SessionBase):
+    """
+    Without an explicit bind, reads run on ``read_engine`` and the first write
+    in a transaction moves it (and its remaining reads) to the writer, so a
+    transaction always sees its own changes.
+    """
+    _writing = False
+
+    def get_bind(self, mapper=None, clause=None, **kwargs):
+        if self.bind is not None:
+            return super().get_bind(mapper, clause=clause, **kwargs)
+        if self._flushing or (clause is not None and getattr(clause, "is_dml", False)):
+            self._writing = True
+        return engine if self._writing else read_engine
+
     def add_user(self, user: "User") -> "User":
         self.add(user)
         self.commit()
         self.refresh(user)
         return user
 
+@event.listens_for(Session, "after_transaction_end")
+def _end_writing(session: Session, transaction) -> None:
+    if transaction.parent is None:
+        session._writing = False
+
 def get_session():
-    with Session(engine) as session:
+    with Session() as session:
         yield session
 
 
 SessionDep = Annotated[Session, Depends(get_session)]
 
-def create_db_and_tables():
-    SQLModel.metadata.create_all(engine)
+T = TypeVar("T")
+
+# Blocking database work from async handlers runs on at most
+# DB_EXECUTOR_THREADS threads, separate from the threadpool sync endpoints use,
+# so slow clients and streams never wait behind queries (or the reverse).
+_db_limiter: Optional[anyio.CapacityLimiter] = None
+
+def db_limiter() -> anyio.CapacityLimiter:
+    global _db_limiter
+    if _db_limiter is None:
+        _db_limiter = anyio.CapacityLimiter(DB_EXECUTOR_THREADS)
+    return _db_limiter
+
+async def run_db(fn: Callable[..., T], *args: Any, **kwargs: Any) -> T:
+    """Run a blocking database call on the bounded DB executor."""
+    return await anyio.to_thread.run_sync(functools.partial(fn, *args, **kwargs), limiter=db_limiter())
+
+class AsyncSession:
+    """
+    Session handle for async handlers. ORM work is passed to ``run`` as a
+    plain function taking the Session first, and executes on the DB executor.
+
+    Each ``run`` is its own unit of work: the session is closed before it
+    returns, so no connection (or read snapshot) is held while the handler
+    awaits anything else. Returned objects are detached but keep the
+    attributes that were loaded; commit inside the function to write.
+    """
+    def __init__(self, session: Session):
+        self.session = session
+
+    def _call(self, fn: Callable[..., T], *args: Any, **kwargs: Any) -> T:
+        try:
+            return fn(self.session, *args, **kwargs)
+        finally:
+            self.session.close()
+
+    async def run(self, fn: Callable[..., T], *args: Any, **kwargs: Any) -> T:
+        return await run_db(self._call, fn, *args, **kwargs)
+
+async def get_async_session() -> AsyncIterator[AsyncSession]:
+    yield AsyncSession(Session())
+
+
+AsyncSessionDep = Annotated[AsyncSession, Depends(get_async_session)]
+
+# SQLite refuses these, and any parenthesized expression, as the default of a
+# column added by ALTER TABLE.
+NON_CONSTANT_DEFAULTS = ("CURRENT_TIMESTAMP", "CURRENT_DATE", "CURRENT_TIME")
+
+def is_constant_default(default: str) -> bool:
+    return default.upper() not in NON_CONSTANT_DEFAULTS and not default.startswith("(")
+
+def add_missing_columns(connection: Connection) -> None:
+    """
+    ``create_all`` never alters existing tables. Add model columns that older
+    databases lack, using the column's server default for existing rows. A
+    non-constant default (the current time) cannot be given to ALTER TABLE,
+    so those columns are added nullable and their NULLs filled in with an
+    UPDATE, also for databases that gained the column before the backfill.
+    Datetimes an earlier backfill stored without microseconds are padded to
+    the ORM's format, so they sort and compare like the rest.
+    """
+    inspector = inspect(connection)
+    for table in SQLModel.metadata.sorted_tables:
+        if not inspector.has_table(table.name):
+            continue
+        existing = {column["name"] for column in inspector.get_columns(table.name)}
+        for column in table.columns:
+            default = column.server_default.arg.text if column.server_default is not None else None
+            if default is not None and not is_constant_default(default):
+                if column.name not in existing:
+                    connection.execute(text(
+                        f'ALTER TABLE "{table.name}" ADD COLUMN "{column.name}" {column.type.compile(connection.dialect)}'
+                    ))
+                connection.exec_driver_sql(
+                    f'UPDATE "{table.name}" SET "{column.name}" = {default} WHERE "{column.name}" IS NULL'
+                )
+                if isinstance(column.type, DateTime):
+                    connection.exec_driver_sql(
+                        f'UPDATE "{table.name}" SET "{column.name}" = "{column.name}" || \'.000000\' '
+                        f'WHERE length("{column.name}") = 19'
+                    )
+                continue
+            if column.name in existing:
+                continue
+            ddl = f'ALTER TABLE "{table.name}" ADD COLUMN "{column.name}" {column.type.compile(connection.dialect)}'
+            if default is not None:
+                ddl += f" NOT NULL DEFAULT {default}"
+            connection.execute(text(ddl))
+
+def add_missing_indexes(connection: Connection) -> None:
+    """``create_all`` only indexes the tables it creates; add indexes declared since."""
+    inspector = inspect(connection)
+    for table in SQLModel.metadata.sorted_tables:
+        if not inspector.has_table(table.name):
+            continue
+        existing = {index["name"] for index in inspector.get_indexes(table.name)}
+        for index in table.indexes:
+            if index.name not in existing:
+                index.create(connection)
+
+CATALOG_TABLES = ("movie", "cast", "moviecastlink", "imageasset", "moviesimilarity")
+
+def ensure_catalog_version(connection: Connection) -> None:
+    """
+    ``catalog_version`` holds a single counter that triggers bump on every
+    write to the tables catalog responses are built from, whichever process
+    or code path makes it. Response caches compare against it.
+    """
+    connection.execute(text(
+        "CREATE TABLE IF NOT EXISTS catalog_version (id INTEGER PRIMARY KEY CHECK (id = 1), version INTEGER NOT NULL)"
+    ))
+    connection.execute(text("INSERT OR IGNORE INTO catalog_version (id, version) VALUES (1, 0)"))
+    for _, ddl in _catalog_version_triggers():
+        connection.execute(text(ddl))
+
+def _catalog_version_triggers() -> Iterator[Tuple[str, str]]:
+    for table in CATALOG_TABLES:
+        for operation in ("INSERT", "UPDATE", "DELETE"):
+            name = f"catalog_version_{table}_{operation.lower()}"
+            yield name, (
+                f'CREATE TRIGGER IF NOT EXISTS {name} AFTER {operation} ON "{table}" '
+                "BEGIN UPDATE catalog_version SET version = version + 1 WHERE id = 1; END"
+            )
+
+@contextmanager
+def catalog_bulk_write(connection: Connection) -> Iterator[None]:
+    """
+    The version triggers fire once per row. For a bulk write, drop them and
+    bump the version once at the end instead. Use it inside a transaction,
+    like ``search.suspended_sync``: SQLite's single writer means no other
+    write can slip in while they are gone.
+    """
+    for name, _ in _catalog_version_triggers():
+        connection.execute(text(f"DROP TRIGGER IF EXISTS {name}"))
+    yield
+    for _, ddl in _catalog_version_triggers():
+        connection.execute(text(ddl))
+    connection.execute(text("UPDATE catalog_version SET version = version + 1 WHERE id = 1"))
+
+def read_catalog_version() -> int:
+    with read_engine.connect() as connection:
+        return connection.execute(text("SELECT version FROM catalog_version WHERE id = 1")).scalar_one()
+
+def ensure_auth_version(connection: Connection) -> None:
+    """
+    ``auth_version`` works like ``catalog_version`` for users: triggers bump
+    it on every update or delete of a user row, so each server process's
+    token cache notices a logout, account delete or profile change made in
+    another one.
+    """
+    connection.execute(text(
+        "CREATE TABLE IF NOT EXISTS auth_version (id INTEGER PRIMARY KEY CHECK (id = 1), version INTEGER NOT NULL)"
+    ))
+    connection.execute(text("INSERT OR IGNORE INTO auth_version (id, version) VALUES (1, 0)"))
+    for operation in ("UPDATE", "DELETE"):
+        connection.execute(text(
+            f'CREATE TRIGGER IF NOT EXISTS auth_version_user_{operation.lower()} AFTER {operation} ON "user" '
+            "BEGIN UPDATE auth_version SET version = version + 1 WHERE id = 1; END"
+        ))
+
+def read_auth_version() -> int:
+    with read_engine.connect() as connection:
+        return connection.execute(text("SELECT version FROM auth_version WHERE id = 1")).scalar_one()
+
+def ensure_watch_history_index(connection: Connection) -> None:
+    """
+    Older databases logged one watchhistory row per heartbeat. Keep the newest
+    row per (user_id, movie_id) so the unique index progress upserts rely on
+    can be created.
+    """
+    indexes = {index["name"] for index in inspect(connection).get_indexes("watchhistory")}
+    if "ix_watchhistory_user_id_movie_id" in indexes:
+        return
+    connection.execute(text(
+        "DELETE FROM watchhistory WHERE id NOT IN "
+        "(SELECT max(id) FROM watchhistory GROUP BY user_id, movie_id)"
+    ))
+    connection.execute(text(
+        "CREATE UNIQUE INDEX ix_watchhistory_user_id_movie_id ON watchhistory (user_id, movie_id)"
+    ))
+
+def create_db_and_tables(bind: Optional[Engine] = None):
+    bind = bind or engine
+    SQLModel.metadata.create_all(bind)
+    with bind.begin() as connection:
+        add_missing_columns(connection)
+        create_search_index(connection)
+        ensure_watch_history_index(connection)
+        add_missing_indexes(connection)
+        ensure_catalog_version(connection)
+        ensure_auth_version(connection)
     print("Database and tables created successfully.")
\ No newline at end of file
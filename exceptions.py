@@ -51,6 +51,14 @@ class TokenMissingException(HTTPException):
             headers={"WWW-Authenticate": "Bearer"},
         )
 
+class AuthBusyException(HTTPException):
+    def __init__(self):
+        super().__init__(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Too many logins at once, please retry shortly",
+            headers={"Retry-After": "1", "X-Error": "AuthBusy"},
+        )
+
 class VersionFileNotFoundException(HTTPException):
     def __init__(self):
         super().__init__(
@@ -59,6 +67,14 @@ class VersionFileNotFoundException(HTTPException):
             headers={"X-Error": "VersionFileNotFound"},
         )
 
+class MetricsDisabledException(HTTPException):
+    def __init__(self):
+        super().__init__(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Metrics are disabled (METRICS_ENABLED=0)",
+            headers={"X-Error": "MetricsDisabled"},
+        )
+
 class MovieNotFoundException(HTTPException):
     def __init__(self, movie_id: int):
         super().__init__(
@@ -96,4 +112,18 @@ class SubtitleNotFoundException(HTTPException):
             status_code=status.HTTP_404_NOT_FOUND,
             detail=f"Subtitle for movie ID {movie_id} not found.",
             headers={"X-Error": "SubtitleNotFound"},
-        )
\ No newline at end of file
+        )
+class InvalidCursorException(HTTPException):
+    def __init__(self):
+        super().__init__(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Invalid or expired pagination cursor",
+            headers={"X-Error": "InvalidCursor"},
+        )
+class ImageNotFoundException(HTTPException):
+    def __init__(self):
+        super().__init__(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Image not found.",
+            headers={"X-Error": "ImageNotFound"},
+        )
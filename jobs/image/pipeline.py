@@ -0,0 +1,210 @@
+"""
+Image pipeline: mirror posters and cast headshots into the local image cache.
+
+Every remote ``Movie.thumbnail`` and ``Cast.image_url`` not cached yet is
+downloaded (from ``IMAGE_ORIGIN`` instead of the original host when set),
+identified by the sha256 of its bytes, and resized once into the WebP and
+JPEG variants of jobs/image/store.py. Downloads and resizing run on a bounded
+worker pool; the URL -> content hash mapping is written to ``imageasset`` so
+the API can hand out local, content-addressed image URLs.
+
+Usage:
+    python -m jobs.image.pipeline --workers 8 --rate 20
+"""
+import hashlib
+import io
+import os
+import threading
+import time
+import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Dict, List, NamedTuple, Optional, Tuple
+from urllib.parse import urlsplit
+
+import typer
+from sqlalchemy import Connection, select, union
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+
+from app_config import IMAGE_ORIGIN
+from database import engine, create_db_and_tables
+from jobs.image.store import IMAGE_VARIANTS, content_dir, has_variants, variant_path
+from jobs.movie.fetcher import NotFound, RateLimiter, with_retries
+from models import Cast, ImageAsset, Movie
+
+app = typer.Typer()
+
+# ================= Configuration =================
+DEFAULT_WORKERS: int = 8
+DEFAULT_RATE: float = 20.0  # downloads per second, across all workers
+DOWNLOAD_TIMEOUT: float = 30.0
+MAX_IMAGE_BYTES: int = 20 * 1024 * 1024
+WEBP_QUALITY: int = 80
+JPEG_QUALITY: int = 85
+USER_AGENT: str = "Velofy-ImagePipeline/1.0"
+RETRYABLE_STATUSES: Tuple[int, ...] = (408, 429)  # the 4xx answers worth retrying
+
+
+class CachedImage(NamedTuple):
+    url: str
+    content_hash: str
+    width: int
+    height: int
+
+
+def origin_url(url: str, origin: str = IMAGE_ORIGIN) -> str:
+    """Point ``url`` at ``origin`` (scheme and host), keeping its path and query."""
+    if not origin:
+        return url
+    parts = urlsplit(url)
+    return origin.rstrip("/") + parts.path + (f"?{parts.query}" if parts.query else "")
+
+
+def download(url: str) -> bytes:
+    """Fetch ``url``; raise NotFound for answers a retry would not change (4xx, oversized images)."""
+    request = urllib.request.Request(url, headers={"User-Agent": USER_AGENT})
+    try:
+        with urllib.request.urlopen(request, timeout=DOWNLOAD_TIMEOUT) as response:
+            data = response.read(MAX_IMAGE_BYTES + 1)
+    except urllib.error.HTTPError as e:
+        if 400 <= e.code < 500 and e.code not in RETRYABLE_STATUSES:
+            raise NotFound(f"HTTP {e.code}") from e
+        raise
+    if len(data) > MAX_IMAGE_BYTES:
+        raise NotFound(f"image larger than {MAX_IMAGE_BYTES} bytes")
+    return data
+
+
+def _save_atomic(image, path: Path, **options) -> None:
+    tmp_path = path.with_name(f".{path.name}.tmp")
+    image.save(tmp_path, **options)
+    os.replace(tmp_path, path)
+
+
+def render_variants(data: bytes, content_hash: str) -> Tuple[int, int]:
+    """Write every variant of the image; returns the original ``(width, height)``."""
+    from PIL import Image, ImageOps  # type: ignore
+
+    with Image.open(io.BytesIO(data)) as original:
+        image = ImageOps.exif_transpose(original)
+        if image.mode not in ("RGB", "L"):
+            image = image.convert("RGB")
+        width, height = image.size
+        directory = content_dir(content_hash)
+        directory.mkdir(parents=True, exist_ok=True)
+        # Largest first, each resized from the previous one: cheaper, same quality.
+        current = image
+        for variant, max_width in sorted(IMAGE_VARIANTS.items(), key=lambda item: -item[1]):
+            if current.width > max_width:
+                current = current.resize(
+                    (max_width, max(1, round(current.height * max_width / current.width))),
+                    Image.Resampling.LANCZOS,
+                )
+            _save_atomic(current, variant_path(content_hash, variant, "webp"), format="WEBP", quality=WEBP_QUALITY, method=4)
+            _save_atomic(
+                current, variant_path(content_hash, variant, "jpg"),
+                format="JPEG", quality=JPEG_QUALITY, optimize=True, progressive=True,
+            )
+    return width, height
+
+
+class ImagePipeline:
+    def __init__(self, workers: int = DEFAULT_WORKERS, rate: float = DEFAULT_RATE, origin: str = IMAGE_ORIGIN):
+        self.workers = max(1, workers)
+        self.origin = origin
+        self.limiter = RateLimiter(rate, burst=self.workers)
+        self.stats: Dict[str, int] = {"downloaded": 0, "deduplicated": 0, "rendered": 0, "failed": 0}
+        self._lock = threading.Lock()
+        self._hash_locks: Dict[str, threading.Lock] = {}
+
+    def _count(self, key: str) -> None:
+        with self._lock:
+            self.stats[key] += 1
+
+    def _hash_lock(self, content_hash: str) -> threading.Lock:
+        # Two URLs with the same bytes can arrive together; render them once.
+        with self._lock:
+            return self._hash_locks.setdefault(content_hash, threading.Lock())
+
+    def process(self, url: str) -> Optional[CachedImage]:
+        def fetch() -> bytes:
+            self.limiter.acquire()
+            return download(origin_url(url, self.origin))
+        try:
+            data = with_retries(fetch)
+            self._count("downloaded")
+            content_hash = hashlib.sha256(data).hexdigest()
+            with self._hash_lock(content_hash):
+                if has_variants(content_hash):
+                    from PIL import Image  # type: ignore
+                    with Image.open(io.BytesIO(data)) as image:
+                        width, height = image.size
+                    self._count("deduplicated")
+                else:
+                    width, height = render_variants(data, content_hash)
+                    self._count("rendered")
+        except Exception as e:
+            typer.secho(f"[ERROR] Failed to cache {url}: {e}", fg=typer.colors.RED)
+            self._count("failed")
+            return None
+        return CachedImage(url, content_hash, width, height)
+
+    def run(self, urls: List[str]) -> List[CachedImage]:
+        if not urls:
+            return []
+        with ThreadPoolExecutor(max_workers=min(self.workers, len(urls))) as pool:
+            return [image for image in pool.map(self.process, urls) if image is not None]
+
+
+def pending_urls(connection: Connection, refresh: bool = False) -> List[str]:
+    """Remote poster and headshot URLs in the catalog that are not in the image cache yet."""
+    sources = union(
+        select(Movie.thumbnail.label("url")).where(Movie.thumbnail.like("http%")),
+        select(Cast.image_url.label("url")).where(Cast.image_url.like("http%")),
+    ).subquery()
+    query = select(sources.c.url)
+    if not refresh:
+        query = query.where(sources.c.url.not_in(select(ImageAsset.url)))
+    return sorted(connection.execute(query).scalars())
+
+
+def save_assets(connection: Connection, images: List[CachedImage]) -> None:
+    if not images:
+        return
+    now = datetime.now(timezone.utc)
+    stmt = sqlite_insert(ImageAsset)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[ImageAsset.url],
+        set_={column: stmt.excluded[column] for column in ("content_hash", "width", "height", "fetched_at")},
+    )
+    connection.execute(stmt, [{**image._asdict(), "fetched_at": now} for image in images])
+
+
+@app.command()
+def main(
+    workers: int = DEFAULT_WORKERS,
+    rate: float = DEFAULT_RATE,
+    origin: str = typer.Option(IMAGE_ORIGIN, help="Fetch from this scheme://host instead of each URL's own."),
+    refresh: bool = typer.Option(False, help="Download every image again, even if cached."),
+):
+    create_db_and_tables()
+    with engine.connect() as connection:
+        urls = pending_urls(connection, refresh=refresh)
+    typer.secho(f"🖼️ Caching {len(urls)} images on {workers} workers...\n", fg=typer.colors.BRIGHT_MAGENTA)
+    started = time.perf_counter()
+    pipeline = ImagePipeline(workers=workers, rate=rate, origin=origin)
+    images = pipeline.run(urls)
+    with engine.begin() as connection:
+        save_assets(connection, images)
+    stats = pipeline.stats
+    typer.secho(
+        f"✅ {len(images)} images cached: {stats['rendered']} rendered, {stats['deduplicated']} duplicates, "
+        f"{stats['failed']} failed ({time.perf_counter() - started:.2f}s)",
+        fg=typer.colors.BRIGHT_GREEN,
+    )
+
+
+if __name__ == "__main__":
+    app()
@@ -0,0 +1,51 @@
+"""
+On-disk layout of the local image cache.
+
+Every distinct image (by sha256 of the downloaded bytes) gets one directory
+holding its resized variants, so the same picture referenced by several URLs
+is stored and resized once:
+
+    IMAGE_CACHE_DIR/ab/abcdef.../card.webp
+                                 card.jpg
+                                 thumb.webp ...
+
+The server derives file paths from the hash in the URL alone, so serving an
+image needs no database access.
+"""
+import re
+from pathlib import Path
+from typing import Dict
+
+from app_config import IMAGE_CACHE_DIR
+
+# Variant name -> maximum width in pixels (images are never upscaled).
+IMAGE_VARIANTS: Dict[str, int] = {"thumb": 185, "card": 342, "large": 780}
+IMAGE_FORMATS: Dict[str, str] = {"webp": "image/webp", "jpg": "image/jpeg"}
+POSTER_VARIANT: str = "card"
+HEADSHOT_VARIANT: str = "thumb"
+DEFAULT_FORMAT: str = "webp"
+
+_CONTENT_HASH = re.compile(r"[0-9a-f]{64}")
+
+
+def is_content_hash(value: str) -> bool:
+    return _CONTENT_HASH.fullmatch(value) is not None
+
+
+def content_dir(content_hash: str) -> Path:
+    return IMAGE_CACHE_DIR / content_hash[:2] / content_hash
+
+
+def variant_path(content_hash: str, variant: str, fmt: str) -> Path:
+    return content_dir(content_hash) / f"{variant}.{fmt}"
+
+
+def variant_url(content_hash: str, variant: str = POSTER_VARIANT, fmt: str = DEFAULT_FORMAT) -> str:
+    return f"/images/{content_hash}/{variant}.{fmt}"
+
+
+def has_variants(content_hash: str) -> bool:
+    return all(
+        variant_path(content_hash, variant, fmt).exists()
+        for variant in IMAGE_VARIANTS for fmt in IMAGE_FORMATS
+    )
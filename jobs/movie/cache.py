@@ -0,0 +1,117 @@
+"""
+Persistent cache for metadata provider lookups.
+
+Entries live in a small SQLite file keyed by ``"<kind>:<id>"`` (e.g.
+``movie:34388152``, ``person:0000158``). Successful lookups expire after
+``ttl`` seconds, IDs the provider does not know are remembered for
+``negative_ttl`` so a dead ID is not retried on every scan, and the file
+is capped at ``max_entries`` by evicting the least recently used rows.
+"""
+import json
+import sqlite3
+import threading
+import time
+from pathlib import Path
+from typing import Any, Dict, Optional, Tuple
+
+# ================= Configuration =================
+DEFAULT_TTL: float = 30 * 24 * 3600  # 30 days
+DEFAULT_NEGATIVE_TTL: float = 24 * 3600  # 1 day
+DEFAULT_MAX_ENTRIES: int = 200_000
+EVICT_FRACTION: float = 0.1  # share of the cap freed at once when it is exceeded
+
+MISSING = object()
+
+
+class LookupCache:
+    def __init__(
+        self,
+        path: Path,
+        ttl: float = DEFAULT_TTL,
+        negative_ttl: float = DEFAULT_NEGATIVE_TTL,
+        max_entries: int = DEFAULT_MAX_ENTRIES,
+    ):
+        self.path = Path(path)
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.max_entries = max_entries
+        self.stats: Dict[str, int] = {
+            "hits": 0, "negative_hits": 0, "misses": 0, "expired": 0, "writes": 0, "evictions": 0,
+        }
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS lookup_cache ("
+            "key TEXT PRIMARY KEY, payload TEXT, ok INTEGER NOT NULL, "
+            "stored_at REAL NOT NULL, accessed_at REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS ix_lookup_cache_accessed_at ON lookup_cache (accessed_at)")
+        self._count = self._conn.execute("SELECT count(*) FROM lookup_cache").fetchone()[0]
+
+    def get(self, kind: str, key: str) -> Any:
+        """
+        Return the cached value, ``None`` for an ID cached as not found, or
+        ``MISSING`` when the lookup has to go to the provider.
+        """
+        cache_key = f"{kind}:{key}"
+        now = time.time()
+        with self._lock:
+            row: Optional[Tuple[Optional[str], int, float]] = self._conn.execute(
+                "SELECT payload, ok, stored_at FROM lookup_cache WHERE key = ?", (cache_key,)
+            ).fetchone()
+            if row is None:
+                self.stats["misses"] += 1
+                return MISSING
+            payload, ok, stored_at = row
+            if now - stored_at > (self.ttl if ok else self.negative_ttl):
+                self.stats["expired"] += 1
+                self.stats["misses"] += 1
+                return MISSING
+            self._conn.execute("UPDATE lookup_cache SET accessed_at = ? WHERE key = ?", (now, cache_key))
+            if not ok:
+                self.stats["negative_hits"] += 1
+                return None
+            self.stats["hits"] += 1
+            return json.loads(payload)
+
+    def put(self, kind: str, key: str, value: Any) -> None:
+        """Store a lookup result; ``None`` records an ID the provider does not know."""
+        now = time.time()
+        payload = json.dumps(value, ensure_ascii=False) if value is not None else None
+        cache_key = f"{kind}:{key}"
+        with self._lock:
+            exists = self._conn.execute("SELECT 1 FROM lookup_cache WHERE key = ?", (cache_key,)).fetchone()
+            self._conn.execute(
+                "INSERT OR REPLACE INTO lookup_cache (key, payload, ok, stored_at, accessed_at) VALUES (?, ?, ?, ?, ?)",
+                (cache_key, payload, value is not None, now, now),
+            )
+            self.stats["writes"] += 1
+            if not exists:
+                self._count += 1
+                if self._count > self.max_entries:
+                    self._evict()
+
+    def _evict(self) -> None:
+        target = int(self.max_entries * (1 - EVICT_FRACTION))
+        excess = self._count - target
+        self._conn.execute(
+            "DELETE FROM lookup_cache WHERE key IN "
+            "(SELECT key FROM lookup_cache ORDER BY accessed_at LIMIT ?)", (excess,)
+        )
+        self.stats["evictions"] += excess
+        self._count = target
+
+    def summary(self) -> str:
+        lookups = self.stats["hits"] + self.stats["negative_hits"] + self.stats["misses"]
+        ratio = (self.stats["hits"] + self.stats["negative_hits"]) / lookups if lookups else 0.0
+        return (
+            f"{self.stats['hits']} hits, {self.stats['negative_hits']} negative hits, "
+            f"{self.stats['misses']} misses ({self.stats['expired']} expired), "
+            f"{self.stats['evictions']} evictions — hit ratio {ratio:.1%}"
+        )
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
@@ -0,0 +1,288 @@
+"""
+Faststart remux for MP4 files whose ``moov`` index sits after the media data.
+
+A browser cannot start playing such a file until it has fetched the index from
+the tail, which costs an extra round trip (and, on slow links, seconds) on
+every play. This job moves ``moov`` in front of ``mdat`` and fixes up the
+chunk offsets in the ``stco``/``co64`` tables: data before the old index moves
+forward by the size of the new one, and data after it (another ``mdat``, say)
+by however much the index grew. ``stco`` is upgraded to ``co64`` where an
+offset would no longer fit in 32 bits.
+
+Only ``moov`` is held in memory; the media data is copied in bounded chunks
+(``copy_file_range`` where the kernel has it). By default the result is
+written next to the original as a hidden ``.<name>.faststart.mp4`` file, which
+library scans ignore, and recorded as ``Movie.optimized_location`` so the
+streamer prefers it; ``--in-place`` atomically replaces the original instead.
+
+Usage:
+    python -m jobs.movie.faststart --dry-run
+    python -m jobs.movie.faststart [--in-place] [--movie-id 42]
+"""
+import mmap
+import os
+import shutil
+import struct
+from pathlib import Path
+from typing import List, NamedTuple, Optional, Tuple
+
+import typer
+from sqlmodel import select
+
+from database import Session, create_db_and_tables
+from jobs.movie.probe import MP4_CONTAINERS, ProbeError, iter_boxes
+from models import Movie
+
+app = typer.Typer()
+
+# ================= Configuration =================
+MP4_EXTENSIONS: Tuple[str, ...] = (".mp4", ".m4v", ".mov")
+COPY_CHUNK_SIZE: int = 8 * 1024 * 1024
+UINT32_MAX = 0xFFFFFFFF
+STCO_MAX_OFFSET: int = UINT32_MAX  # beyond this, an stco table is rewritten as co64
+
+
+class FaststartPlan(NamedTuple):
+    path: Path
+    size: int
+    insert_at: int  # offset of the first mdat: the new moov goes here
+    moov_start: int
+    moov_end: int
+    new_moov: bytes
+
+    @property
+    def moov_growth(self) -> int:
+        return len(self.new_moov) - (self.moov_end - self.moov_start)
+
+
+def faststart_path(path: Path) -> Path:
+    return path.with_name(f".{path.stem}.faststart{path.suffix}")
+
+
+def _box(box_type: bytes, payload: bytes) -> bytes:
+    size = 8 + len(payload)
+    if size > UINT32_MAX:
+        return struct.pack(">I4sQ", 1, box_type, size + 8) + payload
+    return struct.pack(">I4s", size, box_type) + payload
+
+
+def _chunk_offsets(box_type: bytes, payload: bytes) -> Tuple[int, ...]:
+    count = struct.unpack_from(">I", payload, 4)[0]
+    return struct.unpack_from(f">{count}{'I' if box_type == b'stco' else 'Q'}", payload, 8)
+
+
+def _offset_table(box_type: bytes, offsets: List[int]) -> bytes:
+    fmt = f">I{len(offsets)}{'I' if box_type == b'stco' else 'Q'}"
+    return b"\0\0\0\0" + struct.pack(fmt, len(offsets), *offsets)
+
+
+def rebuild_moov(moov: bytes, insert_at: int, moov_start: int, shift: int) -> bytes:
+    """
+    Return ``moov`` (the old index, read from ``moov_start``) rebuilt for the
+    faststart layout, where the new index, ``shift`` bytes long, goes in at
+    ``insert_at``. Chunk offsets between ``insert_at`` and ``moov_start`` move
+    forward by ``shift``. Offsets past the old index move by ``shift`` less
+    its old size: nothing unless stco tables grew into co64.
+    """
+    tail_shift = shift - len(moov)
+
+    def rebuild(buf: bytes, start: int, end: int) -> bytes:
+        out: List[bytes] = []
+        for box_type, offset, payload, box_end in iter_boxes(buf, start, end):
+            if box_type in MP4_CONTAINERS:
+                out.append(_box(box_type, rebuild(buf, payload, box_end)))
+            elif box_type in (b"stco", b"co64"):
+                offsets = [
+                    value + shift if insert_at <= value < moov_start
+                    else value + tail_shift if value >= moov_start
+                    else value
+                    for value in _chunk_offsets(box_type, buf[payload:box_end])
+                ]
+                if box_type == b"stco" and offsets and max(offsets) > STCO_MAX_OFFSET:
+                    box_type = b"co64"
+                out.append(_box(box_type, _offset_table(box_type, offsets)))
+            else:
+                out.append(buf[offset:box_end])
+        return b"".join(out)
+
+    _, _, payload, end = next(iter_boxes(moov, 0, len(moov)))
+    return _box(b"moov", rebuild(moov, payload, end))
+
+
+def plan_faststart(path: Path) -> Optional[FaststartPlan]:
+    """
+    Work out the rewritten index for ``path``, or return None when the file is
+    already faststart. Raises ProbeError for files this job cannot handle.
+    """
+    with open(path, "rb") as f:
+        size = os.fstat(f.fileno()).st_size
+        if size < 16:
+            raise ProbeError("file too small")
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as buf:
+            boxes = list(iter_boxes(buf, 0, size))
+            types = [box_type for box_type, _, _, _ in boxes]
+            if b"moov" not in types or b"mdat" not in types:
+                raise ProbeError("not a progressive MP4 (no moov or mdat)")
+            if b"moof" in types:
+                raise ProbeError("fragmented MP4 is not supported")
+            _, moov_start, _, moov_end = boxes[types.index(b"moov")]
+            insert_at = boxes[types.index(b"mdat")][1]
+            if moov_start < insert_at:
+                return None
+            moov = bytes(buf[moov_start:moov_end])
+    _, _, moov_payload, _ = next(iter_boxes(moov, 0, len(moov)))
+    if any(box_type == b"cmov" for box_type, _, _, _ in iter_boxes(moov, moov_payload, len(moov))):
+        raise ProbeError("compressed moov is not supported")
+
+    # Growing stco into co64 makes the index bigger, which shifts the data
+    # further; repeat until the size settles (at most a couple of rounds).
+    new_moov = moov
+    while True:
+        rebuilt = rebuild_moov(moov, insert_at, moov_start, len(new_moov))
+        if len(rebuilt) == len(new_moov):
+            break
+        new_moov = rebuilt
+    return FaststartPlan(path, size, insert_at, moov_start, moov_end, rebuilt)
+
+
+def copy_range(src: int, dst: int, offset: int, length: int) -> None:
+    """Copy ``length`` bytes from ``src`` at ``offset`` to the end of ``dst`` in bounded chunks."""
+    copy_file_range = getattr(os, "copy_file_range", None)
+    while length > 0:
+        size = min(COPY_CHUNK_SIZE, length)
+        copied = 0
+        if copy_file_range is not None:
+            try:
+                copied = copy_file_range(src, dst, size, offset)
+            except OSError:
+                copy_file_range = None
+        if not copied:
+            chunk = os.pread(src, size, offset)
+            if not chunk:
+                raise ProbeError("file shrank while copying")
+            write_all(dst, chunk)
+            copied = len(chunk)
+        offset += copied
+        length -= copied
+
+
+def write_all(fd: int, data: bytes) -> None:
+    view = memoryview(data)
+    while view:
+        view = view[os.write(fd, view):]
+
+
+def write_faststart(plan: FaststartPlan, target: Path) -> None:
+    """Write the faststart layout of ``plan.path`` to ``target`` (via a temporary file)."""
+    tmp_path = target.with_name(f"{target.name}.tmp")
+    src = os.open(plan.path, os.O_RDONLY)
+    try:
+        dst = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644)
+        try:
+            copy_range(src, dst, 0, plan.insert_at)
+            write_all(dst, plan.new_moov)
+            copy_range(src, dst, plan.insert_at, plan.moov_start - plan.insert_at)
+            copy_range(src, dst, plan.moov_end, plan.size - plan.moov_end)
+            os.fsync(dst)
+        finally:
+            os.close(dst)
+        shutil.copymode(plan.path, tmp_path)
+        os.replace(tmp_path, target)
+    except BaseException:
+        if tmp_path.exists():
+            tmp_path.unlink()
+        raise
+    finally:
+        os.close(src)
+
+
+def record_result(movie_id: int, optimized_location: Optional[str]) -> None:
+    with Session() as session:
+        movie = session.get(Movie, movie_id)
+        if movie is not None:
+            movie.optimized_location = optimized_location
+            session.add(movie)
+            session.commit()
+
+
+def has_fresh_copy(path: Path, optimized_location: Optional[str]) -> bool:
+    if not optimized_location:
+        return False
+    try:
+        return os.stat(optimized_location).st_mtime_ns >= os.stat(path).st_mtime_ns
+    except OSError:
+        return False
+
+
+def candidate_movies(movie_id: Optional[int]) -> List[Tuple[int, Path]]:
+    """MP4 movies without an up-to-date faststart copy."""
+    with Session() as session:
+        statement = select(Movie.id, Movie.location, Movie.optimized_location).order_by(Movie.id)
+        if movie_id is not None:
+            statement = statement.where(Movie.id == movie_id)
+        return [
+            (id_, Path(location)) for id_, location, optimized_location in session.exec(statement)
+            if location and location.lower().endswith(MP4_EXTENSIONS)
+            and not has_fresh_copy(Path(location), optimized_location)
+        ]
+
+
+def _megabytes(size: int) -> str:
+    return f"{size / (1024 ** 2):.1f} MB"
+
+
+@app.command()
+def main(
+    dry_run: bool = typer.Option(False, help="Only report which files would be rewritten."),
+    in_place: bool = typer.Option(False, help="Replace the original file instead of writing a sibling."),
+    movie_id: Optional[int] = typer.Option(None, help="Only process this movie."),
+):
+    create_db_and_tables()
+    movies = candidate_movies(movie_id)
+    typer.secho(f"🎞️ Checking {len(movies)} MP4 files for faststart layout...\n", fg=typer.colors.BRIGHT_MAGENTA)
+    pending, rewritten, failed, total_bytes = 0, 0, 0, 0
+    for id_, path in movies:
+        try:
+            plan = plan_faststart(path)
+        except (ProbeError, OSError) as e:
+            typer.secho(f"[SKIP] {path.name}: {e}", fg=typer.colors.YELLOW)
+            continue
+        if plan is None:
+            continue
+        pending += 1
+        total_bytes += plan.size
+        typer.echo(
+            f"➡️ {path.name}: moov {_megabytes(plan.moov_end - plan.moov_start)} at "
+            f"{plan.moov_start / plan.size:.0%} of {_megabytes(plan.size)}"
+            + (f", index grows by {plan.moov_growth} bytes (co64)" if plan.moov_growth else "")
+        )
+        if dry_run:
+            continue
+
+        target = path if in_place else faststart_path(path)
+        free = shutil.disk_usage(target.parent).free
+        if free < plan.size + len(plan.new_moov):
+            typer.secho(f"[ERROR] Not enough free space for {path.name}", fg=typer.colors.RED)
+            failed += 1
+            continue
+        try:
+            write_faststart(plan, target)
+        except (ProbeError, OSError) as e:
+            typer.secho(f"[ERROR] Failed to rewrite {path.name}: {e}", fg=typer.colors.RED)
+            failed += 1
+            continue
+        record_result(id_, None if in_place else str(target))
+        rewritten += 1
+        typer.secho(f"[DONE] {target}", fg=typer.colors.GREEN)
+
+    if dry_run:
+        typer.secho(
+            f"\n🧾 {pending} of {len(movies)} files need faststart ({_megabytes(total_bytes)} to rewrite)",
+            fg=typer.colors.BRIGHT_BLUE,
+        )
+    else:
+        typer.secho(f"\n✅ Rewrote {rewritten} files, {failed} failed", fg=typer.colors.BRIGHT_GREEN)
+
+
+if __name__ == "__main__":
+    app()
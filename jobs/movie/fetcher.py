@@ -0,0 +1,270 @@
+"""
+Concurrent metadata lookups for the movie jobs.
+
+Every provider call goes through one shared token-bucket rate limiter and is
+retried with exponential backoff, and lookups are spread over a bounded
+thread pool. Results come back keyed by ID, so callers assemble their output
+in whatever (deterministic) order they choose, not completion order.
+
+Providers raise ``NotFound`` when an ID definitively does not exist. That is
+the only failure the lookup cache remembers: transport errors, timeouts and
+server errors are retried on the next scan.
+
+``StubProvider`` stands in for Cinemagoer offline, with a configurable
+latency and failure rate, so the speedup can be measured without the network
+(see benchmarks/metadata_fetch.py).
+"""
+import hashlib
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, Iterable, List, Optional, TypeVar
+import typer
+
+from jobs.movie.interfaces import MetadataProvider, PersonRef, ProviderMovie, ProviderPerson
+from jobs.movie.cache import LookupCache, MISSING
+
+T = TypeVar("T")
+
+# ================= Configuration =================
+DEFAULT_WORKERS: int = 8
+DEFAULT_RATE: float = 10.0  # provider requests per second, across all workers
+DEFAULT_RETRIES: int = 3
+BACKOFF_BASE: float = 0.5  # seconds; doubled on every retry
+BACKOFF_MAX: float = 8.0
+
+
+class NotFound(LookupError):
+    """The provider answered that the ID does not exist; retrying will not help."""
+
+
+class RateLimiter:
+    """Thread-safe token bucket: ``rate`` calls per second with bursts of up to ``burst``."""
+
+    def __init__(self, rate: float, burst: Optional[int] = None):
+        self.rate = rate
+        self.capacity = float(burst or max(1, int(rate)))
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self) -> None:
+        if self.rate <= 0:
+            return
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                wait = (1 - self._tokens) / self.rate
+            time.sleep(wait)
+
+
+def with_retries(
+    call: Callable[[], T],
+    retries: int = DEFAULT_RETRIES,
+    backoff: float = BACKOFF_BASE,
+    max_backoff: float = BACKOFF_MAX,
+) -> T:
+    """Run ``call``, retrying failures with full-jitter exponential backoff."""
+    attempt = 0
+    while True:
+        try:
+            return call()
+        except NotFound:
+            raise
+        except Exception:
+            if attempt >= retries:
+                raise
+            time.sleep(random.uniform(0, min(max_backoff, backoff * (2 ** attempt))))
+            attempt += 1
+
+
+class CinemagoerProvider:
+    """MetadataProvider backed by Cinemagoer, with one client per worker thread."""
+
+    def __init__(self):
+        self._local = threading.local()
+
+    @property
+    def client(self) -> Any:
+        if not hasattr(self._local, "client"):
+            from imdb import Cinemagoer  # type: ignore
+            self._local.client = Cinemagoer()
+        return self._local.client
+
+    @staticmethod
+    def _people(people: Iterable[Any]) -> List[PersonRef]:
+        return [{"person_id": person.personID, "name": person.get("name", "Unknown")} for person in people]
+
+    @staticmethod
+    def _lookup(get: Callable[[str], Any], key: str, required: str) -> Any:
+        """
+        Call ``get``; raise NotFound on an HTTP 404 or on a result without its
+        ``required`` field (Cinemagoer answers a 404 with an empty object).
+        """
+        try:
+            result = get(key)
+        except Exception as e:
+            details = e.args[0] if e.args and isinstance(e.args[0], dict) else {}
+            original = details.get("original exception")
+            if details.get("errcode") == 404 or getattr(original, "code", None) == 404:
+                raise NotFound(key) from e
+            raise
+        if not result.get(required):
+            raise NotFound(key)
+        return result
+
+    def get_movie(self, movie_id: str) -> ProviderMovie:
+        movie = self._lookup(self.client.get_movie, movie_id, "title")
+        return {
+            "title": movie.get("title", "Unknown"),
+            "rating": float(movie.get("rating", 0.0)),
+            "plot": movie.get("plot", ""),
+            "synopsis": movie.get("synopsis", ""),
+            "cover_url": movie.get("cover url"),
+            "genres": list(movie.get("genres", [])),
+            "year": movie.get("year"),
+            "cast": self._people(movie.get("cast", [])),
+            "director": self._people(movie.get("director", [])),
+        }
+
+    def get_person(self, person_id: str) -> ProviderPerson:
+        person = self._lookup(self.client.get_person, person_id, "name")
+        return {
+            "name": person.get("name", "Unknown"),
+            "headshot": person.get("full-size headshot") or person.get("headshot"),
+        }
+
+
+class StubProvider:
+    """
+    Cinemagoer-like MetadataProvider answering from generated data after
+    ``latency`` seconds (plus up to ``jitter``). A ``failure_rate`` share of
+    calls raises ConnectionError, as a flaky network would, and a
+    ``missing_rate`` share of IDs does not exist. Answers depend only on the
+    ID and ``seed``, so every run sees the same library.
+    """
+
+    def __init__(
+        self,
+        latency: float = 0.2,
+        jitter: float = 0.05,
+        failure_rate: float = 0.0,
+        missing_rate: float = 0.0,
+        cast_size: int = 15,
+        people: int = 5000,
+        seed: int = 0,
+    ):
+        self.latency = latency
+        self.jitter = jitter
+        self.failure_rate = failure_rate
+        self.missing_rate = missing_rate
+        self.cast_size = cast_size
+        self.people = people
+        self.seed = seed
+        self.calls = 0
+        self._lock = threading.Lock()
+
+    def _answer(self, kind: str, key: str) -> random.Random:
+        """Sleep like a remote call, fail like one, and return the ID's own random generator."""
+        with self._lock:
+            self.calls += 1
+        time.sleep(self.latency + random.uniform(0, self.jitter))
+        if random.random() < self.failure_rate:
+            raise ConnectionError(f"stub provider: {kind} {key} timed out")
+        rng = random.Random(hashlib.sha256(f"{self.seed}:{kind}:{key}".encode()).digest())
+        if rng.random() < self.missing_rate:
+            raise NotFound(key)
+        return rng
+
+    def _person_ref(self, rng: random.Random) -> PersonRef:
+        person_id = f"{rng.randrange(self.people):07d}"
+        return {"person_id": person_id, "name": f"Person {person_id}"}
+
+    def get_movie(self, movie_id: str) -> ProviderMovie:
+        rng = self._answer("movie", movie_id)
+        return {
+            "title": f"Movie {movie_id}",
+            "rating": round(rng.uniform(1, 10), 1),
+            "plot": [f"Plot of {movie_id}."],
+            "synopsis": [],
+            "cover_url": f"https://example.invalid/cover/{movie_id}.jpg",
+            "genres": [rng.choice(["Drama", "Comedy", "Action", "Thriller", "Documentary"])],
+            "year": rng.randrange(1950, 2025),
+            "cast": [self._person_ref(rng) for _ in range(self.cast_size)],
+            "director": [self._person_ref(rng)],
+        }
+
+    def get_person(self, person_id: str) -> ProviderPerson:
+        self._answer("person", person_id)
+        return {"name": f"Person {person_id}", "headshot": f"https://example.invalid/person/{person_id}.jpg"}
+
+
+class MetadataFetcher:
+    """
+    Fans movie and person lookups out over a bounded, rate-limited worker pool.
+
+    With a ``cache``, cached results (including remembered not-found answers)
+    are answered without touching the rate limiter or the provider.
+    """
+
+    def __init__(
+        self,
+        provider: MetadataProvider,
+        workers: int = DEFAULT_WORKERS,
+        rate: float = DEFAULT_RATE,
+        retries: int = DEFAULT_RETRIES,
+        cache: Optional[LookupCache] = None,
+    ):
+        self.provider = provider
+        self.workers = max(1, workers)
+        self.retries = retries
+        self.cache = cache
+        self.limiter = RateLimiter(rate, burst=self.workers)
+        self.provider_calls = 0
+        self._calls_lock = threading.Lock()
+
+    def _call(self, kind: str, lookup: Callable[[str], T], key: str) -> Optional[T]:
+        if self.cache is not None:
+            cached = self.cache.get(kind, key)
+            if cached is not MISSING:
+                return cached
+
+        def attempt() -> T:
+            self.limiter.acquire()
+            with self._calls_lock:
+                self.provider_calls += 1
+            return lookup(key)
+        try:
+            result: Optional[T] = with_retries(attempt, retries=self.retries)
+        except NotFound:
+            typer.secho(f"[WARN] No {kind} {key} at the provider", fg=typer.colors.YELLOW)
+            result = None
+        except Exception as e:
+            # Possibly transient (network, timeout, 5xx): not cached, so the next scan asks again.
+            typer.secho(f"[ERROR] Lookup failed for {kind} {key}: {e}", fg=typer.colors.RED)
+            return None
+        if self.cache is not None:
+            self.cache.put(kind, key, result)
+        return result
+
+    def _map(self, kind: str, lookup: Callable[[str], T], keys: Iterable[str]) -> Dict[str, Optional[T]]:
+        unique = list(dict.fromkeys(keys))
+        if not unique:
+            return {}
+        with ThreadPoolExecutor(max_workers=min(self.workers, len(unique))) as pool:
+            results = pool.map(lambda key: self._call(kind, lookup, key), unique)
+            return dict(zip(unique, results))
+
+    def fetch_movies(self, movie_ids: Iterable[str]) -> Dict[str, Optional[ProviderMovie]]:
+        """Look up movies by IMDb number; a failed lookup maps to None."""
+        return self._map("movie", self.provider.get_movie, movie_ids)
+
+    def fetch_people(self, person_ids: Iterable[str]) -> Dict[str, Optional[ProviderPerson]]:
+        """Look up people by IMDb number, once each however many films they appear in."""
+        return self._map("person", self.provider.get_person, person_ids)
@@ -1,4 +1,4 @@
-from typing import Optional, TypedDict, List
+from typing import Any, Optional, Protocol, TypedDict, List
 
 
 class MovieMetadata(TypedDict):
@@ -29,4 +29,56 @@ class MovieRecord(TypedDict):
     plot: str
     synopsis: str
     subtitles: str
-    location: str
\ No newline at end of file
+    location: str
+    bitrate: Optional[int]
+    video_codec: Optional[str]
+    audio_codec: Optional[str]
+    width: Optional[int]
+    height: Optional[int]
+
+class MediaInfo(TypedDict):
+    """What the container probe reads from a file's headers."""
+    container: Optional[str]  # "mp4", "matroska", "webm"
+    duration: Optional[float]  # in seconds
+    bitrate: Optional[int]  # bits per second, averaged over the whole file
+    video_codec: Optional[str]  # MP4 sample entry ("avc1") or Matroska CodecID ("V_MPEGH/ISO/HEVC")
+    audio_codec: Optional[str]
+    width: Optional[int]
+    height: Optional[int]
+    moov_at_end: Optional[bool]  # MP4 only: the index follows the media data
+
+class PersonRef(TypedDict):
+    person_id: str
+    name: str
+
+class ProviderMovie(TypedDict):
+    """A movie lookup as plain data, independent of the provider's object model."""
+    title: str
+    rating: float
+    plot: Any
+    synopsis: Any
+    cover_url: Optional[str]
+    genres: List[str]
+    year: Optional[int]
+    cast: List[PersonRef]
+    director: List[PersonRef]
+
+class ProviderPerson(TypedDict):
+    name: str
+    headshot: Optional[str]
+
+class MetadataProvider(Protocol):
+    """Anything that can look movies and people up by IMDb number (no "tt"/"nm" prefix)."""
+    def get_movie(self, movie_id: str) -> ProviderMovie: ...
+    def get_person(self, person_id: str) -> ProviderPerson: ...
+
+
+class FileEntry(TypedDict):
+    size: int
+    mtime_ns: int
+    inode: int
+
+class ScanDelta(TypedDict):
+    added: List[MovieRecord]
+    changed: List[MovieRecord]
+    removed: List[str]  # locations of files that disappeared
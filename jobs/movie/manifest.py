@@ -0,0 +1,105 @@
+"""
+Stat manifest for incremental library scans.
+
+The manifest maps every media file's absolute path to the (size, mtime_ns,
+inode) it had when it was last processed. Comparing it with a fresh walk
+tells a rescan exactly which files are new, changed or gone, so only those
+need metadata work.
+"""
+import json
+import os
+from pathlib import Path
+from typing import Dict, Iterable, Iterator, List, NamedTuple, Tuple
+
+from jobs.movie.interfaces import FileEntry
+
+MANIFEST_VERSION = 1
+
+
+class ManifestDiff(NamedTuple):
+    added: List[str]
+    changed: List[str]
+    removed: List[str]
+    unchanged: int
+
+    @property
+    def empty(self) -> bool:
+        return not (self.added or self.changed or self.removed)
+
+
+def walk_files(root: Path, extensions: Iterable[str]) -> Iterator[Tuple[str, os.stat_result]]:
+    """
+    Recursively yield ``(path, stat)`` for files under ``root`` whose suffix is
+    in ``extensions``, with one scandir per directory and one stat per match.
+    Symlinked directories and hidden entries (such as faststart copies) are
+    skipped.
+    """
+    suffixes = tuple(extension.lower() for extension in extensions)
+    stack = [str(root)]
+    while stack:
+        directory = stack.pop()
+        try:
+            with os.scandir(directory) as entries:
+                for entry in entries:
+                    if entry.name.startswith("."):
+                        continue
+                    if entry.is_dir(follow_symlinks=False):
+                        stack.append(entry.path)
+                    elif entry.name.lower().endswith(suffixes) and entry.is_file():
+                        try:
+                            yield entry.path, entry.stat()
+                        except OSError:
+                            continue
+        except OSError:
+            continue
+
+
+def entry_from_stat(stat: os.stat_result) -> FileEntry:
+    return {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns, "inode": stat.st_ino}
+
+
+def snapshot(root: Path, extensions: Iterable[str]) -> Dict[str, FileEntry]:
+    return {path: entry_from_stat(stat) for path, stat in walk_files(root, extensions)}
+
+
+def load_manifest(path: Path) -> Dict[str, FileEntry]:
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            data = json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return {}
+    if data.get("version") != MANIFEST_VERSION:
+        return {}
+    return {
+        file_path: {"size": size, "mtime_ns": mtime_ns, "inode": inode}
+        for file_path, (size, mtime_ns, inode) in data.get("files", {}).items()
+    }
+
+
+def save_manifest(path: Path, manifest: Dict[str, FileEntry]) -> None:
+    """Write the manifest atomically, so an interrupted scan leaves the old one intact."""
+    data = {
+        "version": MANIFEST_VERSION,
+        "files": {
+            file_path: [entry["size"], entry["mtime_ns"], entry["inode"]]
+            for file_path, entry in manifest.items()
+        },
+    }
+    tmp_path = Path(f"{path}.tmp")
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(data, f, separators=(",", ":"))
+    os.replace(tmp_path, path)
+
+
+def diff_manifest(previous: Dict[str, FileEntry], current: Dict[str, FileEntry]) -> ManifestDiff:
+    added: List[str] = []
+    changed: List[str] = []
+    for file_path, entry in current.items():
+        old = previous.get(file_path)
+        if old is None:
+            added.append(file_path)
+        elif old != entry:
+            changed.append(file_path)
+    removed = [file_path for file_path in previous if file_path not in current]
+    unchanged = len(current) - len(added) - len(changed)
+    return ManifestDiff(sorted(added), sorted(changed), sorted(removed), unchanged)
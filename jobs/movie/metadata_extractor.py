@@ -1,43 +1,34 @@
 import json
 from pathlib import Path
-from interfaces import MovieMetadata, MovieRecord, Cast
-from typing import Optional, List, Any, Dict, Tuple
-from imdb import Cinemagoer  # type: ignore
+from jobs.movie.interfaces import MovieMetadata, MovieRecord, Cast, ProviderMovie, ProviderPerson, ScanDelta
+from jobs.movie.fetcher import (
+    MetadataFetcher, CinemagoerProvider,
+    DEFAULT_WORKERS, DEFAULT_RATE, DEFAULT_RETRIES,
+)
+from jobs.movie.cache import LookupCache, DEFAULT_TTL
+from jobs.movie.probe import try_probe
+from jobs.movie.manifest import walk_files, snapshot, load_manifest, save_manifest, diff_manifest
+from app_config import METADATA_CACHE_PATH
+from typing import Optional, List, Dict, Tuple
 import typer
 
 app = typer.Typer()
-ia: Any = Cinemagoer()
 
 # ================= Configuration =================
 ROOT_MEDIA_PATH: str = "/Users/aniketsarkar/Desktop/movies"  # ← Change this
+MEDIA_EXTENSIONS: Tuple[str, ...] = (".mp4", ".mkv", ".avi")
 
 
-def extract_casts(movie_obj: Dict[str, Any]) -> List[Cast]:
+def extract_casts(movie_obj: ProviderMovie, people: Dict[str, Optional[ProviderPerson]]) -> List[Cast]:
     casts: List[Cast] = []
-    for person in movie_obj.get('cast', []):
-        msg = typer.style("✅ Parsing Details for: ", fg=typer.colors.BRIGHT_WHITE)+typer.style(f"{person.get("name")}", fg=typer.colors.BRIGHT_GREEN)
-        typer.echo(msg)
-        try:
-            personObj = ia.get_person(person.personID)
-        except:
-            personObj = None
-        casts.append({
-            "name": person.get('name', 'Unknown'),
-            "role": "Actor",
-            "image_url": personObj.get('full-size headshot') or personObj.get('headshot', None) if personObj else None,
-        })
-    for person in movie_obj.get('director', []):
-        msg = typer.style("✅ Parsing Details for: ", fg=typer.colors.BRIGHT_WHITE)+typer.style(f"{person.get("name")}", fg=typer.colors.BRIGHT_GREEN)
-        typer.echo(msg)
-        try:
-            personObj = ia.get_person(person.personID)
-        except:
-            personObj = None
-        casts.append({
-            "name": person.get('name', 'Unknown'),
-            "role": "Director",
-            "image_url": personObj.get('full-size headshot') or personObj.get('headshot', None) if personObj else None,
-        })
+    for key, role in (("cast", "Actor"), ("director", "Director")):
+        for person in movie_obj.get(key, []):
+            person_obj = people.get(person["person_id"])
+            casts.append({
+                "name": person.get("name", "Unknown"),
+                "role": role,
+                "image_url": person_obj["headshot"] if person_obj else None,
+            })
     return casts
 
 
@@ -45,22 +36,9 @@ def get_imdb_id_from_filename(filename: str) -> Optional[str]:
     return filename.split(".")[0] if filename.startswith("tt") else None
 
 
-def get_movie_metadata(imdb_id: str) -> Tuple[MovieMetadata, List[Cast]]:
-    try:
-        movie = ia.get_movie(imdb_id[2:])  # remove "tt"
-        metadata: MovieMetadata = {
-            "rating": float(movie.get("rating", 0.0)),
-            "plot": movie.get("plot", ""),
-            "synopsis": movie.get("synopsis", ""),
-            "thumbnail": movie.get("cover url", "N/A"),
-            "category": movie.get("genres", ["Unknown"])[0],
-            "name": movie.get("title", "Unknown"),
-            "year": movie.get("year", 1970),
-        }
-        casts = extract_casts(movie)
-        return metadata, casts
-    except Exception as e:
-        typer.echo(typer.style(f"[ERROR] Failed to fetch metadata for {imdb_id}: {e}", fg=typer.colors.RED))
+def get_movie_metadata(imdb_id: str, movie: Optional[ProviderMovie]) -> MovieMetadata:
+    if movie is None:
+        typer.echo(typer.style(f"[ERROR] Failed to fetch metadata for {imdb_id}", fg=typer.colors.RED))
         return {
             "rating": 0.0,
             "plot": "",
@@ -69,7 +47,16 @@ def get_movie_metadata(imdb_id: str) -> Tuple[MovieMetadata, List[Cast]]:
             "category": "Unknown",
             "name": "Unknown",
             "year": 1970,
-        }, []
+        }
+    return {
+        "rating": movie["rating"],
+        "plot": movie["plot"],
+        "synopsis": movie["synopsis"],
+        "thumbnail": movie["cover_url"] or "N/A",
+        "category": (movie["genres"] or ["Unknown"])[0],
+        "name": movie["title"],
+        "year": movie["year"] or 1970,
+    }
 
 
 def get_file_size_in_gb(filepath: Path) -> float:
@@ -85,63 +72,207 @@ def download_subtitle_stub() -> str:
 
 # ================= Main Processor =================
 
-def process_movies(directory: Path) -> List[MovieRecord]:
-    typer.echo(typer.style(f"\n🔍 Scanning directory: {directory}", fg=typer.colors.CYAN))
+def process_movies(
+    directory: Path,
+    fetcher: Optional[MetadataFetcher] = None,
+    files: Optional[List[Path]] = None,
+    failed: Optional[List[str]] = None,
+) -> List[MovieRecord]:
+    """
+    Build a MovieRecord for every media file under ``directory`` (recursively),
+    or only for ``files`` when given. The locations whose movie or person
+    lookups or processing failed are appended to ``failed``, so callers can
+    try them again.
+
+    Movie lookups run concurrently on ``fetcher``'s pool, then every person
+    across all of those movies is looked up once, also concurrently. Records
+    come back in path order whatever order the lookups finish in.
+    """
+    fetcher = fetcher or MetadataFetcher(CinemagoerProvider())
+    if files is None:
+        typer.echo(typer.style(f"\n🔍 Scanning directory: {directory}", fg=typer.colors.CYAN))
+        files = [Path(path) for path, _ in walk_files(directory, MEDIA_EXTENSIONS)]
+    files = sorted(files, key=str)
+    queued: List[Tuple[Path, str]] = []
+    for file in files:
+        typer.echo(typer.style(f"➡️ Found media file: {file.name}", fg=typer.colors.BLUE))
+        imdb_id: Optional[str] = get_imdb_id_from_filename(file.name)
+        if not imdb_id:
+            typer.echo(typer.style(f"[SKIP] Filename does not contain IMDb ID: {file.name}", fg=typer.colors.YELLOW))
+            continue
+        queued.append((file, imdb_id))
+
+    typer.echo(f"🔎 Fetching metadata for {len(queued)} movies on {fetcher.workers} workers...")
+    movies = fetcher.fetch_movies(imdb_id[2:] for _, imdb_id in queued)  # remove "tt"
+    person_ids = [
+        person["person_id"]
+        for movie in movies.values() if movie is not None
+        for person in movie["cast"] + movie["director"]
+    ]
+    typer.echo(f"👥 Fetching details for {len(set(person_ids))} people...")
+    people = fetcher.fetch_people(person_ids)
+
     movie_data: List[MovieRecord] = []
-    total_files = 0
-    for file in directory.iterdir():
-        if file.is_file() and file.suffix.lower() in [".mp4", ".mkv", ".avi"]:
-            total_files += 1
-            typer.echo(typer.style(f"➡️ Found media file: {file.name}", fg=typer.colors.BLUE))
-            try:
-                imdb_id: Optional[str] = get_imdb_id_from_filename(file.name)
-                if not imdb_id:
-                    typer.echo(typer.style(f"[SKIP] Filename does not contain IMDb ID: {file.name}", fg=typer.colors.YELLOW))
-                    continue
-
-                typer.echo(f"🔎 Fetching metadata for {imdb_id}...")
-
-                metadata, casts = get_movie_metadata(imdb_id)
-
-                typer.echo(f"📦 Assembling movie record for '{metadata['name']}'...")
-
-                movie_record: MovieRecord = {
-                    "imdb_id": imdb_id,
-                    "name": metadata["name"],
-                    "duration": 2.0,  # Placeholder
-                    "rating": metadata["rating"],
-                    "casts": casts,
-                    "category": metadata["category"],
-                    "size": get_file_size_in_gb(file),
-                    "published_year": metadata["year"],
-                    "filename": file.name,
-                    "thumbnail": metadata["thumbnail"],
-                    "plot": metadata["plot"],
-                    "synopsis": metadata["synopsis"],
-                    "subtitles": download_subtitle_stub(),
-                    "location": str(file.resolve())
-                }
-
-                movie_data.append(movie_record)
-                typer.secho(f"[DONE] Processed: {file.name}\n", fg=typer.colors.GREEN)
-            except Exception as e:
-                typer.secho(f"[ERROR] Failed to process {file.name}: {e}\n", fg=typer.colors.RED)
-
-    typer.secho(f"📁 Total media files processed: {len(movie_data)} out of {total_files}", fg=typer.colors.BRIGHT_BLUE)
+    for file, imdb_id in queued:
+        movie = movies.get(imdb_id[2:])
+        # A record missing its movie or part of its cast is written, but looked up again next time.
+        incomplete = movie is None or any(
+            people.get(person["person_id"]) is None for person in movie["cast"] + movie["director"]
+        )
+        if incomplete and failed is not None:
+            failed.append(str(file.absolute()))
+        try:
+            metadata = get_movie_metadata(imdb_id, movie)
+            casts = extract_casts(movie, people) if movie else []
+            media = try_probe(file)
+
+            typer.echo(f"📦 Assembling movie record for '{metadata['name']}'...")
+
+            movie_record: MovieRecord = {
+                "imdb_id": imdb_id,
+                "name": metadata["name"],
+                "duration": round(media["duration"] / 60, 2) if media["duration"] else 0.0,
+                "rating": metadata["rating"],
+                "casts": casts,
+                "category": metadata["category"],
+                "size": get_file_size_in_gb(file),
+                "published_year": metadata["year"],
+                "filename": file.name,
+                "thumbnail": metadata["thumbnail"],
+                "plot": metadata["plot"],
+                "synopsis": metadata["synopsis"],
+                "subtitles": download_subtitle_stub(),
+                "location": str(file.absolute()),
+                "bitrate": media["bitrate"],
+                "video_codec": media["video_codec"],
+                "audio_codec": media["audio_codec"],
+                "width": media["width"],
+                "height": media["height"],
+            }
+
+            movie_data.append(movie_record)
+            typer.secho(f"[DONE] Processed: {file.name}\n", fg=typer.colors.GREEN)
+        except Exception as e:
+            typer.secho(f"[ERROR] Failed to process {file.name}: {e}\n", fg=typer.colors.RED)
+            if failed is not None and not incomplete:
+                failed.append(str(file.absolute()))
+
+    typer.secho(f"📁 Total media files processed: {len(movie_data)} out of {len(files)}", fg=typer.colors.BRIGHT_BLUE)
     return movie_data
 
 
+def load_records(path: Path) -> List[MovieRecord]:
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return []
+
+
+def load_delta(path: Path) -> Optional[ScanDelta]:
+    """The delta a previous run left at ``path``; the importer deletes it once applied."""
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+
+
+def merge_delta(pending: ScanDelta, delta: ScanDelta) -> ScanDelta:
+    """Fold ``delta`` into a ``pending`` one that was never imported; the newer scan wins for each location."""
+    # location -> (still new to the database, record)
+    records: Dict[str, Tuple[bool, MovieRecord]] = {}
+    for is_new, batch in ((True, pending["added"]), (False, pending["changed"]), (True, delta["added"])):
+        for record in batch:
+            records[record["location"]] = (is_new, record)
+    for record in delta["changed"]:
+        # Still added if the database has not seen the file yet.
+        is_new = records.get(record["location"], (False, None))[0]
+        records[record["location"]] = (is_new, record)
+    removed = set(pending["removed"]).difference(records)
+    for location in delta["removed"]:
+        records.pop(location, None)
+        removed.add(location)
+    ordered = sorted(records.items())
+    return {
+        "added": [record for _, (is_new, record) in ordered if is_new],
+        "changed": [record for _, (is_new, record) in ordered if not is_new],
+        "removed": sorted(removed),
+    }
+
+
 @app.command()
-def main(media_path: str = ROOT_MEDIA_PATH):
+def main(
+    media_path: str = ROOT_MEDIA_PATH,
+    workers: int = DEFAULT_WORKERS,
+    rate: float = DEFAULT_RATE,
+    retries: int = DEFAULT_RETRIES,
+    cache_path: str = str(METADATA_CACHE_PATH),
+    cache_ttl_days: float = DEFAULT_TTL / 86400,
+    no_cache: bool = False,
+    output_path: str = "movie_metadata.json",
+    manifest_path: str = "movie_manifest.json",
+    delta_path: str = "movie_metadata.delta.json",
+    full: bool = False,
+):
     typer.secho("🎬 Starting movie metadata processor...\n", fg=typer.colors.BRIGHT_MAGENTA)
-    
-    movies = process_movies(Path(media_path))
+
+    root = Path(media_path).resolve()
+    output = Path(output_path)
+    typer.echo(typer.style(f"🔍 Scanning directory: {root}", fg=typer.colors.CYAN))
+    current = snapshot(root, MEDIA_EXTENSIONS)
+    previous = {} if full or not output.exists() else load_manifest(Path(manifest_path))
+    changes = diff_manifest(previous, current)
+    typer.secho(
+        f"🧾 {len(changes.added)} new, {len(changes.changed)} changed, "
+        f"{len(changes.removed)} removed, {changes.unchanged} unchanged",
+        fg=typer.colors.BRIGHT_BLUE,
+    )
+    if changes.empty:
+        typer.echo(typer.style("✅ Library unchanged, nothing to do.\n", fg=typer.colors.BRIGHT_GREEN))
+        return
+
+    cache = None if no_cache else LookupCache(Path(cache_path), ttl=cache_ttl_days * 86400)
+    fetcher = MetadataFetcher(CinemagoerProvider(), workers=workers, rate=rate, retries=retries, cache=cache)
+    failed: List[str] = []
+    records = process_movies(
+        root, fetcher, files=[Path(path) for path in changes.added + changes.changed], failed=failed,
+    )
+
+    if cache is not None:
+        typer.secho(f"🗄️ Lookup cache: {cache.summary()}", fg=typer.colors.BRIGHT_BLUE)
+        cache.close()
+    typer.secho(f"🌐 Provider calls: {fetcher.provider_calls}", fg=typer.colors.BRIGHT_BLUE)
+
+    # Added files may have been exported before with a failed lookup; replace those records too.
+    stale = set(changes.added) | set(changes.changed) | set(changes.removed)
+    kept = [] if not previous else [record for record in load_records(output) if record["location"] not in stale]
+    movies = sorted(kept + records, key=lambda record: record["location"])
+    added = set(changes.added)
+    delta: ScanDelta = {
+        "added": [record for record in records if record["location"] in added],
+        "changed": [record for record in records if record["location"] not in added],
+        "removed": changes.removed,
+    }
+
+    pending = load_delta(Path(delta_path))
+    if pending is not None:
+        typer.secho(f"🧩 Merging into the delta not yet imported from {delta_path}", fg=typer.colors.YELLOW)
+        delta = merge_delta(pending, delta)
 
     typer.echo("📝 Saving metadata to JSON...")
-    with open("movie_metadata.json", "w", encoding="utf-8") as f:
+    with open(output, "w", encoding="utf-8") as f:
         json.dump(movies, f, indent=2, ensure_ascii=False)
+    with open(delta_path, "w", encoding="utf-8") as f:
+        json.dump(delta, f, indent=2, ensure_ascii=False)
+    # Leave failed lookups out of the manifest, so the next run looks them up again.
+    for location in failed:
+        current.pop(location, None)
+    save_manifest(Path(manifest_path), current)
+    if failed:
+        typer.secho(f"⚠️  {len(failed)} files failed and will be retried on the next run", fg=typer.colors.YELLOW)
 
-    typer.echo(typer.style("✅ Movie data exported to movie_metadata.json", fg=typer.colors.BRIGHT_GREEN))
+    typer.echo(typer.style(f"✅ Movie data exported to {output} (delta in {delta_path})", fg=typer.colors.BRIGHT_GREEN))
     typer.echo(typer.style("\n🏁 Processing complete!\n", fg=typer.colors.BRIGHT_CYAN))
 
 if __name__ == "__main__":
@@ -0,0 +1,346 @@
+"""
+Native container probe for MP4 and Matroska/WebM files.
+
+The file is memory-mapped and only header structures are read: the MP4 box
+tree (``moov`` and its children, skipping ``mdat`` by its size) or the
+Matroska EBML ``Info`` and ``Tracks`` elements (jumping over clusters, or
+straight to them through the ``SeekHead``). Probing a multi-GB file touches a
+handful of pages and takes milliseconds.
+
+Usage:
+    python -m jobs.movie.probe /path/to/movie.mkv
+"""
+import json
+import mmap
+import os
+import struct
+from pathlib import Path
+from typing import Dict, Iterator, List, Optional, Tuple, Union
+
+import typer
+
+from jobs.movie.interfaces import MediaInfo
+
+app = typer.Typer()
+
+# ================= Configuration =================
+# Boxes whose payload is just more boxes, on the path to the sample descriptions.
+MP4_CONTAINERS = {b"moov", b"trak", b"mdia", b"minf", b"stbl", b"edts"}
+
+# Matroska element IDs (marker bits included, as they appear in the file).
+EBML_HEADER = 0x1A45DFA3
+EBML_DOCTYPE = 0x4282
+MKV_SEGMENT = 0x18538067
+MKV_SEEKHEAD = 0x114D9B74
+MKV_SEEK = 0x4DBB
+MKV_SEEK_ID = 0x53AB
+MKV_SEEK_POSITION = 0x53AC
+MKV_INFO = 0x1549A966
+MKV_TIMESTAMP_SCALE = 0x2AD7B1
+MKV_DURATION = 0x4489
+MKV_TRACKS = 0x1654AE6B
+MKV_TRACK_ENTRY = 0xAE
+MKV_TRACK_TYPE = 0x83
+MKV_CODEC_ID = 0x86
+MKV_VIDEO = 0xE0
+MKV_PIXEL_WIDTH = 0xB0
+MKV_PIXEL_HEIGHT = 0xBA
+MKV_CLUSTER = 0x1F43B675
+MKV_UNKNOWN_SIZE = -1
+
+Buffer = Union[bytes, mmap.mmap]
+
+
+class ProbeError(Exception):
+    pass
+
+
+def empty_info(container: Optional[str] = None) -> MediaInfo:
+    return {
+        "container": container,
+        "duration": None,
+        "bitrate": None,
+        "video_codec": None,
+        "audio_codec": None,
+        "width": None,
+        "height": None,
+        "moov_at_end": None,
+    }
+
+
+def _finish(info: MediaInfo, size: int) -> MediaInfo:
+    if info["duration"]:
+        info["bitrate"] = int(size * 8 / info["duration"])
+    return info
+
+
+# ================= MP4 =================
+
+def iter_boxes(buf: Buffer, start: int, end: int) -> Iterator[Tuple[bytes, int, int, int]]:
+    """Yield ``(type, box_offset, payload_offset, box_end)`` for the boxes in ``[start, end)``."""
+    offset = start
+    while offset + 8 <= end:
+        size, box_type = struct.unpack_from(">I4s", buf, offset)
+        header = 8
+        if size == 1:
+            if offset + 16 > end:
+                return
+            size = struct.unpack_from(">Q", buf, offset + 8)[0]
+            header = 16
+        elif size == 0:
+            size = end - offset  # box runs to the end of its parent
+        if size < header:
+            raise ProbeError(f"corrupt {box_type!r} box at {offset}")
+        yield box_type, offset, offset + header, min(offset + size, end)
+        offset += size
+
+
+def _full_box(buf: mmap.mmap, payload: int) -> Tuple[int, int]:
+    """Return ``(version, offset of the fields after version/flags)``."""
+    return buf[payload], payload + 4
+
+
+def _parse_mvhd(buf: mmap.mmap, payload: int) -> Optional[float]:
+    version, fields = _full_box(buf, payload)
+    if version == 1:
+        timescale, duration = struct.unpack_from(">IQ", buf, fields + 16)
+    else:
+        timescale, duration = struct.unpack_from(">II", buf, fields + 8)
+    return duration / timescale if timescale else None
+
+
+def _parse_trak(buf: mmap.mmap, start: int, end: int) -> Dict[str, object]:
+    track: Dict[str, object] = {}
+    stack = [(start, end)]
+    while stack:
+        box_start, box_end = stack.pop()
+        for box_type, _, payload, child_end in iter_boxes(buf, box_start, box_end):
+            if box_type in MP4_CONTAINERS:
+                stack.append((payload, child_end))
+            elif box_type == b"tkhd":
+                # Width and height are the last two 16.16 fields of the box.
+                width, height = struct.unpack_from(">II", buf, child_end - 8)
+                track["width"], track["height"] = width >> 16, height >> 16
+            elif box_type == b"hdlr":
+                track["handler"] = bytes(buf[payload + 8:payload + 12])
+            elif box_type == b"stsd":
+                # The first sample entry's type is the codec fourcc (avc1, hvc1, mp4a, ...).
+                entry = payload + 8
+                if entry + 8 <= child_end:
+                    track["codec"] = bytes(buf[entry + 4:entry + 8]).decode("latin-1").strip()
+                    if entry + 36 <= child_end:
+                        track["entry_size"] = struct.unpack_from(">HH", buf, entry + 32)
+    return track
+
+
+def probe_mp4(buf: mmap.mmap, size: int) -> MediaInfo:
+    info = empty_info("mp4")
+    moov: Optional[Tuple[int, int, int]] = None
+    mdat_offset: Optional[int] = None
+    for box_type, offset, payload, end in iter_boxes(buf, 0, size):
+        if box_type == b"moov" and moov is None:
+            moov = (offset, payload, end)
+        elif box_type == b"mdat" and mdat_offset is None:
+            mdat_offset = offset
+    if moov is None:
+        raise ProbeError("no moov box")
+    moov_offset, moov_payload, moov_end = moov
+    info["moov_at_end"] = mdat_offset is not None and moov_offset > mdat_offset
+
+    for box_type, _, payload, end in iter_boxes(buf, moov_payload, moov_end):
+        if box_type == b"mvhd":
+            info["duration"] = _parse_mvhd(buf, payload)
+        elif box_type == b"trak":
+            track = _parse_trak(buf, payload, end)
+            if track.get("handler") == b"vide" and info["video_codec"] is None:
+                info["video_codec"] = track.get("codec")
+                width, height = track.get("width") or 0, track.get("height") or 0
+                if not (width and height) and "entry_size" in track:
+                    width, height = track["entry_size"]
+                info["width"], info["height"] = width or None, height or None
+            elif track.get("handler") == b"soun" and info["audio_codec"] is None:
+                info["audio_codec"] = track.get("codec")
+    return _finish(info, size)
+
+
+# ================= Matroska =================
+
+def read_vint(buf: mmap.mmap, offset: int, keep_marker: bool) -> Tuple[int, int]:
+    """Read an EBML variable-length integer; return ``(value, length)``."""
+    first = buf[offset]
+    if first == 0:
+        raise ProbeError(f"invalid EBML vint at {offset}")
+    length = 1
+    mask = 0x80
+    while not first & mask:
+        mask >>= 1
+        length += 1
+    value = first if keep_marker else first & (mask - 1)
+    all_ones = value == mask - 1
+    for byte in buf[offset + 1:offset + length]:
+        value = (value << 8) | byte
+        all_ones = all_ones and byte == 0xFF
+    if not keep_marker and all_ones:
+        return MKV_UNKNOWN_SIZE, length
+    return value, length
+
+
+def iter_elements(buf: mmap.mmap, start: int, end: int) -> Iterator[Tuple[int, int, int, int]]:
+    """Yield ``(id, element_offset, data_offset, data_end)`` for the elements in ``[start, end)``."""
+    offset = start
+    while offset < end:
+        element_id, id_length = read_vint(buf, offset, keep_marker=True)
+        size, size_length = read_vint(buf, offset + id_length, keep_marker=False)
+        data = offset + id_length + size_length
+        data_end = end if size == MKV_UNKNOWN_SIZE else min(data + size, end)
+        yield element_id, offset, data, data_end
+        if size == MKV_UNKNOWN_SIZE:
+            return  # only clusters and segments use this; nothing after it can be skipped to
+        offset = data_end
+
+
+def _uint(buf: mmap.mmap, start: int, end: int) -> int:
+    return int.from_bytes(buf[start:end], "big")
+
+
+def _float(buf: mmap.mmap, start: int, end: int) -> float:
+    return struct.unpack(">f" if end - start == 4 else ">d", buf[start:end])[0]
+
+
+def _parse_info(buf: mmap.mmap, start: int, end: int) -> Optional[float]:
+    scale, duration = 1_000_000, None
+    for element_id, _, data, data_end in iter_elements(buf, start, end):
+        if element_id == MKV_TIMESTAMP_SCALE:
+            scale = _uint(buf, data, data_end)
+        elif element_id == MKV_DURATION:
+            duration = _float(buf, data, data_end)
+    return duration * scale / 1e9 if duration else None
+
+
+def _parse_tracks(buf: mmap.mmap, start: int, end: int, info: MediaInfo) -> None:
+    for element_id, _, data, data_end in iter_elements(buf, start, end):
+        if element_id != MKV_TRACK_ENTRY:
+            continue
+        track_type, codec, width, height = None, None, None, None
+        for child_id, _, child, child_end in iter_elements(buf, data, data_end):
+            if child_id == MKV_TRACK_TYPE:
+                track_type = _uint(buf, child, child_end)
+            elif child_id == MKV_CODEC_ID:
+                codec = bytes(buf[child:child_end]).rstrip(b"\0").decode("ascii", "replace")
+            elif child_id == MKV_VIDEO:
+                for video_id, _, value, value_end in iter_elements(buf, child, child_end):
+                    if video_id == MKV_PIXEL_WIDTH:
+                        width = _uint(buf, value, value_end)
+                    elif video_id == MKV_PIXEL_HEIGHT:
+                        height = _uint(buf, value, value_end)
+        if track_type == 1 and info["video_codec"] is None:
+            info["video_codec"], info["width"], info["height"] = codec, width, height
+        elif track_type == 2 and info["audio_codec"] is None:
+            info["audio_codec"] = codec
+
+
+def _parse_seekhead(buf: mmap.mmap, start: int, end: int, segment: int) -> Dict[int, int]:
+    positions: Dict[int, int] = {}
+    for element_id, _, data, data_end in iter_elements(buf, start, end):
+        if element_id != MKV_SEEK:
+            continue
+        seek_id, position = None, None
+        for child_id, _, child, child_end in iter_elements(buf, data, data_end):
+            if child_id == MKV_SEEK_ID:
+                seek_id = _uint(buf, child, child_end)
+            elif child_id == MKV_SEEK_POSITION:
+                position = _uint(buf, child, child_end)
+        if seek_id is not None and position is not None:
+            positions.setdefault(seek_id, segment + position)
+    return positions
+
+
+def probe_matroska(buf: mmap.mmap, size: int) -> MediaInfo:
+    info = empty_info("matroska")
+    segment: Optional[Tuple[int, int]] = None
+    for element_id, _, data, data_end in iter_elements(buf, 0, size):
+        if element_id == EBML_HEADER:
+            for child_id, _, child, child_end in iter_elements(buf, data, data_end):
+                if child_id == EBML_DOCTYPE:
+                    info["container"] = bytes(buf[child:child_end]).rstrip(b"\0").decode("ascii", "replace")
+        elif element_id == MKV_SEGMENT:
+            segment = (data, data_end)
+            break
+    if segment is None:
+        raise ProbeError("no Segment element")
+    segment_start, segment_end = segment
+
+    found: Dict[int, bool] = {MKV_INFO: False, MKV_TRACKS: False}
+    seeks: Dict[int, int] = {}
+
+    def parse(element_id: int, data: int, data_end: int) -> None:
+        if element_id == MKV_INFO:
+            info["duration"] = _parse_info(buf, data, data_end)
+        else:
+            _parse_tracks(buf, data, data_end, info)
+        found[element_id] = True
+
+    for element_id, _, data, data_end in iter_elements(buf, segment_start, segment_end):
+        if element_id in found and not found[element_id]:
+            parse(element_id, data, data_end)
+        elif element_id == MKV_SEEKHEAD:
+            seeks.update(_parse_seekhead(buf, data, data_end, segment_start))
+        elif element_id == MKV_CLUSTER:
+            # Media data from here on: jump to anything still missing rather
+            # than walking every cluster header.
+            for missing in [key for key, done in found.items() if not done]:
+                position = seeks.get(missing)
+                if position is None or position >= size:
+                    continue
+                for seek_id, _, seek_data, seek_end in iter_elements(buf, position, segment_end):
+                    if seek_id == missing:
+                        parse(seek_id, seek_data, seek_end)
+                    break
+            break
+        if all(found.values()):
+            break
+    return _finish(info, size)
+
+
+# ================= Entry Point =================
+
+def probe_file(path: Path) -> MediaInfo:
+    """
+    Probe an MP4/MOV or Matroska/WebM file. Raises ProbeError for unknown or
+    corrupt containers and OSError if the file cannot be read.
+    """
+    with open(path, "rb") as f:
+        size = os.fstat(f.fileno()).st_size
+        if size < 16:
+            raise ProbeError("file too small")
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as buf:
+            if hasattr(buf, "madvise"):
+                # Without this the first page fault reads ahead megabytes of media we never look at.
+                buf.madvise(mmap.MADV_RANDOM)
+            try:
+                if struct.unpack_from(">I", buf, 0)[0] == EBML_HEADER:
+                    return probe_matroska(buf, size)
+                if buf[4:8] in (b"ftyp", b"moov", b"mdat", b"free", b"skip", b"wide"):
+                    return probe_mp4(buf, size)
+            except (IndexError, struct.error, ValueError) as e:
+                raise ProbeError(f"truncated or corrupt container: {e}") from e
+    raise ProbeError("unrecognised container")
+
+
+def try_probe(path: Path) -> MediaInfo:
+    """probe_file that logs failures and falls back to an empty MediaInfo."""
+    try:
+        return probe_file(path)
+    except (ProbeError, OSError) as e:
+        typer.secho(f"[WARN] Could not probe {Path(path).name}: {e}", fg=typer.colors.YELLOW)
+        return empty_info()
+
+
+@app.command()
+def main(paths: List[Path] = typer.Argument(..., help="Media files to probe.")):
+    for path in paths:
+        typer.echo(json.dumps({"path": str(path), **try_probe(path)}))
+
+
+if __name__ == "__main__":
+    app()
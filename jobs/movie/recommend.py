@@ -0,0 +1,263 @@
+"""
+"More like this": precompute the most similar titles of every movie.
+
+Each movie is described by two sparse feature blocks built from what the
+catalog already stores:
+
+* cast    - the people linked through ``MovieCastLink``, idf-weighted so a
+            shared lead actor counts for more than a shared prolific extra
+* cowatch - the users who watched it (``WatchHistory`` with some progress),
+            idf-weighted so a user who watches everything says little
+
+Each block is L2-normalised per row and scaled by the square root of its
+weight, so the dot product of two rows is the weighted sum of the per-block
+cosine similarities. Keys shared by more than ``MAX_KEY_MOVIES`` movies are
+left out: they carry almost no idf weight but would pair up most of the
+catalog. Similarities are computed for blocks of rows at a time as one sparse
+matrix product against the whole catalog.
+
+Genre is too coarse for that product (every pair within a genre would become
+a candidate), so it only adds a bonus to candidate pairs, as year and rating
+closeness do. Each movie also gets the ``2 * TOP_K`` movies of its genre
+closest in year as candidates, so titles without cast or viewers still get a
+list. The best ``TOP_K`` of each row are written to ``moviesimilarity``;
+serving them is an indexed lookup (``GET /media/movie/{id}/similar``).
+
+By default only movies without neighbours yet (new since the last run) are
+computed. Each new movie is also offered to its neighbours' lists, where it
+replaces a weaker entry. ``--full`` rebuilds every list, which also picks up
+new watch history.
+
+Usage:
+    python -m jobs.movie.recommend [--full] [--movie-id 42]
+"""
+import time
+from typing import Dict, Iterator, List, NamedTuple, Optional, Tuple
+
+import numpy as np
+import typer
+from scipy import sparse
+from sqlalchemy import Connection
+
+from database import catalog_bulk_write, create_db_and_tables, engine
+
+app = typer.Typer()
+
+# ================= Configuration =================
+TOP_K: int = 20
+BLOCK_ROWS: int = 2048  # rows per sparse product; bounds memory to a few million candidate pairs
+WEIGHTS: Dict[str, float] = {"genre": 1.0, "cast": 2.0, "cowatch": 3.0, "year": 0.5, "rating": 0.5}
+MAX_KEY_MOVIES: int = 500  # cast members / viewers in more movies than this are ignored
+YEAR_SPAN: float = 10.0  # years apart at which year closeness reaches 0
+RATING_SPAN: float = 3.0  # rating points apart at which rating closeness reaches 0
+COWATCH_MIN_PROGRESS: float = 20.0  # percent; below this a view is not counted
+
+
+class CatalogFeatures(NamedTuple):
+    movie_ids: np.ndarray  # sorted; row i describes movie_ids[i]
+    strong: sparse.csr_matrix  # cast | cowatch blocks
+    genres: np.ndarray  # category code per row
+    years: np.ndarray
+    ratings: np.ndarray
+    by_genre_year: np.ndarray  # rows ordered by (genre, year, id)
+    position: np.ndarray  # row -> its index in by_genre_year
+
+
+# ================= Feature Matrices =================
+def normalize_rows(matrix: sparse.csr_matrix, weight: float) -> sparse.csr_matrix:
+    """Scale every non-empty row to length sqrt(weight)."""
+    norms = np.sqrt(np.asarray(matrix.multiply(matrix).sum(axis=1)).ravel())
+    scale = np.divide(np.sqrt(weight), norms, out=np.zeros_like(norms), where=norms > 0)
+    return sparse.diags(scale) @ matrix
+
+
+def incidence(rows: np.ndarray, keys: np.ndarray, n_rows: int) -> sparse.csr_matrix:
+    """Idf-weighted movie x key matrix from (row, key) pairs, without keys of more than MAX_KEY_MOVIES movies."""
+    if len(rows) == 0:
+        return sparse.csr_matrix((n_rows, 1))
+    _, cols = np.unique(keys, return_inverse=True)
+    matrix = sparse.csr_matrix((np.ones(len(rows)), (rows, cols)), shape=(n_rows, cols.max() + 1))
+    matrix.data[:] = 1.0  # duplicate pairs collapse to one
+    document_frequency = np.bincount(matrix.indices, minlength=matrix.shape[1])
+    idf = np.where(document_frequency <= MAX_KEY_MOVIES, np.log(n_rows / np.maximum(document_frequency, 1)), 0.0)
+    matrix = (matrix @ sparse.diags(idf)).tocsr()
+    matrix.eliminate_zeros()
+    return matrix
+
+
+def fetch_pairs(connection: Connection, sql: str, *params) -> np.ndarray:
+    """Two integer columns of a query as an (n, 2) array."""
+    # Plain tuples: numpy probes SQLAlchemy rows for the array protocol one by one, which is slow.
+    rows = [tuple(row) for row in connection.exec_driver_sql(sql, params)]
+    return np.array(rows, dtype=np.int64).reshape(-1, 2)
+
+
+def load_features(connection: Connection) -> CatalogFeatures:
+    movies = [tuple(row) for row in connection.exec_driver_sql("SELECT id, category, published_year, rating FROM movie ORDER BY id")]
+    movie_ids = np.array([movie[0] for movie in movies], dtype=np.int64)
+    _, genres = np.unique(np.array([movie[1] for movie in movies], dtype=object), return_inverse=True)
+    years = np.array([movie[2] for movie in movies], dtype=float)
+    ratings = np.array([movie[3] for movie in movies], dtype=float)
+    n = len(movie_ids)
+
+    links = fetch_pairs(connection, "SELECT movie_id, cast_id FROM moviecastlink")
+    links = links[np.isin(links[:, 0], movie_ids)]
+    cast = incidence(np.searchsorted(movie_ids, links[:, 0]), links[:, 1], n)
+
+    views = fetch_pairs(connection, "SELECT movie_id, user_id FROM watchhistory WHERE progress >= ?", COWATCH_MIN_PROGRESS)
+    views = views[np.isin(views[:, 0], movie_ids)]
+    cowatch = incidence(np.searchsorted(movie_ids, views[:, 0]), views[:, 1], n)
+
+    strong = sparse.hstack([
+        normalize_rows(cast, WEIGHTS["cast"]),
+        normalize_rows(cowatch, WEIGHTS["cowatch"]),
+    ], format="csr")
+    by_genre_year = np.lexsort((movie_ids, years, genres))
+    position = np.empty(n, dtype=np.int64)
+    position[by_genre_year] = np.arange(n)
+    return CatalogFeatures(movie_ids, strong, genres.astype(np.int64), years, ratings, by_genre_year, position)
+
+
+# ================= Similarity =================
+def block_neighbours(features: CatalogFeatures, rows: np.ndarray, k: int = TOP_K) -> List[tuple]:
+    """
+    Top-``k`` neighbours of the given rows, as (movie_id, rank, similar_id,
+    score) tuples sorted by movie and rank.
+    """
+    product = (features.strong[rows] @ features.strong.T).tocoo()
+
+    # Same-genre movies nearest in year, found by position in the (genre, year) order.
+    offsets = np.concatenate([np.arange(-k, 0), np.arange(1, k + 1)])
+    window = (features.position[rows][:, None] + offsets).ravel()
+    window_source = np.repeat(rows, len(offsets))
+    inside = (window >= 0) & (window < len(features.movie_ids))
+    window_source, window_target = window_source[inside], features.by_genre_year[window[inside]]
+    same_genre = features.genres[window_source] == features.genres[window_target]
+
+    source = np.concatenate([rows[product.row], window_source[same_genre]])
+    target = np.concatenate([product.col, window_target[same_genre]])
+    score = np.concatenate([product.data, np.zeros(np.count_nonzero(same_genre))])
+    keep = source != target
+    source, target, score = source[keep], target[keep], score[keep]
+    # A pair found both ways keeps its product score.
+    order = np.lexsort((-score, target, source))
+    source, target, score = source[order], target[order], score[order]
+    first = np.ones(len(source), dtype=bool)
+    first[1:] = (source[1:] != source[:-1]) | (target[1:] != target[:-1])
+    source, target, score = source[first], target[first], score[first]
+
+    score = score + WEIGHTS["genre"] * (features.genres[source] == features.genres[target])
+    score = score + WEIGHTS["year"] * np.clip(1 - np.abs(features.years[source] - features.years[target]) / YEAR_SPAN, 0, 1)
+    score = score + WEIGHTS["rating"] * np.clip(1 - np.abs(features.ratings[source] - features.ratings[target]) / RATING_SPAN, 0, 1)
+
+    # Ties go to the lower movie id, so results are deterministic.
+    order = np.lexsort((target, -score, source))
+    source, target, score = source[order], target[order], score[order]
+    rank = np.arange(len(source)) - np.searchsorted(source, source, side="left")
+    keep = rank < k
+    return list(zip(
+        features.movie_ids[source[keep]].tolist(), rank[keep].tolist(),
+        features.movie_ids[target[keep]].tolist(), np.round(score[keep], 6).tolist(),
+    ))
+
+
+def iter_neighbour_blocks(features: CatalogFeatures, rows: np.ndarray, k: int = TOP_K) -> Iterator[List[tuple]]:
+    for start in range(0, len(rows), BLOCK_ROWS):
+        yield block_neighbours(features, rows[start:start + BLOCK_ROWS], k)
+
+
+# ================= Storage =================
+INSERT_SQL = "INSERT INTO moviesimilarity (movie_id, rank, similar_id, score) VALUES (?, ?, ?, ?)"
+
+
+def rebuild_all(connection: Connection, features: CatalogFeatures) -> int:
+    written = 0
+    with catalog_bulk_write(connection):
+        connection.exec_driver_sql("DELETE FROM moviesimilarity")
+        for rows in iter_neighbour_blocks(features, np.arange(len(features.movie_ids))):
+            if rows:
+                connection.exec_driver_sql(INSERT_SQL, rows)
+                written += len(rows)
+    return written
+
+
+def update_movies(connection: Connection, features: CatalogFeatures, movie_ids: List[int], k: int = TOP_K) -> int:
+    """
+    Compute the lists of ``movie_ids`` and offer each of them to the lists of
+    its neighbours (similarity is symmetric), replacing weaker entries.
+    """
+    rows = np.flatnonzero(np.isin(features.movie_ids, np.array(movie_ids, dtype=np.int64)))
+    if len(rows) == 0:
+        return 0
+    updated = set(features.movie_ids[rows].tolist())
+    offers: Dict[int, List[Tuple[float, int]]] = {}
+    written = 0
+    with catalog_bulk_write(connection):
+        connection.exec_driver_sql("DELETE FROM moviesimilarity WHERE movie_id = ?", [(movie_id,) for movie_id in updated])
+        for new_rows in iter_neighbour_blocks(features, rows, k):
+            if not new_rows:
+                continue
+            connection.exec_driver_sql(INSERT_SQL, new_rows)
+            written += len(new_rows)
+            for movie_id, _, similar_id, value in new_rows:
+                if similar_id not in updated:
+                    offers.setdefault(similar_id, []).append((value, movie_id))
+        written += merge_offers(connection, offers, k)
+    return written
+
+
+def merge_offers(connection: Connection, offers: Dict[int, List[Tuple[float, int]]], k: int = TOP_K) -> int:
+    written = 0
+    for movie_id, offered in offers.items():
+        current = [
+            (score, similar_id) for similar_id, score in connection.exec_driver_sql(
+                "SELECT similar_id, score FROM moviesimilarity WHERE movie_id = ?", (movie_id,),
+            )
+        ]
+        offered_ids = {similar_id for _, similar_id in offered}
+        merged = sorted(
+            [entry for entry in current if entry[1] not in offered_ids] + offered,
+            key=lambda entry: (-entry[0], entry[1]),
+        )[:k]
+        if merged == sorted(current, key=lambda entry: (-entry[0], entry[1])):
+            continue
+        connection.exec_driver_sql("DELETE FROM moviesimilarity WHERE movie_id = ?", (movie_id,))
+        connection.exec_driver_sql(INSERT_SQL, [
+            (movie_id, rank, similar_id, score) for rank, (score, similar_id) in enumerate(merged)
+        ])
+        written += len(merged)
+    return written
+
+
+def movies_without_neighbours(connection: Connection) -> List[int]:
+    return [row[0] for row in connection.exec_driver_sql(
+        "SELECT id FROM movie WHERE id NOT IN (SELECT DISTINCT movie_id FROM moviesimilarity) ORDER BY id"
+    )]
+
+
+@app.command()
+def main(
+    full: bool = typer.Option(False, help="Recompute every movie's list, not only new movies."),
+    movie_id: Optional[List[int]] = typer.Option(None, help="Also recompute these movies."),
+):
+    create_db_and_tables()
+    started = time.perf_counter()
+    with engine.begin() as connection:
+        features = load_features(connection)
+        typer.secho(
+            f"🧮 {len(features.movie_ids)} movies, {features.strong.shape[1]} features, "
+            f"{features.strong.nnz} non-zeros ({time.perf_counter() - started:.2f}s)",
+            fg=typer.colors.BRIGHT_BLUE,
+        )
+        pending = movies_without_neighbours(connection) + list(movie_id or [])
+        if full or len(pending) == len(features.movie_ids):
+            typer.secho("🎯 Rebuilding every similarity list...\n", fg=typer.colors.BRIGHT_MAGENTA)
+            written = rebuild_all(connection, features)
+        else:
+            typer.secho(f"🎯 Updating {len(pending)} movies...\n", fg=typer.colors.BRIGHT_MAGENTA)
+            written = update_movies(connection, features, pending)
+    typer.secho(f"✅ Wrote {written} similarity rows ({time.perf_counter() - started:.2f}s)", fg=typer.colors.BRIGHT_GREEN)
+
+
+if __name__ == "__main__":
+    app()
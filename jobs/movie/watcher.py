@@ -0,0 +1,502 @@
+"""
+Live library watcher: keeps the Movie table in sync with MOVIE_MEDIA_DIR.
+
+File events come from inotify on Linux (through libc, no extra dependency)
+and from periodic manifest diffs everywhere else. Events are coalesced per
+path and only acted on once the path has been quiet for ``debounce`` seconds
+and its size has stopped changing, so a download in progress is picked up
+once, when it is complete. Each settled batch becomes a ScanDelta that is
+applied to the database through the importer, touching only affected rows.
+
+Failures do not stop the watcher. A batch that cannot be written is queued
+again with exponential backoff, and so are files whose metadata lookup
+failed (up to ``LOOKUP_RETRIES`` times; they are marked stale in the manifest
+so the next reconcile retries them after that). Errors from the event
+backend or a rescan (e.g. ENOSPC from inotify) restart the backend after a
+backoff. ``summary()`` reports the watcher's state; it is also written to
+``WATCHER_STATUS_PATH`` so a server whose watcher runs in another process
+can serve it at ``GET /health/watcher``.
+
+Run it standalone with ``python -m jobs.movie.watcher`` or set
+``WATCH_LIBRARY=1`` to run it inside the server's lifespan.
+"""
+import ctypes
+import ctypes.util
+import errno
+import json
+import os
+import select
+import struct
+import threading
+import time
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterable, List, Optional, Set
+import typer
+
+from app_config import (
+    MOVIE_MEDIA_DIR, METADATA_CACHE_PATH, WATCHER_MANIFEST_PATH, WATCHER_STATUS_PATH,
+    WATCH_DEBOUNCE, WATCH_POLL_INTERVAL,
+)
+from database import create_db_and_tables
+from jobs.movie.interfaces import FileEntry, ScanDelta
+from jobs.movie.cache import LookupCache
+from jobs.movie.fetcher import MetadataFetcher, CinemagoerProvider
+from jobs.movie.importer import apply_delta
+from jobs.movie.manifest import entry_from_stat, snapshot, load_manifest, save_manifest, diff_manifest
+from jobs.movie.metadata_extractor import MEDIA_EXTENSIONS, process_movies
+
+app = typer.Typer()
+
+# ================= Configuration =================
+RETRY_BACKOFF: float = 5.0  # seconds before the first retry of a failed sync; doubled per further failure
+RETRY_BACKOFF_MAX: float = 300.0
+LOOKUP_RETRIES: int = 5  # retries of a file whose metadata lookup failed, before waiting for a reconcile
+STALE: FileEntry = {"size": -1, "mtime_ns": -1, "inode": -1}  # matches no file, so a reconcile re-reads it
+
+
+def backoff(failures: int) -> float:
+    return min(RETRY_BACKOFF_MAX, RETRY_BACKOFF * 2 ** max(0, failures - 1))
+
+
+# ================= inotify =================
+IN_MODIFY = 0x00000002
+IN_ATTRIB = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+IN_ISDIR = 0x40000000
+WATCH_MASK = (
+    IN_MODIFY | IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO
+    | IN_CREATE | IN_DELETE | IN_DELETE_SELF | IN_MOVE_SELF | IN_ONLYDIR
+)
+EVENT_HEADER = struct.Struct("iIII")
+READ_SIZE = 64 * 1024
+
+
+class RescanNeeded(Exception):
+    """The event stream lost events (queue overflow); the caller must diff from scratch."""
+
+
+class InotifyBackend:
+    """Recursive inotify watch over a directory tree; blocks in select() between events."""
+
+    def __init__(self, root: Path, wake_fd: int):
+        libc_name = ctypes.util.find_library("c")
+        if not libc_name:
+            raise OSError("libc not found")
+        self._libc = ctypes.CDLL(libc_name, use_errno=True)
+        if not hasattr(self._libc, "inotify_init1"):
+            raise OSError("inotify is not available")
+        self.fd = self._libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        self.wake_fd = wake_fd
+        self._dirs: Dict[int, str] = {}
+        self.add_tree(str(root))
+
+    def _add_watch(self, directory: str) -> None:
+        wd = self._libc.inotify_add_watch(self.fd, os.fsencode(directory), WATCH_MASK)
+        if wd < 0:
+            code = ctypes.get_errno()
+            if code == errno.ENOSPC:
+                raise OSError(code, "inotify watch limit reached (fs.inotify.max_user_watches)")
+            return
+        self._dirs[wd] = directory
+
+    def add_tree(self, directory: str) -> Set[str]:
+        """Watch ``directory`` and everything below it; returns the files already inside."""
+        found: Set[str] = set()
+        stack = [directory]
+        while stack:
+            current = stack.pop()
+            self._add_watch(current)
+            try:
+                with os.scandir(current) as entries:
+                    for entry in entries:
+                        if entry.is_dir(follow_symlinks=False):
+                            stack.append(entry.path)
+                        else:
+                            found.add(entry.path)
+            except OSError:
+                continue
+        return found
+
+    def wait(self, timeout: Optional[float]) -> Set[str]:
+        """Block until events arrive (or ``timeout``) and return the paths they touched."""
+        readable, _, _ = select.select([self.fd, self.wake_fd], [], [], timeout)
+        if self.fd not in readable:
+            return set()
+        changed: Set[str] = set()
+        while True:
+            try:
+                data = os.read(self.fd, READ_SIZE)
+            except BlockingIOError:
+                return changed
+            offset = 0
+            while offset < len(data):
+                wd, mask, _, length = EVENT_HEADER.unpack_from(data, offset)
+                offset += EVENT_HEADER.size
+                name = os.fsdecode(data[offset:offset + length].rstrip(b"\0"))
+                offset += length
+                if mask & IN_Q_OVERFLOW:
+                    raise RescanNeeded
+                directory = self._dirs.get(wd)
+                if directory is None:
+                    continue
+                if mask & IN_IGNORED:
+                    self._dirs.pop(wd, None)
+                    continue
+                if mask & (IN_DELETE_SELF | IN_MOVE_SELF):
+                    # Everything below a vanished directory is reported by prefix.
+                    changed.add(directory + os.sep)
+                    continue
+                path = os.path.join(directory, name) if name else directory
+                if mask & IN_ISDIR:
+                    if mask & (IN_CREATE | IN_MOVED_TO):
+                        changed |= self.add_tree(path)
+                    elif mask & IN_MOVED_FROM:
+                        changed.add(path + os.sep)
+                    continue
+                changed.add(path)
+
+    def close(self) -> None:
+        os.close(self.fd)
+
+
+class PollingBackend:
+    """Fallback: diff a fresh scandir walk against the previous one every ``interval`` seconds."""
+
+    def __init__(self, root: Path, wake_fd: int, interval: float):
+        self.root = root
+        self.wake_fd = wake_fd
+        self.interval = interval
+        self._snapshot = snapshot(root, MEDIA_EXTENSIONS)
+        self._next_poll = time.monotonic() + interval
+
+    def wait(self, timeout: Optional[float]) -> Set[str]:
+        now = time.monotonic()
+        until_poll = max(0.0, self._next_poll - now)
+        select.select([self.wake_fd], [], [], until_poll if timeout is None else min(timeout, until_poll))
+        if time.monotonic() < self._next_poll:
+            return set()
+        self._next_poll = time.monotonic() + self.interval
+        current = snapshot(self.root, MEDIA_EXTENSIONS)
+        changes = diff_manifest(self._snapshot, current)
+        self._snapshot = current
+        return set(changes.added + changes.changed + changes.removed)
+
+    def close(self) -> None:
+        pass
+
+
+# ================= Watcher =================
+
+class LibraryWatcher:
+    def __init__(
+        self,
+        root: Path = MOVIE_MEDIA_DIR,
+        manifest_path: Path = WATCHER_MANIFEST_PATH,
+        debounce: float = WATCH_DEBOUNCE,
+        poll_interval: float = WATCH_POLL_INTERVAL,
+        force_polling: bool = False,
+        fetcher: Optional[MetadataFetcher] = None,
+        on_change: Optional[Callable[[ScanDelta], None]] = None,
+        status_path: Optional[Path] = WATCHER_STATUS_PATH,
+    ):
+        self.root = Path(root).resolve()
+        self.manifest_path = Path(manifest_path)
+        self.status_path = Path(status_path) if status_path else None
+        self.debounce = debounce
+        self.poll_interval = poll_interval
+        self.force_polling = force_polling
+        self.fetcher = fetcher or MetadataFetcher(CinemagoerProvider(), cache=LookupCache(METADATA_CACHE_PATH))
+        self.on_change = on_change
+        self.manifest: Dict[str, FileEntry] = load_manifest(self.manifest_path)
+        self._pending: Dict[str, float] = {}  # path -> monotonic deadline
+        self._sizes: Dict[str, int] = {}  # size seen at the last settle check
+        self._attempts: Dict[str, int] = {}  # path -> failed syncs in a row
+        self.backend: Optional[str] = None  # "inotify" or "polling" while running
+        self.failures = 0  # watcher errors in a row (backend or rescan)
+        self.last_error: Optional[str] = None
+        self.last_error_at: Optional[float] = None
+        self.last_sync_at: Optional[float] = None
+        self.synced: Dict[str, int] = {"added": 0, "changed": 0, "removed": 0, "failed": 0}
+        self._stop = threading.Event()
+        self._wake_r, self._wake_w = os.pipe()
+        self._thread: Optional[threading.Thread] = None
+        self._running = False
+
+    # ----- lifecycle -----
+
+    def start(self) -> None:
+        """Run the watcher on a daemon thread (used from the FastAPI lifespan)."""
+        self._thread = threading.Thread(target=self.run, name="library-watcher", daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout: Optional[float] = 10.0) -> None:
+        self._stop.set()
+        os.write(self._wake_w, b"\0")
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+    def _backend(self):
+        if not self.force_polling:
+            try:
+                backend = InotifyBackend(self.root, self._wake_r)
+                typer.secho(f"👀 Watching {self.root} with inotify", fg=typer.colors.CYAN)
+                self.backend = "inotify"
+                return backend
+            except OSError as e:
+                typer.secho(f"[WARN] inotify unavailable ({e}), falling back to polling", fg=typer.colors.YELLOW)
+        typer.secho(f"👀 Polling {self.root} every {self.poll_interval:g}s", fg=typer.colors.CYAN)
+        self.backend = "polling"
+        return PollingBackend(self.root, self._wake_r, self.poll_interval)
+
+    def run(self) -> None:
+        """
+        Watch until ``stop()``. An error restarts the backend and rescans
+        after a backoff, so a full inotify table or a database outage pauses
+        syncing instead of ending it.
+        """
+        backend = None
+        rescan = True
+        self._running = True
+        try:
+            while not self._stop.is_set():
+                try:
+                    if backend is None:
+                        backend = self._backend()
+                        rescan = True
+                    if rescan:
+                        self.reconcile()
+                        rescan = False
+                        self._save_status()
+                    changed = backend.wait(self._timeout())
+                    if self._stop.is_set():
+                        break
+                    self._queue(changed)
+                    self._flush_settled()
+                    self.failures = 0
+                except RescanNeeded:
+                    typer.secho("[WARN] Event queue overflowed, rescanning library", fg=typer.colors.YELLOW)
+                    rescan = True
+                except Exception as e:
+                    self.failures += 1
+                    self._failed(f"Library watcher error: {e}")
+                    if backend is not None:
+                        backend.close()
+                        backend = None
+                    self.backend = None
+                    self._stop.wait(backoff(self.failures))
+        finally:
+            if backend is not None:
+                backend.close()
+            self.backend = None
+            self._running = False
+            self._save_status()
+
+    # ----- event handling -----
+
+    def _timeout(self) -> Optional[float]:
+        if not self._pending:
+            return None
+        return max(0.0, min(self._pending.values()) - time.monotonic())
+
+    def _queue(self, paths: Set[str]) -> None:
+        deadline = time.monotonic() + self.debounce
+        for path in paths:
+            if path.endswith(os.sep):
+                # A directory went away: every known file below it is a candidate.
+                for known in self.manifest:
+                    if known.startswith(path):
+                        self._pending[known] = deadline
+            elif path.lower().endswith(MEDIA_EXTENSIONS) and not os.path.basename(path).startswith("."):
+                self._pending[path] = deadline
+                self._sizes.pop(path, None)
+
+    def _flush_settled(self) -> None:
+        now = time.monotonic()
+        ready: Dict[str, Optional[FileEntry]] = {}
+        for path, deadline in list(self._pending.items()):
+            if deadline > now:
+                continue
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:
+                ready[path] = None
+                del self._pending[path]
+                continue
+            except OSError as e:
+                self._failed(f"Cannot stat {path}: {e}")
+                self._retry([path], {})
+                continue
+            if self._sizes.get(path) != stat.st_size:
+                # Still growing (or first look): check again after another quiet period.
+                self._sizes[path] = stat.st_size
+                self._pending[path] = now + self.debounce
+                continue
+            self._sizes.pop(path, None)
+            del self._pending[path]
+            ready[path] = entry_from_stat(stat)
+        if ready:
+            self.apply(ready)
+
+    def reconcile(self) -> None:
+        """Catch up with everything that changed while nobody was watching."""
+        current = snapshot(self.root, MEDIA_EXTENSIONS)
+        changes = diff_manifest(self.manifest, current)
+        if changes.empty:
+            return
+        ready: Dict[str, Optional[FileEntry]] = {path: current[path] for path in changes.added + changes.changed}
+        ready.update({path: None for path in changes.removed})
+        self.apply(ready)
+
+    def apply(self, entries: Dict[str, Optional[FileEntry]]) -> ScanDelta:
+        """Turn settled paths into a ScanDelta, write it to the database and record it in the manifest."""
+        added = sorted(path for path, entry in entries.items() if entry is not None and path not in self.manifest)
+        changed = sorted(
+            path for path, entry in entries.items()
+            if entry is not None and path in self.manifest and self.manifest[path] != entry
+        )
+        removed = sorted(path for path, entry in entries.items() if entry is None and path in self.manifest)
+        delta: ScanDelta = {"added": [], "changed": [], "removed": removed}
+        failed: List[str] = []
+        try:
+            if added or changed:
+                records = process_movies(
+                    self.root, self.fetcher, files=[Path(path) for path in added + changed], failed=failed,
+                )
+                new = set(added)
+                delta["added"] = [record for record in records if record["location"] in new]
+                delta["changed"] = [record for record in records if record["location"] not in new]
+            stats = apply_delta(delta) if delta["added"] or delta["changed"] or delta["removed"] else {}
+        except Exception as e:
+            self._failed(f"Failed to apply library changes: {e}")
+            self._retry(entries, entries)
+            return delta
+        # Entries without a record (e.g. files without an IMDb ID) are remembered too. Failed
+        # lookups are stale: still known, so a removal is noticed, but looked up again by a reconcile.
+        self._record({**entries, **{path: dict(STALE) for path in failed}})
+        self._settled(entries, failed)
+        self.last_sync_at = time.time()
+        for key in ("added", "changed"):
+            self.synced[key] += len(delta[key])
+        self.synced["removed"] += stats.get("removed", 0)
+        self._save_status()
+        if not stats:
+            return delta
+        if self.on_change is not None:
+            self.on_change(delta)
+        typer.secho(
+            f"🔄 Library sync: {len(delta['added'])} added, {len(delta['changed'])} changed, "
+            f"{stats.get('removed', 0)} removed",
+            fg=typer.colors.BRIGHT_GREEN,
+        )
+        return delta
+
+    def _record(self, entries: Dict[str, Optional[FileEntry]]) -> None:
+        for path, entry in entries.items():
+            if entry is None:
+                self.manifest.pop(path, None)
+            else:
+                self.manifest[path] = entry
+        save_manifest(self.manifest_path, self.manifest)
+
+    def _settled(self, entries: Dict[str, Optional[FileEntry]], failed: List[str]) -> None:
+        """Forget the attempts of synced paths and queue failed lookups again, ``LOOKUP_RETRIES`` times at most."""
+        for path in entries:
+            if path not in failed:
+                self._attempts.pop(path, None)
+        retry = [path for path in failed if self._attempts.get(path, 0) < LOOKUP_RETRIES]
+        for path in failed:
+            if path not in retry:
+                self._attempts.pop(path, None)
+        self._retry(retry, entries)
+        self.synced["failed"] += len(failed)
+
+    def _retry(self, paths: Iterable[str], entries: Dict[str, Optional[FileEntry]]) -> None:
+        """Queue ``paths`` again after a backoff that grows with each failure of the same path."""
+        now = time.monotonic()
+        for path in paths:
+            attempts = self._attempts.get(path, 0) + 1
+            self._attempts[path] = attempts
+            self._pending[path] = now + backoff(attempts)
+            entry = entries.get(path)
+            if entry is not None:
+                # Known to have settled: no need to watch its size for another quiet period.
+                self._sizes[path] = entry["size"]
+
+    def _failed(self, message: str) -> None:
+        typer.secho(f"[ERROR] {message}", fg=typer.colors.RED)
+        self.last_error = message
+        self.last_error_at = time.time()
+        self._save_status()
+
+    # ----- state -----
+
+    def summary(self) -> Dict[str, Any]:
+        return {
+            "pid": os.getpid(),
+            "root": str(self.root),
+            "running": self._running,
+            "backend": self.backend,
+            "tracked_files": len(self.manifest),
+            "pending": len(self._pending),
+            "retrying": len(self._attempts),
+            "synced": dict(self.synced),
+            "last_sync_at": self.last_sync_at,
+            "consecutive_failures": self.failures,
+            "last_error": self.last_error,
+            "last_error_at": self.last_error_at,
+            "updated_at": time.time(),
+        }
+
+    def _save_status(self) -> None:
+        if self.status_path is None:
+            return
+        try:
+            tmp_path = Path(f"{self.status_path}.tmp")
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(self.summary(), f)
+            os.replace(tmp_path, self.status_path)
+        except OSError as e:
+            typer.secho(f"[WARN] Could not write watcher status to {self.status_path}: {e}", fg=typer.colors.YELLOW)
+
+
+def load_status(path: Path = WATCHER_STATUS_PATH) -> Optional[Dict[str, Any]]:
+    """The state a watcher in another process last wrote, if any."""
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return None
+
+
+@app.command()
+def main(
+    media_path: str = str(MOVIE_MEDIA_DIR),
+    manifest_path: str = str(WATCHER_MANIFEST_PATH),
+    debounce: float = WATCH_DEBOUNCE,
+    poll_interval: float = WATCH_POLL_INTERVAL,
+    poll: bool = False,
+):
+    create_db_and_tables()
+    watcher = LibraryWatcher(
+        Path(media_path), Path(manifest_path),
+        debounce=debounce, poll_interval=poll_interval, force_polling=poll,
+    )
+    try:
+        watcher.run()
+    except KeyboardInterrupt:
+        typer.echo("\n👋 Watcher stopped.")
+
+
+if __name__ == "__main__":
+    app()
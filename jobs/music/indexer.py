@@ -0,0 +1,273 @@
+"""
+Incremental music library indexer.
+
+Walks ``--media-path`` for audio files and compares them with the stat
+manifest of the previous run (see jobs/movie/manifest.py), so a rescan only
+reads the tags of new and changed files. Tags are read on a process pool (see
+jobs/music/tags.py) and written in batches, one transaction per
+``--batch-size`` tracks. Artists and albums are resolved through in-memory
+indexes loaded once, so a batch costs one multi-row insert per table. Tracks
+whose files disappeared are deleted, along with the albums and artists left
+without tracks.
+
+Usage:
+    python -m jobs.music.indexer --media-path /path/to/music
+"""
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Any, Dict, Iterator, List, NamedTuple, Optional, Tuple
+
+import typer
+from sqlalchemy import Connection, delete, insert, select
+
+from app_config import MUSIC_MEDIA_DIR
+from database import create_db_and_tables, engine
+from jobs.movie.importer import batched
+from jobs.movie.interfaces import FileEntry
+from jobs.movie.manifest import diff_manifest, load_manifest, save_manifest, snapshot
+from jobs.music.interfaces import TrackRecord
+from jobs.music.tags import AUDIO_EXTENSIONS, TagError, read_tags
+from models import Album, Artist, Track
+
+app = typer.Typer()
+
+# ================= Configuration =================
+BATCH_SIZE: int = 2000
+DEFAULT_WORKERS: int = os.cpu_count() or 1
+POOL_CHUNK_SIZE: int = 64  # files per task sent to a worker process
+POOL_MIN_FILES: int = 256  # fewer files than this are read in-process, without starting a pool
+UNKNOWN_ARTIST: str = "Unknown Artist"
+UNKNOWN_ALBUM: str = "Unknown Album"
+STALE: FileEntry = {"size": -1, "mtime_ns": -1, "inode": -1}  # matches no file, so it is re-read
+
+TRACK_COLUMNS: Tuple[str, ...] = (
+    "title", "artist_id", "album_id", "disc_number", "track_number", "genre", "year",
+    "duration", "bitrate", "sample_rate", "format", "size", "location", "added_date",
+)
+# Tracks are keyed by location; a changed file keeps its id and added_date.
+UPSERT_TRACK: str = (
+    f"INSERT INTO track ({', '.join(TRACK_COLUMNS)}) VALUES ({', '.join('?' * len(TRACK_COLUMNS))}) "
+    "ON CONFLICT(location) DO UPDATE SET "
+    + ", ".join(f"{column} = excluded.{column}" for column in TRACK_COLUMNS if column not in ("location", "added_date"))
+)
+
+AlbumKey = Tuple[int, str]  # (album artist id, title)
+
+
+class ReadResult(NamedTuple):
+    path: str
+    record: Optional[TrackRecord]
+    error: Optional[str] = None
+    retry: bool = False  # the file could not be opened, rather than parsed: read it again next scan
+
+
+# ================= Reading =================
+
+def read_track(path: str, size: int) -> ReadResult:
+    """Runs in the worker processes."""
+    try:
+        tags = read_tags(Path(path))
+    except TagError as e:
+        return ReadResult(path, None, str(e))
+    except OSError as e:
+        return ReadResult(path, None, str(e), retry=True)
+    return ReadResult(path, {**tags, "location": path, "size": size})
+
+
+def read_tracks(files: List[Tuple[str, int]], workers: int) -> Iterator[ReadResult]:
+    """Read the tags of ``(path, size)`` files, on ``workers`` processes unless there are only a few; in input order."""
+    paths = [path for path, _ in files]
+    sizes = [size for _, size in files]
+    if workers <= 1 or len(files) < POOL_MIN_FILES:
+        yield from map(read_track, paths, sizes)
+        return
+    with ProcessPoolExecutor(workers) as pool:
+        yield from pool.map(read_track, paths, sizes, chunksize=POOL_CHUNK_SIZE)
+
+
+# ================= Writing =================
+
+def artist_names(record: TrackRecord) -> Tuple[str, str]:
+    """``(track artist, album artist)``, each standing in for the other when missing."""
+    artist = record["artist"] or record["album_artist"] or UNKNOWN_ARTIST
+    return artist, record["album_artist"] or artist
+
+
+def album_key(record: TrackRecord, artists: Dict[str, int]) -> AlbumKey:
+    return artists[artist_names(record)[1]], record["album"] or UNKNOWN_ALBUM
+
+
+def load_artist_index(connection: Connection) -> Dict[str, int]:
+    return {name: artist_id for artist_id, name in connection.execute(select(Artist.id, Artist.name))}
+
+
+def load_album_index(connection: Connection) -> Dict[AlbumKey, int]:
+    return {
+        (artist_id, title): album_id
+        for album_id, artist_id, title in connection.execute(select(Album.id, Album.artist_id, Album.title))
+    }
+
+
+def insert_new_artists(connection: Connection, records: List[TrackRecord], artists: Dict[str, int]) -> int:
+    """Insert the artists of ``records`` missing from ``artists`` and add them to it."""
+    names = sorted({name for record in records for name in artist_names(record) if name not in artists})
+    if not names:
+        return 0
+    result = connection.execute(insert(Artist).returning(Artist.id, Artist.name), [{"name": name} for name in names])
+    for artist_id, name in result:
+        artists[name] = artist_id
+    return len(names)
+
+
+def insert_new_albums(
+    connection: Connection,
+    records: List[TrackRecord],
+    artists: Dict[str, int],
+    albums: Dict[AlbumKey, int],
+) -> int:
+    """Insert the albums of ``records`` missing from ``albums`` (dated by their first track) and add them to it."""
+    new_albums: Dict[AlbumKey, Optional[int]] = {}
+    for record in records:
+        key = album_key(record, artists)
+        if key not in albums and key not in new_albums:
+            new_albums[key] = record["year"]
+    if not new_albums:
+        return 0
+    result = connection.execute(
+        insert(Album).returning(Album.id, Album.artist_id, Album.title),
+        [{"artist_id": artist_id, "title": title, "year": year} for (artist_id, title), year in new_albums.items()],
+    )
+    for album_id, artist_id, title in result:
+        albums[(artist_id, title)] = album_id
+    return len(new_albums)
+
+
+def upsert_tracks(
+    connection: Connection,
+    records: List[TrackRecord],
+    artists: Dict[str, int],
+    albums: Dict[AlbumKey, int],
+    added_date: str,
+) -> None:
+    # Plain tuples skip per-row ORM/Core parameter processing, as for the movie cast links.
+    connection.exec_driver_sql(UPSERT_TRACK, [
+        (
+            record["title"] or Path(record["location"]).stem, artists[artist_names(record)[0]],
+            albums[album_key(record, artists)], record["disc_number"], record["track_number"], record["genre"],
+            record["year"], record["duration"], record["bitrate"], record["sample_rate"], record["format"],
+            record["size"], record["location"], added_date,
+        )
+        for record in records
+    ])
+
+
+def index_tracks(files: List[Tuple[str, int]], workers: int, batch_size: int = BATCH_SIZE) -> Dict[str, Any]:
+    """
+    Read and store ``(path, size)`` files in one transaction per batch; returns
+    counters, and the paths to read again next time in ``unreadable``.
+    """
+    stats = {"tracks": 0, "artists": 0, "albums": 0, "batches": 0, "skipped": 0}
+    unreadable: List[str] = []
+    added_date = datetime.now(timezone.utc).strftime("%Y-%m-%d %H:%M:%S.%f")
+    with engine.connect() as connection:
+        artists = load_artist_index(connection)
+        albums = load_album_index(connection)
+        connection.commit()
+        for batch in batched(read_tracks(files, workers), batch_size):
+            records: List[TrackRecord] = []
+            for result in batch:
+                if result.record is not None:
+                    records.append(result.record)
+                    continue
+                typer.secho(f"[WARN] Could not read {result.path}: {result.error}", fg=typer.colors.YELLOW)
+                stats["skipped"] += 1
+                if result.retry:
+                    unreadable.append(result.path)
+            if not records:
+                continue
+            with connection.begin():
+                stats["artists"] += insert_new_artists(connection, records, artists)
+                stats["albums"] += insert_new_albums(connection, records, artists, albums)
+                upsert_tracks(connection, records, artists, albums, added_date)
+            stats["tracks"] += len(records)
+            stats["batches"] += 1
+    return {**stats, "unreadable": unreadable}
+
+
+def remove_tracks(connection: Connection, locations: List[str]) -> int:
+    removed = 0
+    for batch in batched(locations, BATCH_SIZE):
+        removed += connection.execute(delete(Track).where(Track.location.in_(batch))).rowcount
+    return removed
+
+
+def prune_orphans(connection: Connection) -> Tuple[int, int]:
+    """Delete albums without tracks, then artists without tracks or albums; returns how many of each."""
+    albums = connection.exec_driver_sql("DELETE FROM album WHERE id NOT IN (SELECT album_id FROM track)").rowcount
+    artists = connection.exec_driver_sql(
+        "DELETE FROM artist WHERE id NOT IN (SELECT artist_id FROM track) AND id NOT IN (SELECT artist_id FROM album)"
+    ).rowcount
+    return albums, artists
+
+
+def previous_manifest(connection: Connection, manifest_path: Path, full: bool) -> Dict[str, FileEntry]:
+    """
+    The files the database was indexed from: the manifest saved by the last
+    scan or, with ``full`` or when it is missing, every indexed track marked
+    stale, so files still there are re-read and the rest are removed.
+    """
+    if connection.execute(select(Track.id).limit(1)).first() is None:
+        return {}
+    manifest = {} if full else load_manifest(manifest_path)
+    return manifest or {location: dict(STALE) for location in connection.scalars(select(Track.location))}
+
+
+@app.command()
+def main(
+    media_path: str = str(MUSIC_MEDIA_DIR),
+    workers: int = DEFAULT_WORKERS,
+    batch_size: int = BATCH_SIZE,
+    manifest_path: str = "music_manifest.json",
+    full: bool = False,
+):
+    typer.secho("🎵 Starting music library indexer...\n", fg=typer.colors.BRIGHT_MAGENTA)
+    create_db_and_tables()
+    started = time.perf_counter()
+    root = Path(media_path).resolve()
+    typer.echo(typer.style(f"🔍 Scanning directory: {root}", fg=typer.colors.CYAN))
+    current = snapshot(root, AUDIO_EXTENSIONS)
+    with engine.connect() as connection:
+        previous = previous_manifest(connection, Path(manifest_path), full)
+    changes = diff_manifest(previous, current)
+    typer.secho(
+        f"🧾 {len(changes.added)} new, {len(changes.changed)} changed, "
+        f"{len(changes.removed)} removed, {changes.unchanged} unchanged ({time.perf_counter() - started:.1f}s)",
+        fg=typer.colors.BRIGHT_BLUE,
+    )
+    if changes.empty:
+        typer.echo(typer.style("✅ Library unchanged, nothing to do.\n", fg=typer.colors.BRIGHT_GREEN))
+        return
+
+    files = [(path, current[path]["size"]) for path in changes.added + changes.changed]
+    typer.echo(f"🎧 Reading tags of {len(files)} files on {workers if len(files) >= POOL_MIN_FILES else 1} workers...")
+    stats = index_tracks(files, workers, batch_size)
+    with engine.begin() as connection:
+        removed = remove_tracks(connection, changes.removed)
+        pruned_albums, pruned_artists = prune_orphans(connection)
+    for path in stats["unreadable"]:
+        current.pop(path, None)
+    save_manifest(Path(manifest_path), current)
+
+    typer.secho(
+        f"✅ Indexed {stats['tracks']} tracks with {stats['artists']} new artists and {stats['albums']} new albums "
+        f"in {stats['batches']} batches, skipped {stats['skipped']} files, removed {removed} tracks, "
+        f"{pruned_albums} empty albums and {pruned_artists} artists ({time.perf_counter() - started:.1f}s)",
+        fg=typer.colors.BRIGHT_GREEN,
+    )
+
+
+if __name__ == "__main__":
+    app()
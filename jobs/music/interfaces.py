@@ -0,0 +1,21 @@
+from typing import Optional, TypedDict
+
+
+class TrackTags(TypedDict):
+    """What the tag reader gets from an audio file's headers."""
+    format: Optional[str]  # "mp3", "flac", "mp4"
+    title: Optional[str]
+    artist: Optional[str]
+    album_artist: Optional[str]
+    album: Optional[str]
+    year: Optional[int]
+    track_number: Optional[int]
+    disc_number: Optional[int]
+    genre: Optional[str]
+    duration: Optional[float]  # in seconds
+    bitrate: Optional[int]  # bits per second
+    sample_rate: Optional[int]
+
+class TrackRecord(TrackTags):
+    location: str
+    size: int  # in bytes
@@ -0,0 +1,403 @@
+"""
+Tag reader for MP3 (ID3v2, with ID3v1 filling gaps), FLAC and MP4/M4A files.
+
+Like the movie probe, the file is memory-mapped and only header structures
+are read: the ID3v2 frames and the first MPEG frame (whose Xing/VBRI header
+counts the frames of a VBR file), the FLAC metadata blocks before the first
+audio frame, or the MP4 ``moov`` box with its ``ilst`` item list. Frames that
+are not needed, such as embedded cover art, are skipped by their size, so a
+read touches a few pages however large the file is.
+
+Usage:
+    python -m jobs.music.tags /path/to/track.flac
+"""
+import json
+import mmap
+import os
+import re
+import struct
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+import typer
+
+from jobs.movie.probe import Buffer, ProbeError, iter_boxes, probe_mp4
+from jobs.music.interfaces import TrackTags
+
+app = typer.Typer()
+
+# ================= Configuration =================
+AUDIO_EXTENSIONS = (".mp3", ".flac", ".m4a", ".m4b")
+FRAME_SEARCH: int = 64 * 1024  # bytes after the ID3v2 tag searched for the first MPEG frame
+
+ID3_FIELDS = {
+    b"TIT2": "title", b"TT2": "title",
+    b"TPE1": "artist", b"TP1": "artist",
+    b"TPE2": "album_artist", b"TP2": "album_artist",
+    b"TALB": "album", b"TAL": "album",
+    b"TDRC": "year", b"TYER": "year", b"TYE": "year",
+    b"TRCK": "track_number", b"TRK": "track_number",
+    b"TPOS": "disc_number", b"TPA": "disc_number",
+    b"TCON": "genre", b"TCO": "genre",
+}
+ID3_LENGTH = (b"TLEN", b"TLE")  # milliseconds, used when the MPEG frames give no duration
+
+VORBIS_FIELDS = {
+    "TITLE": "title",
+    "ARTIST": "artist",
+    "ALBUMARTIST": "album_artist",
+    "ALBUM ARTIST": "album_artist",
+    "ALBUM": "album",
+    "DATE": "year",
+    "YEAR": "year",
+    "TRACKNUMBER": "track_number",
+    "DISCNUMBER": "disc_number",
+    "GENRE": "genre",
+}
+
+MP4_FIELDS = {
+    b"\xa9nam": "title",
+    b"\xa9ART": "artist",
+    b"aART": "album_artist",
+    b"\xa9alb": "album",
+    b"\xa9day": "year",
+    b"\xa9gen": "genre",
+}
+# Boxes on the path to the sample descriptions and the iTunes item list.
+MP4_CONTAINERS = {b"moov", b"trak", b"mdia", b"minf", b"stbl", b"udta"}
+
+# Layer III bitrates in kbit/s by header index, for MPEG-1 and for MPEG-2/2.5.
+MPEG1_BITRATES = (0, 32, 40, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320)
+MPEG2_BITRATES = (0, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160)
+MPEG1_SAMPLE_RATES = (44100, 48000, 32000)  # halved for MPEG-2, quartered for MPEG-2.5
+
+# ID3v1 genres, referenced by number from ID3v1 tags, "(17)"-style TCON frames and MP4 "gnre" items.
+ID3V1_GENRES = (
+    "Blues", "Classic Rock", "Country", "Dance", "Disco", "Funk", "Grunge", "Hip-Hop", "Jazz", "Metal",
+    "New Age", "Oldies", "Other", "Pop", "R&B", "Rap", "Reggae", "Rock", "Techno", "Industrial",
+    "Alternative", "Ska", "Death Metal", "Pranks", "Soundtrack", "Euro-Techno", "Ambient", "Trip-Hop", "Vocal",
+    "Jazz+Funk", "Fusion", "Trance", "Classical", "Instrumental", "Acid", "House", "Game", "Sound Clip",
+    "Gospel", "Noise", "AlternRock", "Bass", "Soul", "Punk", "Space", "Meditative", "Instrumental Pop",
+    "Instrumental Rock", "Ethnic", "Gothic", "Darkwave", "Techno-Industrial", "Electronic", "Pop-Folk",
+    "Eurodance", "Dream", "Southern Rock", "Comedy", "Cult", "Gangsta", "Top 40", "Christian Rap", "Pop/Funk",
+    "Jungle", "Native American", "Cabaret", "New Wave", "Psychadelic", "Rave", "Showtunes", "Trailer", "Lo-Fi",
+    "Tribal", "Acid Punk", "Acid Jazz", "Polka", "Retro", "Musical", "Rock & Roll", "Hard Rock",
+)
+
+_YEAR = re.compile(r"\d{4}")
+_NUMBER = re.compile(r"\s*(\d+)")  # "3" or "3/12"
+_GENRE_REF = re.compile(r"\((\d+)\)(.*)|(\d+)")
+
+
+class TagError(Exception):
+    pass
+
+
+def empty_tags(audio_format: Optional[str] = None) -> TrackTags:
+    return {
+        "format": audio_format,
+        "title": None,
+        "artist": None,
+        "album_artist": None,
+        "album": None,
+        "year": None,
+        "track_number": None,
+        "disc_number": None,
+        "genre": None,
+        "duration": None,
+        "bitrate": None,
+        "sample_rate": None,
+    }
+
+
+def _assign(tags: Dict[str, Any], field: str, value: str) -> None:
+    """Store a text value under ``field``, converted to its type; the first value found wins."""
+    value = value.strip().strip("\x00")
+    if not value or tags[field] is not None:
+        return
+    if field == "year":
+        match = _YEAR.search(value)
+        tags[field] = int(match.group()) if match else None
+    elif field in ("track_number", "disc_number"):
+        match = _NUMBER.match(value)
+        tags[field] = int(match.group(1)) or None if match else None
+    else:
+        tags[field] = value
+
+
+def genre_name(value: str) -> str:
+    """Resolve ID3v1 genre references: "17", "(17)" and "(17)Rock" all become "Rock"."""
+    match = _GENRE_REF.fullmatch(value.strip())
+    if match is None:
+        return value
+    if match.group(2):
+        return match.group(2)
+    number = int(match.group(1) or match.group(3))
+    return ID3V1_GENRES[number] if number < len(ID3V1_GENRES) else value
+
+
+# ================= ID3 =================
+
+def _syncsafe(data: bytes) -> int:
+    """A 28-bit integer stored 7 bits per byte."""
+    return (data[0] << 21) | (data[1] << 14) | (data[2] << 7) | data[3]
+
+
+def _unsync(data: bytes) -> bytes:
+    """Undo unsynchronisation, which puts a zero byte after every 0xFF."""
+    return data.replace(b"\xff\x00", b"\xff")
+
+
+def _id3_text(body: bytes) -> str:
+    """The first string of an ID3 text frame (encoding byte, then null-separated values)."""
+    if not body:
+        return ""
+    codec = {1: "utf-16", 2: "utf-16-be", 3: "utf-8"}.get(body[0], "latin-1")
+    return body[1:].decode(codec, errors="replace").split("\x00")[0]
+
+
+def read_id3v2(buf: Buffer, size: int, tags: TrackTags) -> int:
+    """Parse the ID3v2 tag at the start of ``buf`` into ``tags``; returns where the audio begins (0 without a tag)."""
+    if buf[:3] != b"ID3":
+        return 0
+    major, flags = buf[3], buf[5]
+    tag_size = _syncsafe(buf[6:10])
+    audio_start = 10 + tag_size + (10 if major == 4 and flags & 0x10 else 0)  # 0x10: a footer follows
+    if major not in (2, 3, 4):
+        return audio_start
+    data: Buffer = buf
+    offset, end = 10, min(10 + tag_size, size)
+    if flags & 0x80 and major < 4:
+        # The whole tag is unsynchronised: frame sizes only make sense after undoing it.
+        data, offset = _unsync(bytes(buf[offset:end])), 0
+        end = len(data)
+    if flags & 0x40 and major >= 3:  # extended header
+        extended = struct.unpack_from(">I", data, offset)[0]
+        offset += _syncsafe(data[offset:offset + 4]) if major == 4 else extended + 4
+
+    id_size, header_size = (3, 6) if major == 2 else (4, 10)
+    length_ms = None
+    while offset + header_size <= end:
+        frame_id = bytes(data[offset:offset + id_size])
+        if frame_id[0] == 0:
+            break  # padding
+        if major == 2:
+            frame_size, frame_flags = int.from_bytes(data[offset + 3:offset + 6], "big"), 0
+        elif major == 3:
+            frame_size, frame_flags = struct.unpack_from(">IH", data, offset + 4)
+        else:
+            frame_size, frame_flags = _syncsafe(data[offset + 4:offset + 8]), struct.unpack_from(">H", data, offset + 8)[0]
+        body_start = offset + header_size
+        offset = body_start + frame_size
+        field = ID3_FIELDS.get(frame_id)
+        if field is None and frame_id not in ID3_LENGTH:
+            continue
+        if (major == 3 and frame_flags & 0x00C0) or (major == 4 and frame_flags & 0x000C):
+            continue  # compressed or encrypted
+        body = bytes(data[body_start:min(offset, end)])
+        if frame_flags & (0x0020 if major == 3 else 0x0040):  # group identifier byte
+            body = body[1:]
+        if major == 4:
+            if frame_flags & 0x0001:  # data length indicator
+                body = body[4:]
+            if frame_flags & 0x0002 or flags & 0x80:
+                body = _unsync(body)
+        text = _id3_text(body)
+        if field is None:
+            length_ms = text.strip()
+        else:
+            _assign(tags, field, genre_name(text) if field == "genre" else text)
+    if length_ms and length_ms.isdigit() and int(length_ms):
+        tags["duration"] = int(length_ms) / 1000
+    return audio_start
+
+
+def read_id3v1(buf: Buffer, size: int, tags: TrackTags) -> bool:
+    """Fill fields still missing from the 128-byte ID3v1 tag at the end of the file, if there is one."""
+    if size < 128 or buf[size - 128:size - 125] != b"TAG":
+        return False
+    tag = bytes(buf[size - 128:size])
+    for field, start, end in (("title", 3, 33), ("artist", 33, 63), ("album", 63, 93), ("year", 93, 97)):
+        _assign(tags, field, tag[start:end].split(b"\x00")[0].decode("latin-1"))
+    if tag[125] == 0 and tag[126]:  # ID3v1.1 track number
+        _assign(tags, "track_number", str(tag[126]))
+    if tag[127] < len(ID3V1_GENRES):
+        _assign(tags, "genre", ID3V1_GENRES[tag[127]])
+    return True
+
+
+# ================= MPEG audio =================
+
+def read_mpeg_audio(buf: Buffer, start: int, end: int, tags: TrackTags) -> None:
+    """
+    Duration, bitrate and sample rate from the first Layer III frame header in
+    ``[start, end)``. VBR files carry a frame count in a Xing/Info or VBRI header
+    inside that frame; without one, the bitrate is taken to be constant.
+    """
+    limit = min(end - 4, start + FRAME_SEARCH)
+    offset = buf.find(b"\xff", start, limit)
+    while 0 <= offset < limit:
+        header = struct.unpack_from(">I", buf, offset)[0]
+        version, layer = (header >> 19) & 3, (header >> 17) & 3  # version 3: MPEG-1, 2: MPEG-2, 0: MPEG-2.5; layer 1: III
+        bitrate_index, rate_index = (header >> 12) & 0xF, (header >> 10) & 3
+        if header >> 21 == 0x7FF and version != 1 and layer == 1 and 0 < bitrate_index < 15 and rate_index < 3:
+            break
+        offset = buf.find(b"\xff", offset + 1, limit)
+    else:
+        return
+
+    mpeg1 = version == 3
+    sample_rate = MPEG1_SAMPLE_RATES[rate_index] >> (0 if mpeg1 else 1 if version == 2 else 2)
+    samples_per_frame = 1152 if mpeg1 else 576
+    mono = (header >> 6) & 3 == 3
+    xing = offset + 4 + ((17 if mono else 32) if mpeg1 else (9 if mono else 17))  # after the side information
+    frames = None
+    if buf[xing:xing + 4] in (b"Xing", b"Info") and xing + 12 <= end:
+        if struct.unpack_from(">I", buf, xing + 4)[0] & 1:  # frame count present
+            frames = struct.unpack_from(">I", buf, xing + 8)[0]
+    elif buf[offset + 36:offset + 40] == b"VBRI" and offset + 54 <= end:
+        frames = struct.unpack_from(">I", buf, offset + 50)[0]
+
+    audio_bytes = end - offset
+    tags["sample_rate"] = sample_rate
+    if frames:
+        tags["duration"] = frames * samples_per_frame / sample_rate
+        tags["bitrate"] = int(audio_bytes * 8 / tags["duration"])
+    else:
+        tags["bitrate"] = (MPEG1_BITRATES if mpeg1 else MPEG2_BITRATES)[bitrate_index] * 1000
+        tags["duration"] = audio_bytes * 8 / tags["bitrate"]
+
+
+def _is_frame_sync(buf: Buffer, offset: int) -> bool:
+    return buf[offset] == 0xFF and buf[offset + 1] & 0xE0 == 0xE0
+
+
+# ================= FLAC =================
+
+def read_vorbis_comments(buf: Buffer, start: int, end: int, tags: TrackTags) -> None:
+    """A VORBIS_COMMENT block: vendor string, then ``KEY=value`` entries, all little-endian length-prefixed."""
+    offset = start + 4 + struct.unpack_from("<I", buf, start)[0]
+    count = struct.unpack_from("<I", buf, offset)[0]
+    offset += 4
+    for _ in range(count):
+        if offset + 4 > end:
+            break
+        length = struct.unpack_from("<I", buf, offset)[0]
+        key, _, value = bytes(buf[offset + 4:min(offset + 4 + length, end)]).decode("utf-8", errors="replace").partition("=")
+        offset += 4 + length
+        field = VORBIS_FIELDS.get(key.upper())
+        if field is not None:
+            _assign(tags, field, value)
+
+
+def read_flac(buf: Buffer, start: int, size: int, tags: TrackTags) -> None:
+    """Walk the metadata blocks after the ``fLaC`` marker: STREAMINFO for the length, VORBIS_COMMENT for tags."""
+    offset = start + 4
+    total_samples = 0
+    while offset + 4 <= size:
+        header = buf[offset]
+        length = int.from_bytes(buf[offset + 1:offset + 4], "big")
+        block = offset + 4
+        offset = block + length
+        if header & 0x7F == 0 and length >= 18:  # STREAMINFO
+            # 20 bits sample rate, 3 bits channels, 5 bits sample size, 36 bits total samples.
+            packed = int.from_bytes(buf[block + 10:block + 18], "big")
+            tags["sample_rate"] = packed >> 44 or None
+            total_samples = packed & ((1 << 36) - 1)
+        elif header & 0x7F == 4:
+            read_vorbis_comments(buf, block, min(offset, size), tags)
+        if header & 0x80:  # last metadata block
+            break
+    if total_samples and tags["sample_rate"]:
+        tags["duration"] = total_samples / tags["sample_rate"]
+        tags["bitrate"] = int((size - offset) * 8 / tags["duration"])
+
+
+# ================= MP4 =================
+
+def read_ilst(buf: Buffer, start: int, end: int, tags: TrackTags) -> None:
+    """iTunes items: each is a box named after its key, holding a ``data`` box (type, locale, value)."""
+    for key, _, payload, item_end in iter_boxes(buf, start, end):
+        for box_type, _, data, data_end in iter_boxes(buf, payload, item_end):
+            if box_type != b"data" or data + 8 > data_end:
+                continue
+            value = bytes(buf[data + 8:data_end])
+            if key in (b"trkn", b"disk") and len(value) >= 4:
+                # Two padding bytes, then number and total as 16-bit integers.
+                _assign(tags, "track_number" if key == b"trkn" else "disc_number", str(struct.unpack_from(">H", value, 2)[0]))
+            elif key == b"gnre" and len(value) >= 2:
+                _assign(tags, "genre", genre_name(str(struct.unpack_from(">H", value)[0] - 1)))
+            elif key in MP4_FIELDS:
+                _assign(tags, MP4_FIELDS[key], value.decode("utf-8", errors="replace"))
+            break
+
+
+def read_mp4(buf: Buffer, size: int, tags: TrackTags) -> None:
+    info = probe_mp4(buf, size)
+    tags["duration"], tags["bitrate"] = info["duration"], info["bitrate"]
+    stack = [(0, size)]
+    while stack:
+        box_start, box_end = stack.pop()
+        for box_type, _, payload, child_end in iter_boxes(buf, box_start, box_end):
+            if box_type in MP4_CONTAINERS:
+                stack.append((payload, child_end))
+            elif box_type == b"meta":
+                # ISO meta is a full box (version and flags first); QuickTime's starts with its hdlr child.
+                stack.append((payload if buf[payload + 4:payload + 8] == b"hdlr" else payload + 4, child_end))
+            elif box_type == b"ilst":
+                read_ilst(buf, payload, child_end, tags)
+            elif box_type == b"stsd" and tags["sample_rate"] is None:
+                entry = payload + 8
+                if buf[entry + 4:entry + 8] in (b"mp4a", b"alac") and entry + 36 <= child_end:
+                    # Audio sample entries keep the rate as 16.16 fixed point, 32 bytes in.
+                    tags["sample_rate"] = struct.unpack_from(">H", buf, entry + 32)[0] or None
+
+
+# ================= Entry Point =================
+
+def read_tags(path: Path) -> TrackTags:
+    """
+    Read the tags and stream details of an MP3, FLAC or MP4/M4A file. Raises
+    TagError for unknown or corrupt files and OSError if the file cannot be read.
+    """
+    with open(path, "rb") as f:
+        size = os.fstat(f.fileno()).st_size
+        if size < 16:
+            raise TagError("file too small")
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as buf:
+            if hasattr(buf, "madvise"):
+                # Without this the first page fault reads ahead megabytes of audio we never look at.
+                buf.madvise(mmap.MADV_RANDOM)
+            tags = empty_tags()
+            try:
+                audio_start = read_id3v2(buf, size, tags)
+                if buf[audio_start:audio_start + 4] == b"fLaC":
+                    tags["format"] = "flac"
+                    read_flac(buf, audio_start, size, tags)
+                elif buf[4:8] == b"ftyp":
+                    tags["format"] = "mp4"
+                    read_mp4(buf, size, tags)
+                else:
+                    has_id3v1 = read_id3v1(buf, size, tags)
+                    if not (audio_start or has_id3v1 or _is_frame_sync(buf, 0)):
+                        raise TagError("unrecognised audio format")
+                    tags["format"] = "mp3"
+                    read_mpeg_audio(buf, min(audio_start, size), size - (128 if has_id3v1 else 0), tags)
+            except (IndexError, struct.error, ValueError, ProbeError) as e:
+                raise TagError(f"truncated or corrupt tags: {e}") from e
+    return tags
+
+
+@app.command()
+def main(paths: List[Path] = typer.Argument(..., help="Audio files to read.")):
+    for path in paths:
+        try:
+            tags = read_tags(path)
+        except (TagError, OSError) as e:
+            typer.secho(f"[WARN] Could not read {path.name}: {e}", fg=typer.colors.YELLOW)
+            continue
+        typer.echo(json.dumps({"path": str(path), **tags}, ensure_ascii=False))
+
+
+if __name__ == "__main__":
+    app()
@@ -1,7 +1,17 @@
 from typing import Optional, List
 from datetime import datetime, timezone
+from sqlalchemy import Index, text
 from sqlmodel import SQLModel, Field, Relationship
 
+# Columns the catalog can be sorted on. Every one of them gets a (column, id)
+# and a (category, column, id) index so keyset pages are plain index range scans.
+MOVIE_SORT_FIELDS = ("name", "size", "added_date", "rating")
+
+# The database-side "now", in the format the ORM stores datetimes in. SQLite's
+# CURRENT_TIMESTAMP drops the microseconds, and such values compare wrongly
+# against the ones bound from keyset cursors.
+SQLITE_NOW = "(strftime('%Y-%m-%d %H:%M:%f000', 'now'))"
+
 class Cast(SQLModel, table=True):
     id: Optional[int] = Field(default=None, primary_key=True)
     name: str = Field(index=True)
@@ -9,6 +19,9 @@ class Cast(SQLModel, table=True):
     image_url: Optional[str] = None
     movies: List["MovieCastLink"] = Relationship(back_populates="cast")
 
+    # One row per person and role, shared by every movie they appear in.
+    __table_args__ = (Index("ix_cast_name_role", "name", "role", unique=True),)
+
 class MovieCastLink(SQLModel, table=True):
     movie_id: Optional[int] = Field(default=None, foreign_key="movie.id", primary_key=True)
     cast_id: Optional[int] = Field(default=None, foreign_key="cast.id", primary_key=True)
@@ -32,9 +45,25 @@ class Movie(SQLModel, table=True):
     synopsis: str
     subtitles: str
     location: str
+    optimized_location: Optional[str] = None  # faststart copy of location, preferred for streaming
+    bitrate: Optional[int] = None  # bits per second
+    video_codec: Optional[str] = None
+    audio_codec: Optional[str] = None
+    width: Optional[int] = None
+    height: Optional[int] = None
+    added_date: datetime = Field(
+        default_factory=lambda: datetime.now(timezone.utc), index=True,
+        sa_column_kwargs={"server_default": text(SQLITE_NOW)},
+    )
     watch_history: list["WatchHistory"] = Relationship(back_populates="movie")
     cast_links: List["MovieCastLink"] = Relationship(back_populates="movie")
 
+    __table_args__ = tuple(
+        Index(f"ix_movie_{field}_id", field, "id") for field in MOVIE_SORT_FIELDS
+    ) + tuple(
+        Index(f"ix_movie_category_{field}_id", "category", field, "id") for field in MOVIE_SORT_FIELDS
+    )
+
 
 class User(SQLModel, table=True):
     id: Optional[int] = Field(default=None, primary_key=True)
@@ -47,6 +76,8 @@ class User(SQLModel, table=True):
     address: Optional[str] = None
     date_of_birth: Optional[datetime] = None
     created_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
+    # Copied into every access token; bumping it revokes all of the user's tokens.
+    token_version: int = Field(default=0, sa_column_kwargs={"server_default": text("0")})
 
     watch_history: list["WatchHistory"] = Relationship(back_populates="user")
 
@@ -60,3 +91,64 @@ class WatchHistory(SQLModel, table=True):
 
     user: Optional[User] = Relationship(back_populates="watch_history")
     movie: Optional[Movie] = Relationship(back_populates="watch_history")
+
+    # One row per user and movie: progress heartbeats upsert into it. A user's
+    # history pages are range scans of (user_id, watched_at), newest first.
+    __table_args__ = (
+        Index("ix_watchhistory_user_id_movie_id", "user_id", "movie_id", unique=True),
+        Index("ix_watchhistory_user_id_watched_at", "user_id", "watched_at"),
+    )
+
+
+class MovieSimilarity(SQLModel, table=True):
+    """A precomputed "more like this" neighbour of a movie (see jobs/movie/recommend.py)."""
+    movie_id: int = Field(foreign_key="movie.id", primary_key=True)
+    rank: int = Field(primary_key=True)  # 0 = most similar
+    similar_id: int = Field(foreign_key="movie.id")
+    score: float
+
+
+class ImageAsset(SQLModel, table=True):
+    """A remote poster or headshot that has been downloaded into the local image cache."""
+    id: Optional[int] = Field(default=None, primary_key=True)
+    url: str = Field(index=True, unique=True)
+    content_hash: str = Field(index=True)  # sha256 of the original bytes; names the variant directory
+    width: int
+    height: int
+    fetched_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
+
+
+class Artist(SQLModel, table=True):
+    """A performer or album artist in the music library (see jobs/music/indexer.py)."""
+    id: Optional[int] = Field(default=None, primary_key=True)
+    name: str = Field(index=True, unique=True)
+
+
+class Album(SQLModel, table=True):
+    id: Optional[int] = Field(default=None, primary_key=True)
+    title: str
+    artist_id: int = Field(foreign_key="artist.id")  # album artist
+    year: Optional[int] = None
+
+    # Albums are told apart by artist: every band has a "Greatest Hits".
+    __table_args__ = (Index("ix_album_artist_id_title", "artist_id", "title", unique=True),)
+
+
+class Track(SQLModel, table=True):
+    id: Optional[int] = Field(default=None, primary_key=True)
+    title: str = Field(index=True)
+    artist_id: int = Field(foreign_key="artist.id", index=True)
+    album_id: int = Field(foreign_key="album.id")
+    disc_number: Optional[int] = None
+    track_number: Optional[int] = None
+    genre: Optional[str] = Field(default=None, index=True)
+    year: Optional[int] = None
+    duration: Optional[float] = None  # in seconds
+    bitrate: Optional[int] = None  # bits per second
+    sample_rate: Optional[int] = None
+    format: str  # "mp3", "flac", "mp4"
+    size: int  # in bytes
+    location: str = Field(unique=True)
+    added_date: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
+
+    __table_args__ = (Index("ix_track_album_id_disc_number_track_number", "album_id", "disc_number", "track_number"),)
@@ -1,10 +1,8 @@
-from pydantic import EmailStr, BaseModel
-from typing import Optional, List, Any, TYPE_CHECKING
+from pydantic import EmailStr, BaseModel, Field
+from typing import Optional, List, Any
 from datetime import datetime
 from . import BaseRequestModel, BaseResponseModel
-
-if TYPE_CHECKING:
-    from .auth import UserResponseSchema
+from .auth import UserResponseSchema
 
 class MovieCreateSchema(BaseRequestModel):
     name: str
@@ -28,10 +26,11 @@ class MovieReadSchema(BaseResponseModel):
     casts: Optional[List[str]] = None
     category: str
     size: float  # in MB or GB
+    published_year: Optional[int] = None
     added_date: datetime
     filename: str
     thumbnail: str
-    description: str
+    plot: str
     subtitles: Optional[str] = None
     location: Optional[str] = None
     watch_history: Optional[List[Any]] = None  # This will be populated with related data
@@ -91,9 +90,15 @@ class MovieSearchSchema(BaseModel):
     query: str
     filter: Optional[MovieFilterSchema] = None
     sort: Optional[MovieSortSchema] = None
+    limit: int = Field(20, ge=1, le=100)
+    offset: int = Field(0, ge=0)
+    prefix: bool = True  # treat the last word as a prefix (type-ahead)
     # Add any other fields you need for searching movies
+class MovieSearchHitSchema(MovieReadSchema):
+    rank: float  # bm25 score, lower is better
+    snippet: Optional[str] = None  # matched text with <mark> highlights
 class MovieSearchResultSchema(BaseModel):
-    movies: List[MovieReadSchema]
+    movies: List[MovieSearchHitSchema]
     total_count: int
     # Add any other fields you need for search results
 class UserSearchSchema(BaseModel):
@@ -0,0 +1,234 @@
+"""
+Full-text search over the movie catalog, backed by an SQLite FTS5 table.
+
+``movie_fts`` holds one row per movie (rowid = movie.id) with the title, plot,
+synopsis and the space-joined names of its cast. Triggers on ``movie``,
+``cast`` and ``moviecastlink`` keep it in sync, so nothing in the application
+has to remember to update it.
+"""
+import html
+import re
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Set, Tuple
+from contextlib import contextmanager
+
+from sqlalchemy import Connection, bindparam, column, text
+from sqlalchemy.sql.elements import ColumnElement
+from sqlmodel import Session
+
+from models import Movie, MOVIE_SORT_FIELDS
+
+FTS_TABLE = "movie_fts"
+FTS_COLUMNS = ("name", "plot", "synopsis", "cast_names")
+# bm25 weight per FTS column: a title hit beats a cast hit beats a plot hit.
+BM25_WEIGHTS = (10.0, 1.0, 0.5, 4.0)
+SNIPPET_TOKENS = 12
+REFRESH_CHUNK = 500  # stays below SQLite's bound-parameter limit
+HIGHLIGHT_OPEN = "<mark>"
+HIGHLIGHT_CLOSE = "</mark>"
+# FTS5 wraps matches in these private-use characters instead of the tags, so
+# the text around them can be HTML-escaped before the tags go in.
+MATCH_OPEN = "\ue000"
+MATCH_CLOSE = "\ue001"
+
+_CAST_NAMES_SQL = (
+    "(SELECT group_concat(c.name, ' ') FROM moviecastlink l "
+    "JOIN \"cast\" c ON c.id = l.cast_id WHERE l.movie_id = {movie_id})"
+)
+
+_CREATE_TABLE_SQL = (
+    f"CREATE VIRTUAL TABLE IF NOT EXISTS {FTS_TABLE} USING fts5("
+    f"{', '.join(FTS_COLUMNS)}, "
+    "tokenize = 'unicode61 remove_diacritics 2', "
+    # Prefix indexes make 2-4 character type-ahead queries index lookups.
+    "prefix = '2 3 4')"
+)
+
+_TRIGGERS: Dict[str, str] = {
+    "movie_fts_movie_ai": f"""
+        CREATE TRIGGER IF NOT EXISTS movie_fts_movie_ai AFTER INSERT ON movie BEGIN
+            INSERT INTO {FTS_TABLE}(rowid, name, plot, synopsis, cast_names)
+            VALUES (new.id, new.name, new.plot, new.synopsis, {_CAST_NAMES_SQL.format(movie_id="new.id")});
+        END""",
+    "movie_fts_movie_au": f"""
+        CREATE TRIGGER IF NOT EXISTS movie_fts_movie_au AFTER UPDATE OF name, plot, synopsis ON movie BEGIN
+            UPDATE {FTS_TABLE} SET name = new.name, plot = new.plot, synopsis = new.synopsis
+            WHERE rowid = new.id;
+        END""",
+    "movie_fts_movie_ad": f"""
+        CREATE TRIGGER IF NOT EXISTS movie_fts_movie_ad AFTER DELETE ON movie BEGIN
+            DELETE FROM {FTS_TABLE} WHERE rowid = old.id;
+        END""",
+    "movie_fts_link_ai": f"""
+        CREATE TRIGGER IF NOT EXISTS movie_fts_link_ai AFTER INSERT ON moviecastlink BEGIN
+            UPDATE {FTS_TABLE} SET cast_names = {_CAST_NAMES_SQL.format(movie_id="new.movie_id")}
+            WHERE rowid = new.movie_id;
+        END""",
+    "movie_fts_link_ad": f"""
+        CREATE TRIGGER IF NOT EXISTS movie_fts_link_ad AFTER DELETE ON moviecastlink BEGIN
+            UPDATE {FTS_TABLE} SET cast_names = {_CAST_NAMES_SQL.format(movie_id="old.movie_id")}
+            WHERE rowid = old.movie_id;
+        END""",
+    "movie_fts_cast_au": f"""
+        CREATE TRIGGER IF NOT EXISTS movie_fts_cast_au AFTER UPDATE OF name ON "cast" BEGIN
+            UPDATE {FTS_TABLE} SET cast_names = {_CAST_NAMES_SQL.format(movie_id=f"{FTS_TABLE}.rowid")}
+            WHERE rowid IN (SELECT movie_id FROM moviecastlink WHERE cast_id = new.id);
+        END""",
+}
+
+# ======================= INDEX MAINTENANCE =======================
+
+def create_search_index(connection: Connection) -> None:
+    """Create the FTS table and its sync triggers, backfilling it if it is new."""
+    if connection.dialect.name != "sqlite":
+        return
+    exists = connection.execute(
+        text("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = :name"),
+        {"name": FTS_TABLE},
+    ).first()
+    connection.execute(text(_CREATE_TABLE_SQL))
+    for ddl in _TRIGGERS.values():
+        connection.execute(text(ddl))
+    if not exists:
+        rebuild_search_index(connection)
+
+def rebuild_search_index(connection: Connection) -> None:
+    """Repopulate the FTS table from scratch in one statement."""
+    connection.execute(text(f"DELETE FROM {FTS_TABLE}"))
+    connection.execute(text(
+        f"INSERT INTO {FTS_TABLE}(rowid, name, plot, synopsis, cast_names) "
+        f"SELECT m.id, m.name, m.plot, m.synopsis, {_CAST_NAMES_SQL.format(movie_id='m.id')} FROM movie m"
+    ))
+    connection.execute(text(f"INSERT INTO {FTS_TABLE}({FTS_TABLE}) VALUES ('optimize')"))
+
+def refresh_search_rows(connection: Connection, movie_ids: Iterable[int]) -> None:
+    """Rewrite the FTS rows of the given movies from their current data."""
+    ids = list(movie_ids)
+    delete = text(f"DELETE FROM {FTS_TABLE} WHERE rowid IN :ids")
+    insert = text(
+        f"INSERT INTO {FTS_TABLE}(rowid, name, plot, synopsis, cast_names) "
+        f"SELECT m.id, m.name, m.plot, m.synopsis, {_CAST_NAMES_SQL.format(movie_id='m.id')} "
+        "FROM movie m WHERE m.id IN :ids"
+    )
+    for start in range(0, len(ids), REFRESH_CHUNK):
+        chunk = ids[start:start + REFRESH_CHUNK]
+        connection.execute(delete.bindparams(bindparam("ids", chunk, expanding=True)))
+        connection.execute(insert.bindparams(bindparam("ids", chunk, expanding=True)))
+
+@contextmanager
+def suspended_sync(connection: Connection) -> Iterator[Set[int]]:
+    """
+    Drop the sync triggers for a bulk write and refresh the FTS rows of the
+    movie ids the caller adds to the yielded set once at the end, instead of
+    rewriting a movie's FTS row once per inserted cast link.
+
+    Use it inside a transaction: the trigger DDL is transactional in SQLite,
+    so a failed batch rolls back to the triggers being in place.
+    """
+    touched: Set[int] = set()
+    if connection.dialect.name != "sqlite":
+        yield touched
+        return
+    for name in _TRIGGERS:
+        connection.execute(text(f"DROP TRIGGER IF EXISTS {name}"))
+    yield touched
+    for ddl in _TRIGGERS.values():
+        connection.execute(text(ddl))
+    refresh_search_rows(connection, touched)
+
+# ======================= QUERYING =======================
+
+def build_match_query(search: str, prefix: bool = True, columns: Optional[Tuple[str, ...]] = None) -> Optional[str]:
+    """
+    Turn free user input into a safe FTS5 MATCH expression.
+
+    Every word is quoted so FTS5 operators in the input are taken literally;
+    with ``prefix`` the last word also matches as a prefix, for type-ahead.
+    """
+    tokens = re.findall(r"\w+", search, flags=re.UNICODE)
+    if not tokens:
+        return None
+    terms = [f'"{token}"' for token in tokens]
+    if prefix:
+        terms[-1] += "*"
+    expression = " ".join(terms)
+    if columns:
+        expression = f"{{{' '.join(columns)}}} : ({expression})"
+    return expression
+
+def match_clause(search: str, prefix: bool = False) -> ColumnElement[bool]:
+    """A WHERE clause restricting a Movie query to rows matching ``search``."""
+    expression = build_match_query(search, prefix=prefix)
+    if expression is None:
+        return Movie.id.in_([])
+    matches = text(f"SELECT rowid FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH :fts_query")
+    return Movie.id.in_(matches.bindparams(fts_query=expression).columns(column("rowid")))
+
+def search_movies(
+    db: Session,
+    search: str,
+    category: Optional[str] = None,
+    limit: int = 20,
+    offset: int = 0,
+    prefix: bool = True,
+    sort_by: Optional[str] = None,
+    descending: bool = False,
+) -> Tuple[List[Dict[str, Any]], int]:
+    """
+    Return ``(hits, total_count)``; hits are ``{"id", "score", "snippet"}``
+    ordered by bm25, or by ``sort_by`` (one of MOVIE_SORT_FIELDS) if given.
+    The snippet is HTML: escaped text with the matches in ``<mark>``.
+    """
+    expression = build_match_query(search, prefix=prefix)
+    if expression is None:
+        return [], 0
+    params: Dict[str, Any] = {"fts_query": expression, "limit": limit, "offset": offset}
+    category_sql = ""
+    if category:
+        category_sql = "AND m.category = :category"
+        params["category"] = category
+    order_sql = "score"
+    if sort_by in MOVIE_SORT_FIELDS:
+        direction = "DESC" if descending else "ASC"
+        order_sql = f"m.{sort_by} {direction}, m.id {direction}"
+    weights = ", ".join(str(weight) for weight in BM25_WEIGHTS)
+    rows = db.execute(text(f"""
+        SELECT {FTS_TABLE}.rowid AS id,
+               bm25({FTS_TABLE}, {weights}) AS score,
+               snippet({FTS_TABLE}, -1, '{MATCH_OPEN}', '{MATCH_CLOSE}', '…', {SNIPPET_TOKENS}) AS snippet
+        FROM {FTS_TABLE} JOIN movie m ON m.id = {FTS_TABLE}.rowid
+        WHERE {FTS_TABLE} MATCH :fts_query {category_sql}
+        ORDER BY {order_sql}
+        LIMIT :limit OFFSET :offset
+    """), params).mappings().all()
+    total = db.execute(text(f"""
+        SELECT count(*) FROM {FTS_TABLE} JOIN movie m ON m.id = {FTS_TABLE}.rowid
+        WHERE {FTS_TABLE} MATCH :fts_query {category_sql}
+    """), params).scalar_one()
+    return [{**row, "snippet": mark_matches(row["snippet"])} for row in rows], total
+
+def mark_matches(fts_text: Optional[str]) -> Optional[str]:
+    """HTML-escape FTS output, then turn its match markers into ``<mark>`` tags."""
+    if fts_text is None:
+        return None
+    return html.escape(fts_text).replace(MATCH_OPEN, HIGHLIGHT_OPEN).replace(MATCH_CLOSE, HIGHLIGHT_CLOSE)
+
+def suggest_titles(db: Session, search: str, limit: int = 10) -> List[Dict[str, Any]]:
+    """
+    Type-ahead: best title matches for a partial query, with ``highlighted``
+    the title as HTML (escaped, matches in ``<mark>``).
+
+    Every match is ranked before the limit applies, so a strong match is
+    never cut in favour of whichever ones the index returns first.
+    """
+    expression = build_match_query(search, prefix=True, columns=("name",))
+    if expression is None:
+        return []
+    rows = db.execute(text(f"""
+        SELECT rowid AS id, name,
+               highlight({FTS_TABLE}, 0, '{MATCH_OPEN}', '{MATCH_CLOSE}') AS highlighted
+        FROM {FTS_TABLE}
+        WHERE {FTS_TABLE} MATCH :fts_query
+        ORDER BY rank
+        LIMIT :limit
+    """), {"fts_query": expression, "limit": limit}).mappings().all()
+    return [{**row, "highlighted": mark_matches(row["highlighted"])} for row in rows]
@@ -12,12 +12,173 @@ Features:
 Design:
 - Structured for easy expansion and modification.
 - Intended to run with Uvicorn (a lightning-fast ASGI server).
-- Optimized for development environments with hot reloading enabled.
+- By default runs one process with hot reloading, for development.
+- ``--prod`` runs several worker processes without reloading. Work that only
+  needs doing once (schema setup, bcrypt calibration, the library watcher) is
+  done in the parent process before the workers start. uvloop and httptools
+  are used when installed. On SIGTERM or Ctrl+C, workers stop accepting
+  connections and give open streams ``SHUTDOWN_GRACE_PERIOD`` seconds to
+  finish.
+- Workers share state through the database only. Token revocations reach
+  every worker through ``auth_version`` (app/token_cache.py). Buffered watch
+  progress is only visible to other workers once flushed, so with several
+  workers it is flushed every ``MULTI_WORKER_FLUSH_INTERVAL`` seconds unless
+  ``WATCH_FLUSH_INTERVAL`` says otherwise.
+
+Usage:
+    python server.py                               # development
+    python server.py --prod --workers 4            # workers share the parent's socket
+    python server.py --prod --workers 4 --reuse-port  # each worker binds its own SO_REUSEPORT socket
 """
 # server.py
 # This script runs the FastAPI application using Uvicorn.
 
+import importlib.util
+import multiprocessing
+import os
+import signal
+import socket
+import time
+from typing import Any, Dict, List
+
+import typer
 import uvicorn as uv
 
+from app_config import (
+    BCRYPT_ROUNDS, BCRYPT_TARGET_MS, MOVIE_MEDIA_DIR, SERVER_HOST, SERVER_PORT, SERVER_WORKERS,
+    SHUTDOWN_GRACE_PERIOD, WATCH_LIBRARY,
+)
+
+cli = typer.Typer()
+
+# ================= Configuration =================
+APP: str = "app.app:app"
+SUPERVISE_INTERVAL: float = 0.5  # seconds between checks for crashed workers (--reuse-port)
+KILL_MARGIN: float = 5.0  # seconds past the grace period before a stuck worker is killed
+MULTI_WORKER_FLUSH_INTERVAL: float = 1.0  # default WATCH_FLUSH_INTERVAL with several workers
+
+
+def optional(module: str, fallback: str) -> str:
+    """``module`` (uvloop, httptools) if it is installed, else uvicorn's pure-Python ``fallback``."""
+    return module if importlib.util.find_spec(module) else fallback
+
+
+def prepare_workers():
+    """Run once in the parent what every worker would otherwise repeat; returns the library watcher, if any."""
+    from database import create_db_and_tables, engine
+
+    create_db_and_tables()
+    engine.dispose()
+    os.environ["SKIP_SCHEMA_SETUP"] = "1"
+    if not BCRYPT_ROUNDS:
+        from app.password_hasher import calibrated_rounds
+
+        rounds = calibrated_rounds(BCRYPT_TARGET_MS)
+        os.environ["BCRYPT_ROUNDS"] = str(rounds)
+        typer.secho(f"🔐 bcrypt cost {rounds} (target {BCRYPT_TARGET_MS:.0f} ms)", fg=typer.colors.BRIGHT_BLUE)
+    watcher = None
+    if WATCH_LIBRARY:
+        from jobs.movie.watcher import LibraryWatcher
+
+        # Workers notice the new catalog version on their own (CATALOG_RECHECK_INTERVAL).
+        watcher = LibraryWatcher(MOVIE_MEDIA_DIR)
+        watcher.start()
+        os.environ["WATCH_LIBRARY"] = "0"
+    return watcher
+
+
+def reuse_port_socket(host: str, port: int) -> socket.socket:
+    sock = socket.socket(socket.AF_INET6 if ":" in host else socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+    sock.bind((host, port))
+    return sock
+
+
+def serve_reuse_port(options: Dict[str, Any]) -> None:
+    """Worker entry point: its own listening socket, so the kernel balances connections across workers."""
+    server = uv.Server(uv.Config(APP, **options))
+    server.run(sockets=[reuse_port_socket(options["host"], options["port"])])
+
+
+def supervise_reuse_port(workers: int, options: Dict[str, Any]) -> None:
+    """Start ``workers`` processes, replace any that crash, and pass SIGINT/SIGTERM on as a graceful SIGTERM."""
+    context = multiprocessing.get_context("spawn")
+    stopping = False
+
+    def stop(signum, frame) -> None:
+        nonlocal stopping
+        stopping = True
+
+    def spawn():
+        process = context.Process(target=serve_reuse_port, args=(options,), name="velofy-worker")
+        process.start()
+        return process
+
+    signal.signal(signal.SIGINT, stop)
+    signal.signal(signal.SIGTERM, stop)
+    processes: List[Any] = [spawn() for _ in range(workers)]
+    while not stopping:
+        time.sleep(SUPERVISE_INTERVAL)
+        for index, process in enumerate(processes):
+            if not stopping and not process.is_alive():
+                typer.secho(f"⚠️  Worker {process.pid} exited with {process.exitcode}, restarting", fg=typer.colors.YELLOW)
+                processes[index] = spawn()
+
+    typer.secho(f"🛑 Draining {workers} workers (up to {SHUTDOWN_GRACE_PERIOD:g}s)...", fg=typer.colors.BRIGHT_BLUE)
+    for process in processes:
+        if process.is_alive():
+            os.kill(process.pid, signal.SIGTERM)
+    deadline = time.monotonic() + SHUTDOWN_GRACE_PERIOD + KILL_MARGIN
+    for process in processes:
+        process.join(max(0.0, deadline - time.monotonic()))
+        if process.is_alive():
+            process.kill()
+
+
+@cli.command()
+def main(
+    prod: bool = typer.Option(False, "--prod", help="Run several worker processes without auto-reload."),
+    workers: int = typer.Option(SERVER_WORKERS, help="Worker processes with --prod (0: one per CPU)."),
+    reuse_port: bool = typer.Option(False, "--reuse-port", help="With --prod, give each worker its own SO_REUSEPORT socket."),
+    host: str = typer.Option(SERVER_HOST, help="Address to listen on."),
+    port: int = typer.Option(SERVER_PORT, help="Port to listen on."),
+):
+    if not prod:
+        uv.run(APP, host=host, port=port, reload=True)
+        return
+
+    workers = workers or os.cpu_count() or 1
+    if reuse_port and not hasattr(socket, "SO_REUSEPORT"):
+        raise typer.BadParameter("SO_REUSEPORT is not available on this platform", param_hint="--reuse-port")
+    options: Dict[str, Any] = {
+        "host": host,
+        "port": port,
+        "loop": optional("uvloop", "asyncio"),
+        "http": optional("httptools", "h11"),
+        "timeout_graceful_shutdown": SHUTDOWN_GRACE_PERIOD,
+    }
+    mode = "SO_REUSEPORT" if reuse_port and workers > 1 else "shared socket"
+    typer.secho(
+        f"🚀 {workers} worker(s) on {host}:{port} ({mode}, loop {options['loop']}, http {options['http']})",
+        fg=typer.colors.BRIGHT_GREEN,
+    )
+    if workers == 1:
+        uv.run(APP, **options)  # the lifespan does the one-off setup itself
+        return
+
+    # Other workers only see buffered watch progress once it is flushed; keep that lag short.
+    os.environ.setdefault("WATCH_FLUSH_INTERVAL", str(MULTI_WORKER_FLUSH_INTERVAL))
+    watcher = prepare_workers()
+    try:
+        if reuse_port:
+            supervise_reuse_port(workers, options)
+        else:
+            uv.run(APP, workers=workers, **options)
+    finally:
+        if watcher is not None:
+            watcher.stop()
+
+
 if __name__ == "__main__":
-    uv.run("app.app:app", host="0.0.0.0", port=8000, reload=True)
\ No newline at end of file
+    cli()